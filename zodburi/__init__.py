@@ -1,6 +1,14 @@
 from importlib.metadata import entry_points
 import re
 
+from zodburi.cachesize import cache_size_hook
+from zodburi.databases import DatabaseMapping
+from zodburi.datatypes import convert_bytesize
+from zodburi.datatypes import convert_int
+from zodburi.monitor import monitor_hook
+from zodburi.proxy import StorageProxy
+from zodburi.template import expand_uri
+
 CONNECTION_PARAMETERS = (
     "pool_size",
     "pool_timeout",
@@ -24,6 +32,36 @@ PARAMETERS = dict(
     [(f"connection_{parm}", parm) for parm in CONNECTION_PARAMETERS]
 )
 
+# Query string parameters, accepted by every scheme, which wrap the
+# storage factory in a 'zodburi.proxy.StorageProxy'.
+PROXY_PARAMETERS = dict(
+    lazy=convert_int,
+    background=convert_int,
+    fork_safe=convert_int,
+)
+
+# Query string parameters, accepted by every scheme, which configure a
+# 'zodburi.monitor.monitor_hook' for the databases created from the dbkw.
+MONITOR_PARAMETERS = dict(
+    activity_monitor=convert_int,
+    activity_monitor_history=int,
+    metrics_file=str,
+    metrics_socket=str,
+    metrics_interval=float,
+)
+
+# Query string parameters, accepted by every scheme, which configure a
+# 'zodburi.cachesize.cache_size_hook' for the databases created from the
+# dbkw.
+ADAPTIVE_CACHE_PARAMETERS = dict(
+    adaptive_cache=convert_int,
+    adaptive_cache_min=int,
+    adaptive_cache_max=int,
+    adaptive_cache_max_rss=convert_bytesize,
+    adaptive_cache_interval=float,
+    adaptive_cache_idle=float,
+)
+
 HAS_UNITS_RE = re.compile(r"\s*(\d+)\s*([kmg])b\s*$")
 UNITS = dict(k=1<<10, m=1<<20, g=1<<30)
 
@@ -54,13 +92,36 @@ def resolve_uri(uri):
     Returns a tuple, (factory, dbkw) where factory is a no-arg callable which
     returns a storage matching the spec defined in the uri.  dbkw is a dict of
     keyword arguments that may be passed to ZODB.DB.DB.
+
+    Placeholders in the uri, such as '{worker_id}', are first expanded (see
+    'zodburi.template.expand_uri').
     """
-    factory, dbkw = _get_uri_factory_and_dbkw(uri)
+    factory, dbkw = _get_uri_factory_and_dbkw(expand_uri(uri))
+    factory = _get_proxy_factory(factory, dbkw)
     return factory, _get_dbkw(dbkw)
 
 
-def _get_uri_factory_and_dbkw(uri):
-    """Return factory and original raw dbkw for a URI."""
+def canonicalize(uri):
+    """
+    Returns the canonical form of the uri, so that uris which resolve to the
+    same storage and dbkw compare equal:  paths are normalized, default ports
+    made explicit, and query string parameters converted to canonical values
+    and sorted.
+
+    Resolvers take part by providing a 'canonicalize(uri)' method;  uris for
+    schemes whose resolvers do not are returned unchanged.
+    """
+    resolver = _get_resolver(uri)
+    hook = getattr(resolver, "canonicalize", None)
+
+    if hook is None:
+        return uri
+
+    return hook(uri)
+
+
+def _get_resolver(uri):
+    """Return the resolver registered for the scheme of a URI."""
     scheme = uri[:uri.find(":")]
     try:
         resolver_eps = entry_points(group="zodburi.resolvers")
@@ -69,13 +130,18 @@ def _get_uri_factory_and_dbkw(uri):
 
     for ep in resolver_eps:
         if ep.name == scheme:
-            resolver = ep.load()
-            factory, dbkw = resolver(uri)
-            return factory, dbkw
+            return ep.load()
     else:
         raise NoResolverForScheme(uri)
 
 
+def _get_uri_factory_and_dbkw(uri):
+    """Return factory and original raw dbkw for a URI."""
+    resolver = _get_resolver(uri)
+    factory, dbkw = resolver(uri)
+    return factory, dbkw
+
+
 _resolve_uri = _get_uri_factory_and_dbkw  # pragma: noqa  BBB alias
 
 
@@ -89,9 +155,77 @@ def _parse_bytes(s):
         return int(s)
 
 
+def _pop_parameters(kw, parameters):
+    """Pop 'parameters', converted, from 'kw' into a new dict."""
+    popped = {}
+
+    for parameter, convert in parameters.items():
+        if parameter in kw:
+            popped[parameter] = convert(kw.pop(parameter))
+
+    return popped
+
+
+def _get_proxy_factory(factory, kw):
+    """Wrap 'factory' per the proxy parameters popped from 'kw'."""
+    proxykw = _pop_parameters(kw, PROXY_PARAMETERS)
+
+    if not any(proxykw.values()):
+        return factory
+
+    def proxy_factory():
+        return StorageProxy(factory, **proxykw)
+
+    return proxy_factory
+
+
+def _canonicalize_dbkw(kw):
+    """Return 'kw', raw dbkw, with values of known parameters in canonical
+    string form.
+    """
+    canonical = {}
+
+    for parameter, v in kw.items():
+        if parameter in PROXY_PARAMETERS:
+            v = PROXY_PARAMETERS[parameter](v)
+        elif parameter in MONITOR_PARAMETERS:
+            v = MONITOR_PARAMETERS[parameter](v)
+        elif parameter in ADAPTIVE_CACHE_PARAMETERS:
+            v = ADAPTIVE_CACHE_PARAMETERS[parameter](v)
+        elif PARAMETERS.get(parameter) in BYTES_PARAMETERS:
+            v = _parse_bytes(v)
+        elif parameter.startswith("connection_") and parameter in PARAMETERS:
+            v = int(v)
+        canonical[parameter] = str(v)
+
+    return canonical
+
+
+def _add_database_hook(dbkw, hook):
+    """Have 'hook' called with each database created from 'dbkw'."""
+    databases = dbkw.get("databases")
+
+    if not isinstance(databases, DatabaseMapping):
+        # Databases created from 'dbkw' join the resolver's mapping, if any.
+        databases = dbkw["databases"] = DatabaseMapping(databases=databases)
+
+    databases.hooks.append(hook)
+
+
 def _get_dbkw(kw):
     dbkw = _DEFAULT_DBKW.copy()
 
+    monitorkw = _pop_parameters(kw, MONITOR_PARAMETERS)
+    cachekw = _pop_parameters(kw, ADAPTIVE_CACHE_PARAMETERS)
+
+    # A multi-database mapping supplied by the resolver, never by a query
+    # string.
+    if "databases" in kw:
+        databases = kw.pop("databases")
+        if isinstance(databases, str):
+            raise UnknownDatabaseKeywords({"databases": databases})
+        dbkw["databases"] = databases
+
     for parameter in PARAMETERS:
         if parameter in kw:
             v = kw.pop(parameter)
@@ -106,4 +240,11 @@ def _get_dbkw(kw):
     if kw:
         raise UnknownDatabaseKeywords(kw)
 
+    if (monitorkw.get("activity_monitor") or "metrics_file" in monitorkw
+            or "metrics_socket" in monitorkw):
+        _add_database_hook(dbkw, monitor_hook(**monitorkw))
+
+    if cachekw.get("adaptive_cache"):
+        _add_database_hook(dbkw, cache_size_hook(**cachekw))
+
     return dbkw
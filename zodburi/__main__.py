@@ -0,0 +1,220 @@
+import argparse
+import json
+import sys
+
+from zodburi import backup
+from zodburi import migrate
+from zodburi import simulate
+from zodburi import stats
+from zodburi.datatypes import convert_bytesize
+
+
+def _run(args, verb, func, *func_args, **kw):
+    # Call 'func', reporting its progress and final stats on stderr.
+    def report(stats):
+        print(f"{verb} {stats}", file=sys.stderr)
+
+    stats = func(
+        *func_args, report=None if args.quiet else report,
+        report_interval=args.report_interval, **kw)
+    if not args.quiet:
+        report(stats)
+    return 0
+
+
+def _copy(args):
+    return _run(
+        args, "copied", migrate.copy, args.source, args.destination,
+        blob_workers=args.blob_workers,
+        queue_size=args.queue_size,
+    )
+
+
+def _backup(args):
+    return _run(
+        args, "backed up", backup.backup, args.uri, args.directory,
+        segment_size=args.segment_size,
+    )
+
+
+def _restore(args):
+    return _run(
+        args, "restored", backup.restore, args.directory, args.uri)
+
+
+def _stats(args):
+    storage_stats = stats.analyze(args.uri, workers=args.workers)
+    if args.json:
+        json.dump(
+            storage_stats.as_dict(args.cache_budget), sys.stdout, indent=2)
+        print()
+    else:
+        print(stats.format_stats(storage_stats, args.cache_budget, args.top))
+    return 0
+
+
+def _simulate(args):
+    results = simulate.simulate(
+        args.trace, counts=args.counts, sizes=args.sizes,
+        rearrange=args.rearrange, zeo=args.zeo)
+    if args.json:
+        json.dump(results.as_dict(args.tolerance), sys.stdout, indent=2)
+        print()
+    else:
+        print(simulate.format_results(results, args.tolerance))
+    return 0
+
+
+def _list_of(convert):
+    def convert_list(value):
+        return [convert(item) for item in value.split(",") if item]
+    return convert_list
+
+
+def _add_report_arguments(parser):
+    parser.add_argument(
+        "--report-interval", type=float, metavar="SECONDS",
+        default=migrate.DEFAULT_REPORT_INTERVAL,
+        help="seconds between progress reports (default: %(default)s)")
+    parser.add_argument(
+        "-q", "--quiet", action="store_true",
+        help="do not report progress and throughput")
+
+
+def _make_parser():
+    parser = argparse.ArgumentParser(
+        prog="python -m zodburi",
+        description="Tools for the storages at zodburi URIs.",
+    )
+    commands = parser.add_subparsers(
+        title="commands", dest="command", required=True)
+
+    copy_parser = commands.add_parser(
+        "copy",
+        help="copy the transactions of one storage to another",
+        description=(
+            "Copy the transactions of the storage at SOURCE to the one at "
+            "DESTINATION, preserving transaction ids.  The copy resumes "
+            "after the last transaction of DESTINATION, so an interrupted "
+            "copy may be run again."
+        ),
+    )
+    copy_parser.add_argument(
+        "source", metavar="SOURCE", help="source storage URI")
+    copy_parser.add_argument(
+        "destination", metavar="DESTINATION", help="destination storage URI")
+    copy_parser.add_argument(
+        "--blob-workers", type=int, metavar="N",
+        default=migrate.DEFAULT_BLOB_WORKERS,
+        help="threads fetching blob files (default: %(default)s)")
+    copy_parser.add_argument(
+        "--queue-size", type=int, metavar="N",
+        default=migrate.DEFAULT_QUEUE_SIZE,
+        help="transactions read ahead of the writer (default: %(default)s)")
+    _add_report_arguments(copy_parser)
+    copy_parser.set_defaults(func=_copy)
+
+    backup_parser = commands.add_parser(
+        "backup",
+        help="back up the transactions of a storage incrementally",
+        description=(
+            "Back up the transactions of the storage at URI committed since "
+            "the last backup in DIRECTORY, as compressed, checksummed "
+            "segments."
+        ),
+    )
+    backup_parser.add_argument("uri", metavar="URI", help="storage URI")
+    backup_parser.add_argument(
+        "directory", metavar="DIRECTORY", help="backup directory")
+    backup_parser.add_argument(
+        "--segment-size", type=convert_bytesize, metavar="SIZE",
+        default=backup.DEFAULT_SEGMENT_SIZE,
+        help="uncompressed size of segments, e.g. 64mb (default: 64mb)")
+    _add_report_arguments(backup_parser)
+    backup_parser.set_defaults(func=_backup)
+
+    restore_parser = commands.add_parser(
+        "restore",
+        help="restore a backup into a storage",
+        description=(
+            "Restore the transactions backed up in DIRECTORY into the "
+            "storage at URI, after its last transaction."
+        ),
+    )
+    restore_parser.add_argument(
+        "directory", metavar="DIRECTORY", help="backup directory")
+    restore_parser.add_argument("uri", metavar="URI", help="storage URI")
+    _add_report_arguments(restore_parser)
+    restore_parser.set_defaults(func=_restore)
+
+    stats_parser = commands.add_parser(
+        "stats",
+        help="report object statistics of a storage",
+        description=(
+            "Scan the storage at URI and report the count and sizes of its "
+            "current objects by class, its blobs, and recommended "
+            "connection cache parameters."
+        ),
+    )
+    stats_parser.add_argument("uri", metavar="URI", help="storage URI")
+    stats_parser.add_argument(
+        "--workers", type=int, metavar="N",
+        help="processes scanning file:// storages (default: CPU count)")
+    stats_parser.add_argument(
+        "--cache-budget", type=convert_bytesize, metavar="SIZE",
+        default=stats.DEFAULT_CACHE_BUDGET,
+        help="memory per connection cache, e.g. 256mb (default: 256mb)")
+    stats_parser.add_argument(
+        "--top", type=int, metavar="N", default=20,
+        help="classes listed, by total size (default: %(default)s)")
+    stats_parser.add_argument(
+        "--json", action="store_true",
+        help="report all statistics, with per-class histograms, as JSON")
+    stats_parser.set_defaults(func=_stats)
+
+    simulate_parser = commands.add_parser(
+        "simulate",
+        help="simulate caches of various sizes from an access trace",
+        description=(
+            "Replay the access trace at TRACE, written by the trace: scheme "
+            "or a ZEO client cache trace, through LRU and ZEO client caches "
+            "of various sizes, and report their hit rates and recommended "
+            "cache parameters."
+        ),
+    )
+    simulate_parser.add_argument(
+        "trace", metavar="TRACE", help="trace file")
+    simulate_parser.add_argument(
+        "--counts", type=_list_of(int), metavar="N,...",
+        default=simulate.DEFAULT_COUNTS,
+        help="LRU cache sizes, in objects (default: 1024 to 1048576)")
+    simulate_parser.add_argument(
+        "--sizes", type=_list_of(convert_bytesize), metavar="SIZE,...",
+        default=simulate.DEFAULT_SIZES,
+        help="LRU and ZEO cache sizes, e.g. 64mb,1gb (default: 1mb to 4gb)")
+    simulate_parser.add_argument(
+        "--rearrange", type=float, metavar="RATIO",
+        default=simulate.DEFAULT_REARRANGE,
+        help="ZEO cache rearrange ratio (default: %(default)s)")
+    simulate_parser.add_argument(
+        "--no-zeo", dest="zeo", action="store_false",
+        help="only simulate LRU caches")
+    simulate_parser.add_argument(
+        "--tolerance", type=float, metavar="RATE",
+        default=simulate.DEFAULT_TOLERANCE,
+        help="hit rate a recommended size may lose to the largest "
+             "(default: %(default)s)")
+    simulate_parser.add_argument(
+        "--json", action="store_true", help="report the results as JSON")
+    simulate_parser.set_defaults(func=_simulate)
+
+    return parser
+
+
+def main(argv=None):
+    args = _make_parser().parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":  # pragma: NO COVER
+    sys.exit(main())
@@ -0,0 +1,414 @@
+import collections
+import gzip
+import hashlib
+import os
+import struct
+import tempfile
+import time
+
+from ZODB.blob import is_blob_record
+from ZODB.Connection import TransactionMetaData
+from ZODB.interfaces import IBlobStorage
+from ZODB.POSException import POSKeyError
+from ZODB.utils import p64
+from ZODB.utils import u64
+from ZODB.utils import z64
+
+from zodburi.migrate import CopyStats
+from zodburi.migrate import DEFAULT_REPORT_INTERVAL
+from zodburi.migrate import DestinationNotRestorable
+from zodburi.migrate import DestinationWithoutBlobs
+from zodburi.stats import _read_only_uri
+
+
+DEFAULT_SEGMENT_SIZE = 64 << 20
+INDEX_NAME = "index"
+SEGMENT_SUFFIX = ".seg.gz"
+CHUNK_SIZE = 1 << 20
+
+# Segments are gzip-compressed streams of transactions:  a transaction
+# header, its records, each followed by its blob (if any), then an end
+# marker.
+TRANSACTION = b"T"
+RECORD = b"R"
+END = b"E"
+# tid, status (a single ASCII character)
+TRANSACTION_HEADER = struct.Struct(">8sc")
+# oid, tid, has data_txn, data_txn, data length (-1 for None)
+RECORD_HEADER = struct.Struct(">8s8s?8sq")
+# blob length (-1 for none)
+BLOB_HEADER = struct.Struct(">q")
+LENGTH = struct.Struct(">I")
+
+Segment = collections.namedtuple(
+    "Segment", ["name", "first", "last", "checksum"])
+
+
+class InvalidBackup(ValueError):
+    def __init__(self, path, why):
+        self.path = path
+        self.why = why
+        super().__init__(f"Invalid backup segment {path!r}: {why}")
+
+
+def read_index(directory):
+    """Return the list of :class:`Segment` (name, first tid, last tid,
+    SHA-256 checksum) of the backup in 'directory', oldest first.
+    """
+    path = os.path.join(directory, INDEX_NAME)
+    if not os.path.exists(path):
+        return []
+
+    segments = []
+    with open(path) as f:
+        for line in f:
+            name, first, last, checksum = line.split()
+            segments.append(Segment(
+                name, p64(int(first, 16)), p64(int(last, 16)), checksum))
+    return segments
+
+
+def last_backed_up(directory):
+    """Return the id of the last transaction backed up in 'directory',
+    or None if there is none.
+    """
+    segments = read_index(directory)
+    return segments[-1].last if segments else None
+
+
+class _HashingFile:
+    # Write-only file computing the SHA-256 of what is written to it.
+
+    def __init__(self, f):
+        self._f = f
+        self.sha256 = hashlib.sha256()
+
+    def write(self, data):
+        self.sha256.update(data)
+        return self._f.write(data)
+
+    def flush(self):
+        self._f.flush()
+
+
+class _SegmentWriter:
+
+    def __init__(self, directory):
+        self.directory = directory
+        fd, self.tmp_path = tempfile.mkstemp(
+            prefix="segment-", suffix=".tmp", dir=directory)
+        self._file = os.fdopen(fd, "wb")
+        self._hashing = _HashingFile(self._file)
+        self._gzip = gzip.GzipFile(fileobj=self._hashing, mode="wb")
+        self.size = 0
+        self.first = self.last = None
+
+    def write(self, data):
+        self.size += len(data)
+        self._gzip.write(data)
+
+    def commit(self):
+        # Close the segment and add it to the index.
+        self._gzip.close()
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+
+        segment = Segment(
+            f"{u64(self.first):016x}-{u64(self.last):016x}{SEGMENT_SUFFIX}",
+            self.first, self.last, self._hashing.sha256.hexdigest())
+        os.replace(self.tmp_path, os.path.join(self.directory, segment.name))
+        with open(os.path.join(self.directory, INDEX_NAME), "a") as f:
+            f.write(
+                f"{segment.name} {u64(segment.first):016x} "
+                f"{u64(segment.last):016x} {segment.checksum}\n")
+            f.flush()
+            os.fsync(f.fileno())
+        return segment
+
+    def discard(self):
+        self._gzip.close()
+        self._file.close()
+        os.remove(self.tmp_path)
+
+
+def _write_bytes(out, data):
+    out.write(LENGTH.pack(len(data)))
+    out.write(data)
+
+
+def _write_blob(out, source, oid, tid):
+    try:
+        filename = source.loadBlob(oid, tid)
+    except POSKeyError:
+        out.write(BLOB_HEADER.pack(-1))
+        return None
+
+    with open(filename, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        out.write(BLOB_HEADER.pack(size))
+        remaining = size
+        while remaining:
+            chunk = f.read(min(remaining, CHUNK_SIZE))
+            if not chunk:
+                raise ValueError(f"Blob file {filename!r} shrank while read")
+            out.write(chunk)
+            remaining -= len(chunk)
+    return size
+
+
+def backup_storage(storage, directory, segment_size=DEFAULT_SEGMENT_SIZE,
+                   report=None, report_interval=DEFAULT_REPORT_INTERVAL):
+    """Back up the transactions of 'storage' committed since the last
+    backup in 'directory', and return a :class:`zodburi.migrate.CopyStats`.
+
+    Transactions are streamed from the storage's iterator, with their blobs,
+    into gzip-compressed segments of about 'segment_size' uncompressed
+    bytes, so only one record (or blob chunk) is held in memory at a time.
+    Each segment is added, with its SHA-256 checksum, to the backup's index
+    once complete:  an interrupted backup resumes after the last complete
+    segment.  If not None, 'report' is called with the stats every
+    'report_interval' seconds.
+    """
+    os.makedirs(directory, exist_ok=True)
+    last = last_backed_up(directory)
+    start = None if last is None else p64(u64(last) + 1)
+    blobs = IBlobStorage.providedBy(storage)
+    stats = CopyStats(start)
+    next_report = time.monotonic() + report_interval
+    segment = None
+
+    try:
+        for txn in storage.iterator(start):
+            if segment is None:
+                segment = _SegmentWriter(directory)
+                segment.first = txn.tid
+
+            metadata = TransactionMetaData(
+                txn.user, txn.description, txn.extension)
+            segment.write(TRANSACTION)
+            segment.write(TRANSACTION_HEADER.pack(
+                txn.tid, txn.status.encode("ascii")))
+            _write_bytes(segment, metadata.user)
+            _write_bytes(segment, metadata.description)
+            _write_bytes(segment, metadata.extension_bytes)
+
+            for record in txn:
+                data = record.data
+                segment.write(RECORD)
+                segment.write(RECORD_HEADER.pack(
+                    record.oid, record.tid, record.data_txn is not None,
+                    record.data_txn or z64, -1 if data is None else len(data),
+                ))
+                if data is not None:
+                    segment.write(data)
+                    stats.bytes += len(data)
+                if blobs and is_blob_record(data):
+                    size = _write_blob(
+                        segment, storage, record.oid, record.tid)
+                    if size is not None:
+                        stats.blobs += 1
+                        stats.blob_bytes += size
+                else:
+                    segment.write(BLOB_HEADER.pack(-1))
+                stats.records += 1
+
+            segment.write(END)
+            segment.last = stats.last_tid = txn.tid
+            stats.transactions += 1
+
+            if segment.size >= segment_size:
+                segment.commit()
+                segment = None
+
+            if report is not None and time.monotonic() >= next_report:
+                report(stats)
+                next_report = time.monotonic() + report_interval
+
+        if segment is not None:
+            segment.commit()
+            segment = None
+    finally:
+        if segment is not None:
+            segment.discard()
+
+    return stats
+
+
+def _verify(path, checksum):
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            sha256.update(chunk)
+    if sha256.hexdigest() != checksum:
+        raise InvalidBackup(path, "checksum mismatch")
+
+
+def _read(f, size, path):
+    data = f.read(size)
+    if len(data) != size:
+        raise InvalidBackup(path, "truncated")
+    return data
+
+
+def _read_bytes(f, path):
+    size, = LENGTH.unpack(_read(f, LENGTH.size, path))
+    return _read(f, size, path)
+
+
+def _read_blob(f, path, directory):
+    # Copy the blob at the current position of 'f' to a temporary file in
+    # 'directory' and return its name, or skip it if 'directory' is None.
+    size, = BLOB_HEADER.unpack(_read(f, BLOB_HEADER.size, path))
+    if size < 0:
+        return None
+
+    if directory is None:
+        while size:
+            size -= len(_read(f, min(size, CHUNK_SIZE), path))
+        return None
+
+    fd, name = tempfile.mkstemp(
+        prefix="zodburi-restore-", suffix=".tmp", dir=directory)
+    with os.fdopen(fd, "wb") as out:
+        remaining = size
+        while remaining:
+            chunk = _read(f, min(remaining, CHUNK_SIZE), path)
+            out.write(chunk)
+            remaining -= len(chunk)
+    return name
+
+
+def _restore_segment(path, storage, last, stats):
+    blob_dir = None
+    if IBlobStorage.providedBy(storage):
+        blob_dir = storage.temporaryDirectory()
+
+    with gzip.open(path, "rb") as f:
+        while True:
+            marker = f.read(1)
+            if not marker:
+                break
+            if marker != TRANSACTION:
+                raise InvalidBackup(path, "expected a transaction")
+
+            tid, status = TRANSACTION_HEADER.unpack(
+                _read(f, TRANSACTION_HEADER.size, path))
+            status = status.decode("ascii")
+            metadata = TransactionMetaData(
+                _read_bytes(f, path), _read_bytes(f, path),
+                _read_bytes(f, path))
+            skip = tid <= last
+            if not skip:
+                storage.tpc_begin(metadata, tid, status)
+            try:
+                _restore_records(
+                    f, path, storage, metadata, None if skip else blob_dir,
+                    skip, stats)
+                if not skip:
+                    storage.tpc_vote(metadata)
+                    storage.tpc_finish(metadata)
+            except BaseException:
+                if not skip:
+                    storage.tpc_abort(metadata)
+                raise
+
+            if not skip:
+                stats.transactions += 1
+                stats.last_tid = tid
+
+
+def _restore_records(f, path, storage, metadata, blob_dir, skip, stats):
+    while True:
+        marker = _read(f, 1, path)
+        if marker == END:
+            return
+        if marker != RECORD:
+            raise InvalidBackup(path, "expected a record")
+
+        oid, tid, has_data_txn, data_txn, size = RECORD_HEADER.unpack(
+            _read(f, RECORD_HEADER.size, path))
+        data = None if size < 0 else _read(f, size, path)
+        data_txn = data_txn if has_data_txn else None
+        blob = _read_blob(f, path, blob_dir)
+        if skip:
+            continue
+
+        if blob is not None:
+            stats.blobs += 1
+            stats.blob_bytes += os.path.getsize(blob)
+            storage.restoreBlob(oid, tid, data, blob, data_txn, metadata)
+        elif blob_dir is None and is_blob_record(data):
+            raise DestinationWithoutBlobs(storage)
+        else:
+            storage.restore(oid, tid, data, '', data_txn, metadata)
+        stats.records += 1
+        stats.bytes += len(data or b'')
+
+
+def restore_storage(directory, storage, report=None,
+                    report_interval=DEFAULT_REPORT_INTERVAL):
+    """Restore the transactions backed up in 'directory' into 'storage',
+    with their original transaction ids, and return a
+    :class:`zodburi.migrate.CopyStats`.
+
+    Transactions already in the storage (up to its last transaction) are
+    skipped, so an interrupted restore may simply be run again.  Each
+    segment's checksum is verified before any of its transactions are
+    restored.  If not None, 'report' is called with the stats after each
+    segment, at most every 'report_interval' seconds.
+    """
+    if not hasattr(storage, 'restore'):
+        raise DestinationNotRestorable(storage)
+
+    last = storage.lastTransaction()
+    stats = CopyStats()
+    next_report = time.monotonic() + report_interval
+
+    for segment in read_index(directory):
+        if segment.last <= last:
+            continue
+        path = os.path.join(directory, segment.name)
+        _verify(path, segment.checksum)
+        _restore_segment(path, storage, last, stats)
+
+        if report is not None and time.monotonic() >= next_report:
+            report(stats)
+            next_report = time.monotonic() + report_interval
+
+    return stats
+
+
+def _open_storage(uri):
+    from zodburi import resolve_uri
+
+    factory, _ = resolve_uri(uri)
+    return factory()
+
+
+def backup(uri, directory, **kw):
+    """Back up the storage at 'uri' to 'directory' (see
+    :func:`backup_storage`, which takes the keyword arguments).
+
+    ``file://`` and ``zeo://`` storages are opened read-only, so that a
+    storage in use may be backed up.
+    """
+    storage = _open_storage(_read_only_uri(uri))
+    try:
+        return backup_storage(storage, directory, **kw)
+    finally:
+        storage.close()
+
+
+def restore(directory, uri, **kw):
+    """Restore the backup in 'directory' into the storage at 'uri' (see
+    :func:`restore_storage`, which takes the keyword arguments).
+    """
+    storage = _open_storage(uri)
+    try:
+        return restore_storage(directory, storage, **kw)
+    finally:
+        storage.close()
@@ -0,0 +1,86 @@
+import mmap
+import os
+
+
+SENDFILE_CHUNK_SIZE = 1 << 30
+
+
+def blob_path(blob):
+    """Return the path of the file holding the committed data of 'blob',
+    a ``ZODB.blob.Blob`` loaded from a storage with blobs.
+
+    The file must only be read:  it is shared by all connections, and
+    belongs to the storage (or, for ZEO, its blob cache).  Raises
+    ``ZODB.interfaces.BlobError`` if the blob has uncommitted changes.
+    """
+    blob._p_activate()
+    return blob.committed()
+
+
+def blob_size(blob):
+    """Return the size, in bytes, of the committed data of 'blob'."""
+    return os.path.getsize(blob_path(blob))
+
+
+def blob_mmap(blob):
+    """Return a read-only memory map of the committed data of 'blob'.
+
+    Slicing the map, or a ``memoryview`` of it, reads the file's pages
+    without copying them through a Python file object.  An empty blob
+    can't be mapped:  an empty ``bytes`` is returned instead.
+    """
+    with open(blob_path(blob), "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return b""
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def blob_sendfile(blob, out_fd, offset=0, count=None):
+    """Send the committed data of 'blob', from 'offset', to the file
+    descriptor 'out_fd' (e.g. a socket's ``fileno()``), using
+    ``os.sendfile`` to copy it in the kernel.
+
+    Send at most 'count' bytes (by default, up to the end of the data);
+    return the number of bytes sent.
+    """
+    with open(blob_path(blob), "rb") as f:
+        in_fd = f.fileno()
+        end = os.fstat(in_fd).st_size
+        if count is not None:
+            end = min(end, offset + count)
+
+        sent = 0
+        while offset < end:
+            n = os.sendfile(
+                out_fd, in_fd, offset, min(end - offset, SENDFILE_CHUNK_SIZE))
+            if n == 0:
+                break
+            offset += n
+            sent += n
+
+    return sent
+
+
+def blob_file_wrapper(blob, environ, block_size=8192):
+    """Return a WSGI response iterable for the committed data of 'blob'.
+
+    Uses the server's ``wsgi.file_wrapper`` where available, which servers
+    typically implement with ``os.sendfile``;  otherwise, reads the file
+    in blocks of 'block_size' bytes.
+    """
+    f = open(blob_path(blob), "rb")
+    file_wrapper = environ.get("wsgi.file_wrapper")
+
+    if file_wrapper is not None:
+        return file_wrapper(f, block_size)
+
+    return _iter_file(f, block_size)
+
+
+def _iter_file(f, block_size):
+    with f:
+        while True:
+            block = f.read(block_size)
+            if not block:
+                break
+            yield block
@@ -0,0 +1,151 @@
+import os
+import time
+import weakref
+
+from zodburi.databases import PeriodicDatabaseTask
+
+
+DEFAULT_INTERVAL = 30.0
+DEFAULT_IDLE = 300.0
+
+# A cache is full once its non-ghost objects reach this fraction of the
+# target size:  only then do misses say anything about the target.
+FULL_RATIO = 0.9
+
+# Grow a full cache's target when the objects loaded from the storage over
+# an interval reach this fraction of it;  shrink it when they stay below
+# this other one.
+GROW_MISS_RATIO = 0.1
+SHRINK_MISS_RATIO = 0.01
+
+GROW_FACTOR = 1.5
+SHRINK_FACTOR = 0.9
+# Shrink factor when the process is over its RSS limit.
+RSS_SHRINK_FACTOR = 0.75
+
+
+def current_rss():
+    """Return the resident set size of this process, in bytes, or None if
+    it cannot be determined (outside Linux).
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            resident_pages = int(f.read().split()[1])
+    except (OSError, IndexError, ValueError):
+        return None
+
+    return resident_pages * os.sysconf("SC_PAGE_SIZE")
+
+
+class CacheSizeController(PeriodicDatabaseTask):
+    """Adjust the connection cache size targets of databases to their load.
+
+    Every 'interval' seconds, for each database:
+
+    - if the process' resident set size exceeds 'max_rss' bytes, the target
+      is shrunk, and the caches of all idle connections minimized;
+    - otherwise, if the connections' caches are full and the objects they
+      loaded from the storage (cache misses) since the last adjustment
+      reach a tenth of the target, the target is grown;  if misses stay
+      below a hundredth of it, it is shrunk, evicting cold objects.
+
+    Targets stay between 'min_size' and 'max_size' objects (by default a
+    quarter of, and four times, each database's configured cache size).  A
+    configured byte size target is scaled along.  Connections idle in the
+    pool for more than 'idle' seconds have their caches minimized.
+    """
+    name = "zodburi cache size controller"
+
+    def __init__(self, interval=DEFAULT_INTERVAL, min_size=None,
+                 max_size=None, max_rss=None, idle=DEFAULT_IDLE):
+        super().__init__(interval)
+        self.min_size = min_size
+        self.max_size = max_size
+        self.max_rss = max_rss
+        self.idle = idle
+        self._bounds = weakref.WeakKeyDictionary()
+        self._load_counts = weakref.WeakKeyDictionary()
+
+    def add(self, db):
+        size = db.getCacheSize()
+        min_size = self.min_size if self.min_size is not None else size // 4
+        max_size = self.max_size if self.max_size is not None else size * 4
+        self._bounds[db] = (max(min_size, 1), max(max_size, min_size, 1))
+        super().add(db)
+
+    def adjust(self):
+        """Adjust the databases now;  return False if all are closed."""
+        return self.run()
+
+    def run_once(self, dbs):
+        rss = current_rss()
+        over_rss = (
+            self.max_rss is not None and rss is not None and rss > self.max_rss
+        )
+
+        for db in dbs:
+            self._adjust(db, over_rss)
+
+    def _adjust(self, db, over_rss):
+        size = db.getCacheSize()
+        min_size, max_size = self._bounds[db]
+        misses = 0
+        fullest = 0
+
+        def measure(conn):
+            nonlocal misses, fullest
+            loads, _ = conn.getTransferCounts()
+            # Activity monitors clear the counts when connections close.
+            last = self._load_counts.get(conn, 0)
+            misses += loads - last if loads >= last else loads
+            self._load_counts[conn] = loads
+            fullest = max(fullest, conn._cache.cache_non_ghost_count)
+
+        db._connectionMap(measure)
+
+        if over_rss:
+            new_size = int(size * RSS_SHRINK_FACTOR)
+        elif fullest < size * FULL_RATIO:
+            new_size = size
+        elif misses >= size * GROW_MISS_RATIO:
+            new_size = int(size * GROW_FACTOR)
+        elif misses < size * SHRINK_MISS_RATIO:
+            new_size = int(size * SHRINK_FACTOR)
+        else:
+            new_size = size
+
+        new_size = min(max(new_size, min_size), max_size)
+
+        if new_size != size:
+            size_bytes = db.getCacheSizeBytes()
+            db.setCacheSize(new_size)
+            if size_bytes:
+                db.setCacheSizeBytes(int(size_bytes * new_size / size))
+
+        self._collect_idle(db, 0 if over_rss else self.idle)
+
+    def _collect_idle(self, db, idle):
+        # Connections in 'pool.available' aren't in use, and can't be
+        # taken from the pool while we hold the database's lock.
+        cutoff = time.time() - idle
+        with db._lock:
+            for returned, conn in db.pool.available:
+                if returned <= cutoff:
+                    if conn._cache.cache_non_ghost_count:
+                        conn.cacheMinimize()
+                else:
+                    conn.cacheGC()
+
+
+def cache_size_hook(adaptive_cache=True, adaptive_cache_min=None,
+                    adaptive_cache_max=None, adaptive_cache_max_rss=None,
+                    adaptive_cache_interval=DEFAULT_INTERVAL,
+                    adaptive_cache_idle=DEFAULT_IDLE):
+    """Return a hook for a :class:`zodburi.databases.DatabaseMapping`,
+    adding each database to a shared :class:`CacheSizeController`.
+    """
+    controller = CacheSizeController(
+        adaptive_cache_interval, adaptive_cache_min, adaptive_cache_max,
+        adaptive_cache_max_rss, adaptive_cache_idle,
+    )
+    return controller.add
@@ -0,0 +1,204 @@
+import collections.abc
+import logging
+import threading
+import weakref
+
+from ZODB.DB import DB
+
+
+logger = logging.getLogger(__name__)
+
+
+def is_open(db):
+    """Return whether the ``ZODB.DB.DB`` 'db' is not yet closed."""
+    # 'DB.close()' deletes the instance's 'storage' attribute.
+    return "storage" in vars(db)
+
+
+class DatabaseMapping(collections.abc.MutableMapping):
+    """Multi-database mapping calling hooks with the databases added to it.
+
+    ``ZODB.DB.DB`` adds itself to the mapping passed as its 'databases'
+    argument, so that hooks in 'hooks', called with each database, can
+    configure the databases created from the keyword arguments returned by
+    :func:`zodburi.resolve_uri`.
+
+    The databases are kept in 'databases', by default a new dict, e.g. a
+    multi-database mapping of the caller's (see :func:`join_databases`).
+    Closed databases are dropped from it before a database is added, so
+    that the same keyword arguments can create a database again.
+    """
+    def __init__(self, hooks=(), databases=None):
+        self.hooks = list(hooks)
+        self.databases = {} if databases is None else databases
+
+    def drop_closed(self):
+        """Drop the databases which are closed."""
+        for name, db in list(self.databases.items()):
+            if not is_open(db):
+                del self.databases[name]
+
+    def __contains__(self, name):
+        # 'ZODB.DB.DB' checks that its name is free before adding itself.
+        self.drop_closed()
+        return name in self.databases
+
+    def __getitem__(self, name):
+        return self.databases[name]
+
+    def __setitem__(self, name, db):
+        self.drop_closed()
+        self.databases[name] = db
+        for hook in self.hooks:
+            hook(db)
+
+    def __delitem__(self, name):
+        del self.databases[name]
+
+    def __iter__(self):
+        return iter(self.databases)
+
+    def __len__(self):
+        return len(self.databases)
+
+    def __repr__(self):
+        return f"<{self.__class__.__name__} {self.databases!r}>"
+
+
+def join_databases(dbkw, databases):
+    """Return a copy of 'dbkw', keyword arguments returned by
+    :func:`zodburi.resolve_uri`, creating a database which joins the
+    multi-database mapping 'databases', keeping the hooks of 'dbkw'.
+
+    Pass it as ``DB(storage, **join_databases(dbkw, databases))`` rather
+    than ``DB(storage, databases=databases, **dbkw)``, which fails when
+    'dbkw' has hooks.
+    """
+    mapping = dbkw.get("databases")
+
+    if isinstance(mapping, DatabaseMapping):
+        databases = DatabaseMapping(mapping.hooks, databases)
+
+    return dict(dbkw, databases=databases)
+
+
+class LazyDatabaseClosed(ValueError):
+    def __init__(self, database):
+        self.database = database
+        super().__init__(f"Lazy database is closed: {database!r}")
+
+
+class LazyDatabase:
+    """Delegate to a ``ZODB.DB.DB`` for 'storage' and 'dbkw', created on
+    first use.
+
+    Creating a ``ZODB.DB.DB`` loads the root object, and so opens its
+    storage:  pass a storage from a factory resolved with ``lazy=true``
+    (see :class:`zodburi.proxy.StorageProxy`) to defer opening it until
+    the database is first used, e.g. by ``open()`` or ``transaction()``.
+    Concurrent first uses create the database only once.
+
+    A database which joins a multi-database mapping does so when it is
+    created.
+    """
+    def __init__(self, storage, **dbkw):
+        self._storage = storage
+        self._dbkw = dbkw
+        self._db = None
+        self._closed = False
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        db = self._db
+        if db is None:
+            return f"<{self.__class__.__name__} for uncreated database>"
+        return f"<{self.__class__.__name__} for {db!r}>"
+
+    def __getattr__(self, name):
+        if name.startswith("__"):
+            raise AttributeError(name)
+
+        return getattr(self._get_db(), name)
+
+    def _get_db(self):
+        db = self._db
+
+        if db is not None:
+            return db
+
+        with self._lock:
+            if self._db is None:
+                if self._closed:
+                    raise LazyDatabaseClosed(self)
+                self._db = DB(self._storage, **self._dbkw)
+
+            return self._db
+
+    def created(self):
+        """Return whether the database has been created."""
+        return self._db is not None
+
+    def close(self):
+        """Close the database, if created, or else its storage."""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            db = self._db
+
+        if db is not None:
+            db.close()
+        else:
+            self._storage.close()
+
+
+class PeriodicDatabaseTask:
+    """Base class for tasks run at an interval for a set of databases.
+
+    The task is run by a daemon thread, started when the first database is
+    added, which stops once all of them are closed.  Subclasses implement
+    :meth:`run_once`, which is called with the open databases.
+    """
+    name = "zodburi periodic task"
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._dbs = weakref.WeakSet()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def add(self, db):
+        self._dbs.add(db)
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(
+                target=self._run, name=self.name, daemon=True,
+            )
+            self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+
+    def open_databases(self):
+        """Return the databases added which are not yet closed."""
+        return [db for db in list(self._dbs) if is_open(db)]
+
+    def run(self):
+        """Run the task now;  return False if all databases are closed."""
+        dbs = self.open_databases()
+
+        if not dbs:
+            return False
+
+        self.run_once(dbs)
+        return True
+
+    def run_once(self, dbs):
+        raise NotImplementedError  # pragma: no cover
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                if not self.run():
+                    break
+            except Exception:
+                logger.exception("%s failed", self.name)
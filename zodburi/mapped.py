@@ -0,0 +1,199 @@
+import bisect
+import mmap
+import os
+import struct
+
+import zope.interface
+import ZODB.interfaces
+import ZODB.POSException
+import ZODB.TimeStamp
+import ZODB.utils
+
+
+MAGIC = b"ZODBURI\x01"
+# magic, record count, last transaction id, index offset
+HEADER = struct.Struct(">8sQ8sQ")
+# oid, tid, data offset, data length
+INDEX_ENTRY = struct.Struct(">8s8sQQ")
+
+
+class InvalidMappedFile(ValueError):
+    def __init__(self, path):
+        self.path = path
+        super().__init__(f"Not a mapped storage file: {path!r}")
+
+
+def write_mapped(source, path):
+    """Write the current records of 'source', a storage supporting
+    iteration, to the file at 'path', for :class:`MappedStorage`.
+
+    The file is written under a temporary name and renamed into place, so
+    concurrent readers see either no file or a complete one.
+    """
+    current = {}
+    for txn in source.iterator():
+        for record in txn:
+            if record.data is None:  # undone object creation
+                current.pop(record.oid, None)
+            else:
+                current[record.oid] = (record.tid, record.data)
+
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            f.write(b"\0" * HEADER.size)
+            index = []
+            for oid in sorted(current):
+                tid, data = current[oid]
+                index.append(INDEX_ENTRY.pack(oid, tid, f.tell(), len(data)))
+                f.write(data)
+            index_offset = f.tell()
+            f.write(b"".join(index))
+            f.seek(0)
+            f.write(HEADER.pack(
+                MAGIC, len(index), source.lastTransaction(), index_offset))
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+class _Oids:
+    # The oids of a mapped file's index, as a sequence for 'bisect'.
+
+    def __init__(self, buffer, offset, count):
+        self._buffer = buffer
+        self._offset = offset
+        self._count = count
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, i):
+        start = self._offset + i * INDEX_ENTRY.size
+        return self._buffer[start:start + 8]
+
+
+@zope.interface.implementer(ZODB.interfaces.IStorage)
+class MappedStorage:
+    """A read-only storage of the current records in a file written by
+    :func:`write_mapped`, which is memory-mapped rather than read.
+
+    Processes opening the same file share the pages of the mapping, e.g. a
+    reference dataset in ``/dev/shm`` shared by the workers of a pool.
+    Records are looked up by binary search in the file's sorted oid index.
+    Only the current revisions of the objects are available.
+    """
+    def __init__(self, path, name=None):
+        self._path = path
+        self.__name__ = name or path
+
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        try:
+            magic, count, ltid, index_offset = HEADER.unpack_from(self._mmap)
+        except struct.error:
+            magic = None
+        if magic != MAGIC:
+            self._mmap.close()
+            raise InvalidMappedFile(path)
+
+        self._count = count
+        self._ltid = ltid
+        self._index_offset = index_offset
+        self._buffer = memoryview(self._mmap)
+        self._oids = _Oids(self._mmap, index_offset, count)
+
+    def _entry(self, oid):
+        i = bisect.bisect_left(self._oids, oid)
+        if i < self._count and self._oids[i] == oid:
+            return INDEX_ENTRY.unpack_from(
+                self._mmap, self._index_offset + i * INDEX_ENTRY.size)
+        raise ZODB.POSException.POSKeyError(oid)
+
+    def load_view(self, oid):
+        """Return a (memoryview, tid) pair for the current record of 'oid',
+        without copying its data out of the mapping.
+        """
+        _, tid, offset, length = self._entry(oid)
+        return self._buffer[offset:offset + length], tid
+
+    def close(self):
+        if self._buffer is not None:
+            self._buffer.release()
+            self._buffer = None
+            try:
+                self._mmap.close()
+            except BufferError:
+                # Views returned by 'load_view' are still alive:  the
+                # mapping goes away with the last of them.
+                pass
+
+    def getName(self):
+        return self.__name__
+
+    def getSize(self):
+        return len(self._mmap)
+
+    def getTid(self, oid):
+        return self._entry(oid)[1]
+
+    def history(self, oid, size=1):
+        _, tid, _, length = self._entry(oid)
+        return [dict(time=ZODB.TimeStamp.TimeStamp(tid).timeTime(), tid=tid,
+                     serial=tid, user_name='', description='', size=length)]
+
+    def isReadOnly(self):
+        return True
+
+    def lastTransaction(self):
+        return self._ltid
+
+    def __len__(self):
+        return self._count
+
+    load = ZODB.utils.load_current
+
+    def loadBefore(self, oid, tid):
+        _, record_tid, offset, length = self._entry(oid)
+        if record_tid >= tid:
+            return None
+        return self._mmap[offset:offset + length], record_tid, None
+
+    def loadSerial(self, oid, serial):
+        _, tid, offset, length = self._entry(oid)
+        if tid != serial:
+            raise ZODB.POSException.POSKeyError(oid, serial)
+        return self._mmap[offset:offset + length]
+
+    def new_oid(self):
+        raise ZODB.POSException.ReadOnlyError()
+
+    def pack(self, t, referencesf):
+        raise ZODB.POSException.ReadOnlyError()
+
+    def registerDB(self, db):
+        pass
+
+    def sortKey(self):
+        return self.__name__
+
+    def store(self, oid, serial, data, version, transaction):
+        raise ZODB.POSException.ReadOnlyError()
+
+    def tpc_begin(self, transaction):
+        raise ZODB.POSException.ReadOnlyError()
+
+    def tpc_abort(self, transaction):
+        pass
+
+    def tpc_vote(self, transaction):
+        raise ZODB.POSException.ReadOnlyError()
+
+    def tpc_finish(self, transaction, func=lambda tid: None):
+        raise ZODB.POSException.ReadOnlyError()
+
+    def supportsUndo(self):
+        return False
@@ -0,0 +1,212 @@
+import copy
+import threading
+
+from BTrees.OOBTree import OOBTree
+from ZODB.Connection import TransactionMetaData
+from ZODB.MappingStorage import MappingStorage
+from ZODB.utils import u64
+from ZODB.utils import z64
+
+from zodburi.proxy import StorageProxy
+
+
+_snapshots = {}
+_snapshots_lock = threading.Lock()
+
+
+def _load_transactions(source, destination):
+    # Copy the transactions of 'source' into 'destination', a fresh
+    # 'MappingStorage', which has no 'restore':  store the records as of
+    # their original tids instead.
+    max_oid = 0
+
+    for txn in source.iterator():
+        metadata = TransactionMetaData(
+            txn.user, txn.description, txn.extension)
+        destination.tpc_begin(metadata, txn.tid)
+        for record in txn:
+            if record.data is None:  # undone object creation
+                continue
+            tid_data = destination._data.get(record.oid)
+            serial = tid_data.maxKey() if tid_data else z64
+            destination.store(record.oid, serial, record.data, '', metadata)
+            max_oid = max(max_oid, u64(record.oid))
+        destination.tpc_vote(metadata)
+        destination.tpc_finish(metadata)
+
+    destination._oid = max(destination._oid, max_oid)
+
+
+def load_snapshot(uri):
+    """Return a ``MappingStorage`` holding the transactions of the storage
+    at 'uri', which is opened, copied and closed only on the first call for
+    (the canonical form of) 'uri' in this process.
+
+    The snapshot is shared:  use :func:`clone_snapshot` to get a storage
+    which may be written to.
+    """
+    # Imported here:  'zodburi' imports this module via its resolvers.
+    from zodburi import _get_uri_factory_and_dbkw
+    from zodburi import canonicalize
+
+    key = canonicalize(uri)
+
+    with _snapshots_lock:
+        snapshot = _snapshots.get(key)
+
+        if snapshot is None:
+            factory, _ = _get_uri_factory_and_dbkw(uri)
+            source = factory()
+            try:
+                snapshot = MappingStorage(key)
+                _load_transactions(source, snapshot)
+            finally:
+                source.close()
+            _snapshots[key] = snapshot
+
+    return snapshot
+
+
+def clone_snapshot(snapshot, name='MappingStorage'):
+    """Return a new ``MappingStorage`` named 'name' with the contents of
+    'snapshot', another ``MappingStorage``.
+
+    Only the containers are copied, not the records themselves, so cloning
+    is much cheaper than re-reading the snapshot's source.
+    """
+    storage = MappingStorage(name)
+
+    with snapshot._lock:
+        storage._data = {
+            oid: tid_data.__class__(tid_data)
+            for oid, tid_data in snapshot._data.items()
+        }
+        transactions = OOBTree()
+        for tid, txn in snapshot._transactions.items():
+            # Packing removes records from the transactions' 'data'.
+            txn = copy.copy(txn)
+            txn.data = dict(txn.data)
+            transactions[tid] = txn
+        storage._transactions = transactions
+        storage._ltid = snapshot._ltid
+        storage._last_pack = snapshot._last_pack
+        storage._oid = snapshot._oid
+
+    return storage
+
+
+def clear_snapshots():
+    """Forget the snapshots loaded by :func:`load_snapshot`."""
+    with _snapshots_lock:
+        _snapshots.clear()
+
+
+class _SharedEntry:
+
+    def __init__(self, storage):
+        self.storage = storage
+        self.handles = []
+        self.disposed = False
+
+
+_shared = {}
+_shared_lock = threading.Lock()
+
+
+class SharedStorage(StorageProxy):
+    """A handle on a storage shared, by name, within the process.
+
+    Returned by :func:`open_shared`.  Transactions committed through one
+    handle invalidate the objects they changed in the databases using the
+    other handles.  Closing a handle releases it;  the shared storage is
+    only closed once it has been disposed of (see :func:`dispose_shared`)
+    and all of its handles are closed.
+    """
+    def __init__(self, entry):
+        self._entry = entry
+        self._oids = {}
+        super().__init__(lambda: entry.storage)
+
+    def tpc_begin(self, transaction, *args):
+        self._get_storage().tpc_begin(transaction, *args)
+        self._oids[transaction] = []
+
+    def store(self, oid, serial, data, version, transaction):
+        result = self._get_storage().store(
+            oid, serial, data, version, transaction)
+        oids = self._oids.get(transaction)
+        if oids is not None:
+            oids.append(oid)
+        return result
+
+    def tpc_finish(self, transaction, *args):
+        tid = self._get_storage().tpc_finish(transaction, *args)
+        oids = self._oids.pop(transaction, ())
+
+        if oids:
+            with _shared_lock:
+                others = [h for h in self._entry.handles if h is not self]
+            for handle in others:
+                for db in list(handle._dbs):
+                    db.invalidate(tid, oids)
+
+        return tid
+
+    def tpc_abort(self, transaction):
+        self._get_storage().tpc_abort(transaction)
+        self._oids.pop(transaction, None)
+
+    def close(self):
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._storage = None
+            self._dbs = []
+
+        entry = self._entry
+        with _shared_lock:
+            entry.handles.remove(self)
+            close = entry.disposed and not entry.handles
+
+        if close:
+            entry.storage.close()
+
+
+def open_shared(name, factory):
+    """Return a new :class:`SharedStorage` handle on the storage shared as
+    'name' in this process, created by calling 'factory', a no-arg storage
+    factory, unless it already exists.
+    """
+    with _shared_lock:
+        entry = _shared.get(name)
+
+        if entry is None:
+            entry = _shared[name] = _SharedEntry(factory())
+
+        handle = SharedStorage(entry)
+        entry.handles.append(handle)
+
+    return handle
+
+
+def dispose_shared(name):
+    """Forget the storage shared as 'name', closing it once all of its
+    handles are closed;  the next :func:`open_shared` for 'name' creates a
+    new one.
+    """
+    with _shared_lock:
+        entry = _shared.pop(name)
+        entry.disposed = True
+        close = not entry.handles
+
+    if close:
+        entry.storage.close()
+
+
+def shared_storages():
+    """Return a dict mapping the names of the storages shared in this
+    process to their number of open handles.
+    """
+    with _shared_lock:
+        return {name: len(entry.handles) for name, entry in _shared.items()}
@@ -0,0 +1,224 @@
+from concurrent.futures import ThreadPoolExecutor
+import os
+import queue
+import shutil
+import tempfile
+import threading
+import time
+
+from ZODB.blob import is_blob_record
+from ZODB.Connection import TransactionMetaData
+from ZODB.interfaces import IBlobStorage
+from ZODB.POSException import POSKeyError
+from ZODB.utils import p64
+from ZODB.utils import u64
+from ZODB.utils import z64
+
+
+DEFAULT_BLOB_WORKERS = 4
+# Transactions read ahead of the one being written.
+DEFAULT_QUEUE_SIZE = 64
+DEFAULT_REPORT_INTERVAL = 10.0
+
+_DONE = object()
+
+
+class DestinationNotRestorable(TypeError):
+    def __init__(self, destination):
+        self.destination = destination
+        super().__init__(
+            f"Cannot copy transactions to a storage without 'restore': "
+            f"{destination!r}")
+
+
+class DestinationWithoutBlobs(TypeError):
+    def __init__(self, destination):
+        self.destination = destination
+        super().__init__(
+            f"Cannot copy blobs to a storage without blob support: "
+            f"{destination!r}")
+
+
+class CopyStats:
+    """Counts of what a copy has copied so far, and how fast."""
+
+    def __init__(self, start=None):
+        self.start = start
+        self.last_tid = None
+        self.transactions = 0
+        self.records = 0
+        self.bytes = 0
+        self.blobs = 0
+        self.blob_bytes = 0
+        self.started = time.monotonic()
+
+    @property
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+    def __str__(self):
+        elapsed = max(self.elapsed, 1e-6)
+        total = self.bytes + self.blob_bytes
+        return (
+            f"{self.transactions} transactions, {self.records} records, "
+            f"{self.blobs} blobs, {total / (1 << 20):.1f} MB in "
+            f"{elapsed:.1f}s ({self.transactions / elapsed:.1f} txn/s, "
+            f"{total / (1 << 20) / elapsed:.1f} MB/s)"
+        )
+
+
+def _stage_blob(source, oid, tid, directory):
+    # Make a copy of the blob file of the record (oid, tid), which the
+    # destination can consume, in 'directory':  a hard link if possible.
+    try:
+        filename = source.loadBlob(oid, tid)
+    except POSKeyError:
+        return None
+
+    fd, name = tempfile.mkstemp(
+        prefix="zodburi-copy-", suffix=".tmp", dir=directory)
+    os.close(fd)
+    os.remove(name)
+    try:
+        os.link(filename, name)
+    except OSError:
+        shutil.copyfile(filename, name)
+    return name
+
+
+def _read(source, start, blob_pool, blob_dir, transactions, stopped):
+    # Read transactions from 'source' into the 'transactions' queue,
+    # staging their blobs in 'blob_pool', until done or 'stopped'.
+    def put(item):
+        while not stopped.is_set():
+            try:
+                transactions.put(item, timeout=0.1)
+            except queue.Full:
+                continue
+            return True
+        return False
+
+    try:
+        for txn in source.iterator(start):
+            records = []
+            for record in txn:
+                blob = None
+                if blob_dir is not None and is_blob_record(record.data):
+                    blob = blob_pool.submit(
+                        _stage_blob, source, record.oid, record.tid, blob_dir)
+                records.append((
+                    record.oid, record.tid, record.data, record.data_txn,
+                    blob,
+                ))
+            metadata = TransactionMetaData(
+                txn.user, txn.description, txn.extension)
+            if not put((txn.tid, txn.status, metadata, records)):
+                return
+        put(_DONE)
+    except BaseException as e:
+        put(e)
+
+
+def copy_storage(source, destination, blob_workers=DEFAULT_BLOB_WORKERS,
+                 queue_size=DEFAULT_QUEUE_SIZE, report=None,
+                 report_interval=DEFAULT_REPORT_INTERVAL):
+    """Copy the transactions of 'source' to 'destination', with their
+    original transaction ids, and return a :class:`CopyStats`.
+
+    Copying resumes after the destination's last transaction, so an
+    interrupted copy may simply be run again.  Transactions are read, in
+    a separate thread, up to 'queue_size' ahead of the one being written;
+    blob files are fetched and staged by a pool of 'blob_workers' threads.
+    If not None, 'report' is called with the stats every
+    'report_interval' seconds.
+    """
+    if not hasattr(destination, 'restore'):
+        raise DestinationNotRestorable(destination)
+
+    blob_dir = None
+    if IBlobStorage.providedBy(source):
+        if not IBlobStorage.providedBy(destination):
+            raise DestinationWithoutBlobs(destination)
+        blob_dir = destination.temporaryDirectory()
+
+    last = destination.lastTransaction()
+    start = None if last == z64 else p64(u64(last) + 1)
+    stats = CopyStats(start)
+    transactions = queue.Queue(queue_size)
+    stopped = threading.Event()
+    next_report = time.monotonic() + report_interval
+
+    with ThreadPoolExecutor(
+            blob_workers, thread_name_prefix="zodburi copy blobs",
+    ) as blob_pool:
+        reader = threading.Thread(
+            target=_read, name="zodburi copy reader",
+            args=(source, start, blob_pool, blob_dir, transactions, stopped),
+            daemon=True,
+        )
+        reader.start()
+
+        try:
+            while True:
+                item = transactions.get()
+                if item is _DONE:
+                    break
+                if isinstance(item, BaseException):
+                    raise item
+
+                tid, status, metadata, records = item
+                _write(destination, tid, status, metadata, records, stats)
+
+                if report is not None and time.monotonic() >= next_report:
+                    report(stats)
+                    next_report = time.monotonic() + report_interval
+        finally:
+            stopped.set()
+            reader.join()
+
+    return stats
+
+
+def _write(destination, tid, status, metadata, records, stats):
+    destination.tpc_begin(metadata, tid, status)
+    try:
+        for oid, record_tid, data, data_txn, blob in records:
+            blob_filename = None if blob is None else blob.result()
+            if blob_filename is not None:
+                stats.blobs += 1
+                stats.blob_bytes += os.path.getsize(blob_filename)
+                destination.restoreBlob(
+                    oid, record_tid, data, blob_filename, data_txn, metadata)
+            else:
+                destination.restore(
+                    oid, record_tid, data, '', data_txn, metadata)
+            stats.records += 1
+            stats.bytes += len(data or b'')
+        destination.tpc_vote(metadata)
+        destination.tpc_finish(metadata)
+    except BaseException:
+        destination.tpc_abort(metadata)
+        raise
+
+    stats.transactions += 1
+    stats.last_tid = tid
+
+
+def copy(source_uri, destination_uri, **kw):
+    """Copy the transactions of the storage at 'source_uri' to the one at
+    'destination_uri' (see :func:`copy_storage`, which takes the keyword
+    arguments).
+    """
+    from zodburi import resolve_uri
+
+    source_factory, _ = resolve_uri(source_uri)
+    destination_factory, _ = resolve_uri(destination_uri)
+    source = source_factory()
+    try:
+        destination = destination_factory()
+        try:
+            return copy_storage(source, destination, **kw)
+        finally:
+            destination.close()
+    finally:
+        source.close()
@@ -0,0 +1,173 @@
+import os
+import socket
+import threading
+
+from ZODB.ActivityMonitor import ActivityMonitor
+
+from zodburi.databases import PeriodicDatabaseTask
+
+
+DEFAULT_METRICS_INTERVAL = 15.0
+
+
+class CountingActivityMonitor(ActivityMonitor):
+    """An ``ActivityMonitor`` which also keeps running totals.
+
+    'totals' maps 'connections', 'loads' and 'stores' to the number of
+    connections closed, and of objects they loaded and stored, since the
+    monitor was created.
+    """
+    def __init__(self, history_length=3600):
+        super().__init__(history_length)
+        self.totals = {"connections": 0, "loads": 0, "stores": 0}
+        self._totals_lock = threading.Lock()
+
+    def closedConnection(self, conn):
+        loads, stores = conn.getTransferCounts()
+        with self._totals_lock:
+            self.totals["connections"] += 1
+            self.totals["loads"] += loads
+            self.totals["stores"] += stores
+        super().closedConnection(conn)
+
+
+def collect_metrics(db):
+    """Return a list of (name, type, help, value) metrics for 'db'.
+
+    'type' is a Prometheus metric type, 'counter' or 'gauge'.
+    """
+    metrics = []
+
+    def add(name, type, help, value):
+        metrics.append((f"zodb_{name}", type, help, value))
+
+    monitor = db.getActivityMonitor()
+    if isinstance(monitor, CountingActivityMonitor):
+        totals = dict(monitor.totals)
+        add("connections_closed_total", "counter",
+            "Connections closed.", totals["connections"])
+        add("loads_total", "counter",
+            "Objects loaded from the storage by closed connections.",
+            totals["loads"])
+        add("stores_total", "counter",
+            "Objects stored to the storage by closed connections.",
+            totals["stores"])
+
+    pool = db.pool
+    pooled = len(pool.all)
+    add("connection_pool_size", "gauge",
+        "Configured connection pool size.", db.getPoolSize())
+    add("connections", "gauge", "Connections in the pool.", pooled)
+    add("connections_in_use", "gauge",
+        "Connections in the pool which are open.",
+        pooled - len(pool.available))
+
+    cache_objects = [0]
+    cache_bytes = [0]
+
+    def measure(conn):
+        cache_objects[0] += conn._cache.cache_non_ghost_count
+        cache_bytes[0] += conn._cache.total_estimated_size
+
+    db._connectionMap(measure)
+    add("cache_size_target", "gauge",
+        "Configured target size, in objects, of each connection's cache.",
+        db.getCacheSize())
+    add("cache_objects", "gauge",
+        "Non-ghost objects in all connection caches.", cache_objects[0])
+    add("cache_bytes", "gauge",
+        "Estimated size, in bytes, of all connection caches.", cache_bytes[0])
+
+    client_cache = getattr(db.storage, "_cache", None)
+    get_stats = getattr(client_cache, "getStats", None)
+    if get_stats is not None:  # ZEO ClientStorage
+        adds, added_bytes, evicts, evicted_bytes, hits = get_stats()
+        add("zeo_cache_hits_total", "counter",
+            "Loads served by the ZEO client cache.", hits)
+        add("zeo_cache_adds_total", "counter",
+            "Records added to the ZEO client cache.", adds)
+        add("zeo_cache_evicts_total", "counter",
+            "Records evicted from the ZEO client cache.", evicts)
+
+    return metrics
+
+
+def format_metrics(dbs):
+    """Return the metrics for the databases 'dbs' in the Prometheus text
+    format, labelled with their names.
+    """
+    families = {}
+
+    for db in dbs:
+        database = db.database_name.replace("\\", "\\\\").replace('"', '\\"')
+        for name, type, help, value in collect_metrics(db):
+            family = families.setdefault(
+                name, [f"# HELP {name} {help}", f"# TYPE {name} {type}"])
+            family.append(f'{name}{{database="{database}"}} {value}')
+
+    return "".join(
+        line + "\n" for family in families.values() for line in family
+    )
+
+
+class MetricsExporter(PeriodicDatabaseTask):
+    """Export snapshots of the metrics for databases at an interval.
+
+    - 'path', if not None, is a file replaced with each snapshot, e.g. for
+      node_exporter's textfile collector.
+    - 'socket_path', if not None, is a Unix domain socket to which each
+      snapshot is written over a new connection, e.g. to a local agent.
+
+    Snapshots are written by a daemon thread, started when the first
+    database is added, which stops once all of them are closed.
+    """
+    name = "zodburi metrics exporter"
+
+    def __init__(self, interval=DEFAULT_METRICS_INTERVAL,
+                 path=None, socket_path=None):
+        super().__init__(interval)
+        self.path = path
+        self.socket_path = socket_path
+
+    def export(self):
+        """Write a snapshot now;  return False if all databases are closed.
+        """
+        return self.run()
+
+    def run_once(self, dbs):
+        text = format_metrics(dbs)
+
+        if self.path is not None:
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w") as f:
+                f.write(text)
+            os.replace(tmp_path, self.path)
+
+        if self.socket_path is not None:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+                sock.connect(self.socket_path)
+                sock.sendall(text.encode("utf-8"))
+
+
+def monitor_hook(activity_monitor=False, activity_monitor_history=3600,
+                 metrics_file=None, metrics_socket=None,
+                 metrics_interval=DEFAULT_METRICS_INTERVAL):
+    """Return a hook for a :class:`zodburi.databases.DatabaseMapping`.
+
+    The hook attaches a :class:`CountingActivityMonitor` to each database
+    if 'activity_monitor' is true, and adds it to a :class:`MetricsExporter`
+    if 'metrics_file' or 'metrics_socket' is set.
+    """
+    exporter = None
+    if metrics_file is not None or metrics_socket is not None:
+        exporter = MetricsExporter(
+            metrics_interval, metrics_file, metrics_socket)
+
+    def hook(db):
+        if activity_monitor:
+            db.setActivityMonitor(
+                CountingActivityMonitor(activity_monitor_history))
+        if exporter is not None:
+            exporter.add(db)
+
+    return hook
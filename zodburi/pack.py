@@ -0,0 +1,217 @@
+import datetime
+import logging
+import re
+import time
+import weakref
+
+from ZODB.FileStorage.fspack import FileStoragePacker
+
+from zodburi.databases import PeriodicDatabaseTask
+
+
+logger = logging.getLogger(__name__)
+
+# Seconds between checks whether a pack is due.
+PACK_CHECK_INTERVAL = 60.0
+
+WINDOW_RE = re.compile(r"^\s*(\d{1,2}):(\d{2})\s*-\s*(\d{1,2}):(\d{2})\s*$")
+
+_schedulers = weakref.WeakKeyDictionary()
+
+
+class InvalidPackWindow(ValueError):
+    def __init__(self, window):
+        self.window = window
+        super().__init__(
+            f"Invalid pack window, expected 'HH:MM-HH:MM': {window!r}")
+
+
+class MissingPackInterval(ValueError):
+    def __init__(self, kw):
+        self.kw = kw
+        super().__init__(
+            f"Pack options require pack_interval: {', '.join(sorted(kw))}")
+
+
+def parse_window(window):
+    """Parse 'HH:MM-HH:MM' into a (start, end) pair of ``datetime.time``.
+
+    The window may wrap around midnight, e.g. '22:00-04:00'.
+    """
+    m = WINDOW_RE.match(window)
+
+    if m is None:
+        raise InvalidPackWindow(window)
+
+    try:
+        start = datetime.time(int(m.group(1)), int(m.group(2)))
+        end = datetime.time(int(m.group(3)), int(m.group(4)))
+    except ValueError:
+        raise InvalidPackWindow(window) from None
+
+    return start, end
+
+
+def in_window(window, now=None):
+    """Return whether the local time 'now' (default: the current time) is
+    in 'window', a (start, end) pair returned by :func:`parse_window`.
+    """
+    start, end = window
+    if now is None:
+        now = datetime.datetime.now().time()
+
+    if start <= end:
+        return start <= now < end
+    return now >= start or now < end
+
+
+class ThrottledPacker(FileStoragePacker):
+    """A ``FileStoragePacker`` copying at most 'rate' bytes per second.
+
+    Only the copy of the transactions before the pack time, which makes up
+    the bulk of a pack's I/O and runs without the storage's commit lock, is
+    throttled.
+    """
+    def __init__(self, storage, referencesf, stop, gc=True, rate=None):
+        super().__init__(storage, referencesf, stop, gc)
+        self._rate = rate
+        self._copied = 0
+        self._started = None
+
+    def copyDataRecords(self, pos, th):
+        if self._started is None:
+            self._started = time.monotonic()
+
+        result = super().copyDataRecords(pos, th)
+
+        if self._rate:
+            self._copied += th.tlen
+            delay = (
+                self._copied / self._rate
+                - (time.monotonic() - self._started)
+            )
+            if delay > 0:
+                time.sleep(delay)
+
+        return result
+
+
+def throttled_packer(rate):
+    """Return a ``FileStorage`` 'packer' copying at most 'rate' bytes per
+    second (see :class:`ThrottledPacker`).
+    """
+    def packer(storage, referencesf, stop, gc):
+        # Like 'FileStorage.packer', with our packer class.
+        p = ThrottledPacker(storage, referencesf, stop, gc, rate)
+        try:
+            opos = p.pack()
+            if opos is None:
+                return None
+            return opos, p.index
+        finally:
+            p.close()
+
+    return packer
+
+
+class PackScheduler(PeriodicDatabaseTask):
+    """Pack databases every 'pack_interval' seconds.
+
+    - 'pack_days' is the number of days of history to keep.
+    - 'window', if not None, is a (start, end) pair returned by
+      :func:`parse_window`:  packs only start in that window of local time.
+
+    The first pack is due 'pack_interval' seconds after a database is
+    added.  Packs run in the scheduler's daemon thread;  see
+    :func:`pack_stats` for their outcome.
+    """
+    name = "zodburi pack scheduler"
+
+    def __init__(self, pack_interval, pack_days=0.0, window=None):
+        super().__init__(min(PACK_CHECK_INTERVAL, pack_interval))
+        self.pack_interval = pack_interval
+        self.pack_days = pack_days
+        self.window = window
+        self._stats = weakref.WeakKeyDictionary()
+
+    def add(self, db):
+        self._stats[db] = {
+            "packs": 0,
+            "failures": 0,
+            "next_pack": time.time() + self.pack_interval,
+            "last_pack": None,
+            "last_duration": None,
+            "last_size_before": None,
+            "last_size_after": None,
+            "last_error": None,
+        }
+        _schedulers[db] = self
+        super().add(db)
+
+    def stats(self, db):
+        """Return a dict describing the packs of 'db'."""
+        return dict(self._stats[db])
+
+    def run_once(self, dbs):
+        if self.window is not None and not in_window(self.window):
+            return
+
+        now = time.time()
+        for db in dbs:
+            if self._stats[db]["next_pack"] <= now:
+                self.pack(db)
+
+    def pack(self, db):
+        """Pack 'db' now, recording the outcome in its stats."""
+        stats = self._stats[db]
+        started = time.time()
+        size_before = db.getSize()
+
+        try:
+            db.pack(days=self.pack_days)
+        except Exception as e:
+            logger.exception("Packing %s failed", db.database_name)
+            stats["failures"] += 1
+            stats["last_error"] = repr(e)
+        else:
+            stats["packs"] += 1
+            stats["last_error"] = None
+            stats["last_size_before"] = size_before
+            stats["last_size_after"] = db.getSize()
+            logger.info(
+                "Packed %s in %.1fs: %d bytes -> %d bytes",
+                db.database_name, time.time() - started,
+                size_before, stats["last_size_after"],
+            )
+        finally:
+            stats["last_pack"] = started
+            stats["last_duration"] = time.time() - started
+            stats["next_pack"] = started + self.pack_interval
+
+
+def pack_stats(db):
+    """Return a dict describing the scheduled packs of 'db', or None if
+    its packs aren't scheduled (see the ``pack_interval`` option).
+
+    - 'packs' and 'failures' count the packs which succeeded and failed.
+    - 'next_pack' and 'last_pack' are the times (as returned by
+      ``time.time()``) at which the next pack is due and the last one
+      started, 'last_duration' how long it took, in seconds.
+    - 'last_size_before' and 'last_size_after' are the sizes of the
+      storage, in bytes, before and after the last successful pack.
+    - 'last_error' describes the error of the last pack, if it failed.
+    """
+    scheduler = _schedulers.get(db)
+
+    if scheduler is None:
+        return None
+
+    return scheduler.stats(db)
+
+
+def pack_hook(pack_interval, pack_days=0.0, pack_window=None):
+    """Return a hook for a :class:`zodburi.databases.DatabaseMapping`,
+    scheduling packs of each database with a shared :class:`PackScheduler`.
+    """
+    window = None if pack_window is None else parse_window(pack_window)
+    return PackScheduler(pack_interval, pack_days, window).add
@@ -0,0 +1,127 @@
+from concurrent.futures import ThreadPoolExecutor
+import collections
+import logging
+import threading
+
+from ZODB.serialize import referencesf
+
+from zodburi.proxy import StorageProxy
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DEPTH = 1
+DEFAULT_WORKERS = 4
+DEFAULT_BUFFER_SIZE = 1000
+
+_MISSING = object()
+
+
+class PrefetchingStorage(StorageProxy):
+    """Prefetch the objects referenced by those loaded from the storage
+    returned by 'factory', down to 'depth' levels of references.
+
+    Each ``loadBefore`` parses the persistent references of the record it
+    returns and fetches them, as of the same transaction, in the
+    background, so that walking an object graph waits on bandwidth rather
+    than on a round trip per object:
+
+    - storages with a ``prefetch(oids, tid)`` method, such as ZEO's
+      ``ClientStorage``, are asked to prefetch each level of references
+      into their own cache, in one request;
+
+    - other storages are loaded from by a pool of 'workers' threads, into
+      a buffer of up to 'buffer_size' records, each served once.
+
+    Records already buffered or being fetched are not fetched again, and
+    none are when the buffer is full.
+    """
+    def __init__(self, factory, depth=DEFAULT_DEPTH, workers=DEFAULT_WORKERS,
+                 buffer_size=DEFAULT_BUFFER_SIZE):
+        super().__init__(factory)
+        self.depth = depth
+        self.buffer_size = buffer_size
+        self._executor = ThreadPoolExecutor(
+            workers, thread_name_prefix="zodburi prefetch")
+        self._buffer_lock = threading.Lock()
+        # (oid, tid) -> loadBefore result
+        self._buffer = collections.OrderedDict()
+        # (oid, tid) -> future of a loadBefore result, or _MISSING
+        self._pending = {}
+
+    def loadBefore(self, oid, tid):
+        key = oid, tid
+        with self._buffer_lock:
+            result = self._buffer.pop(key, _MISSING)
+            future = self._pending.get(key)
+        if result is _MISSING and future is not None:
+            result = future.result()
+            with self._buffer_lock:
+                self._buffer.pop(key, None)
+        if result is _MISSING:
+            result = self._get_storage().loadBefore(oid, tid)
+        if result is not None and self.depth:
+            self._prefetch(result[0], tid, self.depth)
+        return result
+
+    def _prefetch(self, data, tid, depth):
+        # Fetch the objects 'data' references, and theirs down to 'depth'.
+        with self._buffer_lock:
+            room = self.buffer_size - len(self._buffer) - len(self._pending)
+            if room <= 0:
+                return
+            oids = [
+                oid for oid in referencesf(data)
+                if (oid, tid) not in self._buffer
+                and (oid, tid) not in self._pending
+            ][:room]
+            if not oids:
+                return
+
+            storage = self._get_storage()
+            prefetch = getattr(storage, "prefetch", None)
+            if prefetch is not None:
+                prefetch(oids, tid)
+                if depth > 1:
+                    # Walk on from the records being fetched into the
+                    # storage's cache.
+                    self._executor.submit(
+                        self._descend, storage, oids, tid, depth - 1)
+                return
+
+            for oid in oids:
+                self._pending[oid, tid] = self._executor.submit(
+                    self._fetch, storage, oid, tid, depth - 1)
+
+    def _descend(self, storage, oids, tid, depth):
+        for oid in oids:
+            try:
+                result = storage.loadBefore(oid, tid)
+            except Exception:
+                logger.debug("Prefetching %r failed", oid, exc_info=True)
+                continue
+            if result is not None:
+                self._prefetch(result[0], tid, depth)
+
+    def _fetch(self, storage, oid, tid, depth):
+        key = oid, tid
+        try:
+            result = storage.loadBefore(oid, tid)
+        except Exception:
+            logger.debug("Prefetching %r failed", oid, exc_info=True)
+            result = _MISSING
+        with self._buffer_lock:
+            del self._pending[key]
+            if result is not _MISSING:
+                self._buffer[key] = result
+                while len(self._buffer) > self.buffer_size:
+                    self._buffer.popitem(last=False)
+        if result is not None and result is not _MISSING and depth:
+            self._prefetch(result[0], tid, depth)
+        return result
+
+    def close(self):
+        self._executor.shutdown(wait=True, cancel_futures=True)
+        with self._buffer_lock:
+            self._buffer.clear()
+        super().close()
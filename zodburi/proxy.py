@@ -0,0 +1,283 @@
+import logging
+import os
+import threading
+import time
+import weakref
+
+from zope.interface import providedBy
+
+
+logger = logging.getLogger(__name__)
+
+# Seconds between checks of the wrapped storage's 'is_connected()' while
+# waiting for it to become ready.
+READY_POLL_INTERVAL = 0.1
+
+_fork_safe_proxies = weakref.WeakSet()
+_fork_safe_proxies_lock = threading.Lock()
+
+
+class StorageProxyClosed(ValueError):
+    def __init__(self, proxy):
+        self.proxy = proxy
+        super().__init__(f"Storage proxy is closed: {proxy!r}")
+
+
+class StorageProxy:
+    """Delegate to the storage returned by a no-arg storage factory.
+
+    Method lookups are resolved against the wrapped storage at call time,
+    so callers which cache bound methods (``ZODB.DB``'s MVCC adapter,
+    ``DemoStorage``) keep working when the wrapped storage is reopened.
+
+    - 'factory' is a no-arg callable returning a storage, e.g. one
+      returned by :func:`zodburi.resolve_uri`.
+    - 'lazy', if true, defers opening the storage until it is first used,
+      rather than opening it immediately.  Concurrent first uses open it
+      only once.  Creating a ``ZODB.DB.DB`` uses the storage:  defer that
+      with :class:`zodburi.databases.LazyDatabase`.
+    - 'background', if true, opens the storage in a background thread,
+      rather than immediately.  Use :meth:`ready`, :meth:`wait` and
+      :meth:`state` to follow its progress;  the first use of the storage
+      waits for it.  If the open fails, the next use tries again.
+    - 'fork_safe', if true, has a forked child abandon the wrapped
+      storage, unclosed, and reopen its own on first use, with fresh
+      locks (see :func:`after_fork_in_child`);  the parent's storage is
+      left untouched.  Without it, a storage inherited across a fork is
+      still detected by comparing process ids, and abandoned.
+
+    Databases registered via ``registerDB`` are re-registered with each
+    reopened storage, and told to invalidate their caches.
+    """
+    def __init__(self, factory, lazy=False, background=False,
+                 fork_safe=False):
+        self._factory = factory
+        self._fork_safe = fork_safe
+        self._lock = threading.RLock()
+        self._storage = None
+        self._pid = None
+        self._dbs = []
+        self._closed = False
+        self._opening = False
+        self._opened = threading.Event()
+        self._open_error = None
+
+        if fork_safe:
+            with _fork_safe_proxies_lock:
+                _fork_safe_proxies.add(self)
+
+        if background:
+            self._opening = True
+            threading.Thread(
+                target=self._open_in_background,
+                name=f"zodburi background open of {factory!r}",
+                daemon=True,
+            ).start()
+        elif not lazy:
+            with self._lock:
+                self._open()
+
+    def __repr__(self):
+        storage = self._storage
+        if storage is None:
+            return f"<{self.__class__.__name__} for unopened storage>"
+        return f"<{self.__class__.__name__} for {storage!r}>"
+
+    @property
+    def __providedBy__(self):
+        return providedBy(self._get_storage())
+
+    def __getattr__(self, name):
+        if name.startswith("__"):
+            raise AttributeError(name)
+
+        attr = getattr(self._get_storage(), name)
+
+        if not callable(attr):
+            return attr
+
+        def method(*args, **kw):
+            return getattr(self._get_storage(), name)(*args, **kw)
+
+        method.__name__ = name
+        return method
+
+    def __len__(self):
+        return len(self._get_storage())
+
+    def _open(self):
+        # Caller holds 'self._lock'.
+        self._opening = True
+        try:
+            storage = self._factory()
+        finally:
+            self._opening = False
+        self._storage, self._pid = storage, os.getpid()
+        self._open_error = None
+        self._opened.set()
+
+        if hasattr(storage, "registerDB"):
+            for db in self._dbs:
+                storage.registerDB(db)
+
+        for db in self._dbs:
+            db.invalidateCache()
+
+    def _get_storage(self):
+        storage = self._storage
+
+        if storage is not None and self._pid == os.getpid():
+            return storage
+
+        with self._lock:
+            if self._closed:
+                raise StorageProxyClosed(self)
+
+            if self._storage is not None and self._pid != os.getpid():
+                # Inherited across a fork:  the parent still owns the
+                # storage's files, sockets and threads, so leave them be.
+                self._storage = None
+
+            if self._storage is None:
+                self._open()
+
+            return self._storage
+
+    def _open_in_background(self):
+        with self._lock:
+            try:
+                if self._storage is None and not self._closed:
+                    self._open()
+            except Exception as e:
+                logger.exception("Opening storage in background failed")
+                self._open_error = e
+            finally:
+                self._opening = False
+                self._opened.set()
+
+    def ready(self):
+        """Return whether the storage is open (and, if it has a notion of
+        being connected, e.g. ZEO's ``ClientStorage``, connected).
+        """
+        storage = self._storage
+
+        if storage is None or self._closed:
+            return False
+
+        is_connected = getattr(storage, "is_connected", None)
+        return is_connected is None or bool(is_connected())
+
+    def wait(self, timeout=None):
+        """Wait up to 'timeout' seconds (forever if None) until :meth:`ready`.
+
+        Return whether the storage is ready;  False if opening it failed.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        if not self._opened.wait(timeout):
+            return False
+
+        while not self.ready():
+            if self._storage is None:
+                return False
+
+            interval = READY_POLL_INTERVAL
+
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                interval = min(interval, remaining)
+
+            time.sleep(interval)
+
+        return True
+
+    def state(self):
+        """Return a string describing the state of the storage, one of:
+
+        - 'unopened', not yet opened (for lazy proxies)
+        - 'opening', being opened
+        - 'failed', opening it failed
+        - 'disconnected', open but not (yet, or any more) connected
+        - 'ready', open (and connected)
+        - 'closed', closed
+        """
+        if self._closed:
+            return "closed"
+        if self._storage is None:
+            if self._opening:
+                return "opening"
+            if self._open_error is not None:
+                return "failed"
+            return "unopened"
+        if self.ready():
+            return "ready"
+        return "disconnected"
+
+    def _release(self):
+        # Close the wrapped storage, leaving the proxy to reopen it on
+        # next use.  Caller holds 'self._lock'.
+        storage, self._storage = self._storage, None
+
+        if storage is not None and self._pid == os.getpid():
+            storage.close()
+
+    def registerDB(self, db):
+        with self._lock:
+            self._dbs.append(db)
+            storage = self._storage
+
+            if (storage is not None and self._pid == os.getpid()
+                    and hasattr(storage, "registerDB")):
+                storage.registerDB(db)
+
+    def close(self):
+        with self._lock:
+            if not self._closed:
+                self._closed = True
+                self._release()
+                self._dbs = []
+
+        with _fork_safe_proxies_lock:
+            _fork_safe_proxies.discard(self)
+
+
+def before_fork():
+    """Hold the registry of fork-safe proxies while the process forks, so
+    that the child inherits it in a consistent state.  Storages are left
+    open:  threads of the parent may be using them.
+
+    Registered with ``os.register_at_fork``, where available; servers
+    which fork by other means may call it, followed by
+    :func:`after_fork_in_parent` or :func:`after_fork_in_child`.
+    """
+    _fork_safe_proxies_lock.acquire()
+
+
+def after_fork_in_parent():
+    """Release the registry of fork-safe proxies in the parent."""
+    _fork_safe_proxies_lock.release()
+
+
+def after_fork_in_child():
+    """Have fork-safe proxies abandon, unclosed, the storages inherited
+    from the parent, and reopen their own on first use.
+
+    Their locks, which threads of the parent may have held when the
+    process forked, are replaced.
+    """
+    for proxy in list(_fork_safe_proxies):
+        proxy._lock = threading.RLock()
+        proxy._storage = None
+        proxy._opening = False
+
+    _fork_safe_proxies_lock.release()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(
+        before=before_fork,
+        after_in_parent=after_fork_in_parent,
+        after_in_child=after_fork_in_child,
+    )
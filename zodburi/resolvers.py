@@ -1,7 +1,10 @@
+from concurrent.futures import ThreadPoolExecutor
+import functools
 from io import BytesIO
 import os
 import re
 from urllib.parse import parse_qsl
+from urllib.parse import urlencode
 from urllib.parse import urlsplit
 import warnings
 
@@ -14,11 +17,62 @@ from ZODB.DemoStorage import DemoStorage
 from ZODB.FileStorage.FileStorage import FileStorage
 from ZODB.MappingStorage import MappingStorage
 
+from zodburi import _canonicalize_dbkw
 from zodburi import _get_uri_factory_and_dbkw
+from zodburi import canonicalize
 from zodburi import CONNECTION_PARAMETERS
+from zodburi.databases import DatabaseMapping
 from zodburi.datatypes import convert_bytesize
 from zodburi.datatypes import convert_int
 from zodburi.datatypes import convert_tuple
+from zodburi.mapped import MappedStorage
+from zodburi.mapped import write_mapped
+from zodburi.memory import clone_snapshot
+from zodburi.memory import load_snapshot
+from zodburi.memory import open_shared
+from zodburi.pack import MissingPackInterval
+from zodburi.pack import pack_hook
+from zodburi.pack import throttled_packer
+from zodburi.prefetch import PrefetchingStorage
+from zodburi.spill import SpillStorage
+from zodburi.trace import TraceWriter
+from zodburi.trace import TracingStorage
+from zodburi.zeo import AUTO_UNIX_SOCKET
+from zodburi.zeo import Backoff
+from zodburi.zeo import CACHE_VERIFY_MODES
+from zodburi.zeo import ClientThread
+from zodburi.zeo import convert_cache_size
+from zodburi.zeo import default_cache_budget_dir
+from zodburi.zeo import default_unix_socket
+from zodburi.zeo import default_verify_lock
+from zodburi.zeo import DEFAULT_CACHE_BUDGET_INTERVAL
+from zodburi.zeo import DEFAULT_RECONNECT_BACKOFF_MAX
+from zodburi.zeo import DEFAULT_RECONNECT_JITTER
+from zodburi.zeo import HostCacheBudget
+from zodburi.zeo import HostCacheSize
+from zodburi.zeo import InvalidCacheVerifyMode
+from zodburi.zeo import InvalidReconnectJitter
+from zodburi.zeo import is_local_host
+from zodburi.zeo import open_dropped_cache
+from zodburi.zeo import prefer_unix_socket
+from zodburi.zeo import share_cache_budget
+from zodburi.zeo import VerificationSlots
+from zodburi.zeo import warm_cache
+
+
+def _split_uri(uri, prefix):
+    # Split 'uri' into the part following 'prefix' and its query string.
+    prefix, rest = uri.split(prefix, 1)
+    result = rest.split('?', 1)
+    if len(result) == 1:
+        return result[0], ''
+    return result
+
+
+def _canonical_query(kw, separator='?'):
+    # Braces are kept, for URI templates.
+    query = urlencode(sorted(kw.items()), safe='/,:{}')
+    return separator + query if query else ''
 
 
 class Resolver:
@@ -48,40 +102,91 @@ class Resolver:
 
         return new, unused
 
+    def canonicalize_kwargs(self, kw):
+        """Return 'kw' with the values of the arguments this resolver (or
+        ``ZODB.DB.DB``) interprets in canonical string form.
+        """
+        new, unused = self.interpret_kwargs(kw)
+        canonical = _canonicalize_dbkw(unused)
+        for arg_name, value in new.items():
+            if isinstance(value, tuple):
+                value = ','.join(value)
+            canonical[arg_name] = str(value)
+        return canonical
+
+
+class InvalidMemoryStorageURI(ValueError):
+
+    def __init__(self, uri, why):
+        self.uri = uri
+        self.why = why
+        super().__init__(f"memory: invalid uri {uri} : {why}")
+
 
 class MappingStorageURIResolver(Resolver):
+    _int_args = ('shared',)
+    _string_args = ('from', 'mapped')
+    _bytesize_args = ('spill_size',)
 
     def __call__(self, uri):
-        prefix, rest = uri.split('memory://', 1)
-        result = rest.split('?', 1)
-        if len(result) == 1:
-            name = result[0]
-            query = ''
-        else:
-            name, query = result
+        name, query = _split_uri(uri, 'memory://')
         kw = dict(parse_qsl(query))
         kw, unused = self.interpret_kwargs(kw)
         args = (name,)
-        def factory():
-            return MappingStorage(*args)
+        if 'mapped' in kw:
+            if 'spill_size' in kw:
+                raise InvalidMemoryStorageURI(
+                    uri, 'spill_size with read-only mapped storage')
+            path = kw.pop('mapped')
+            from_uri = kw.pop('from', None)
+            def mapping_factory():
+                if from_uri is not None and not os.path.exists(path):
+                    source_factory, _ = _get_uri_factory_and_dbkw(from_uri)
+                    source = source_factory()
+                    try:
+                        write_mapped(source, path)
+                    finally:
+                        source.close()
+                return MappedStorage(path, name or None)
+        elif 'from' in kw:
+            from_uri = kw.pop('from')
+            def mapping_factory():
+                return clone_snapshot(load_snapshot(from_uri), *args)
+        else:
+            def mapping_factory():
+                return MappingStorage(*args)
+        if 'spill_size' in kw:
+            spill_size = kw.pop('spill_size')
+            def storage_factory():
+                return SpillStorage(*args, spill_size, mapping_factory)
+        else:
+            storage_factory = mapping_factory
+        if kw.pop('shared', False):
+            def factory():
+                return open_shared(name, storage_factory)
+        else:
+            factory = storage_factory
         return factory, unused
 
+    def canonicalize(self, uri):
+        name, query = _split_uri(uri, 'memory://')
+        kw = self.canonicalize_kwargs(dict(parse_qsl(query)))
+        if 'from' in kw:
+            kw['from'] = canonicalize(kw['from'])
+        return f'memory://{name}{_canonical_query(kw)}'
+
 
 class FileStorageURIResolver(Resolver):
-    # XXX missing: blob_dir, packer, pack_keep_old, pack_gc, stop
-    _int_args = ('create', 'read_only', 'demostorage')
-    _string_args = ('blobstorage_dir', 'blobstorage_layout')
-    _bytesize_args = ('quota',)
+    # XXX missing: blob_dir, packer, stop
+    _int_args = ('create', 'read_only', 'demostorage', 'pack_gc',
+                 'pack_keep_old')
+    _string_args = ('blobstorage_dir', 'blobstorage_layout', 'pack_window')
+    _bytesize_args = ('quota', 'pack_rate')
+    _float_args = ('pack_interval', 'pack_days')
 
     def __call__(self, uri):
         # we can't use urlsplit here due to Windows filenames
-        prefix, rest = uri.split('file://', 1)
-        result = rest.split('?', 1)
-        if len(result) == 1:
-            path = result[0]
-            query = ''
-        else:
-            path, query = result
+        path, query = _split_uri(uri, 'file://')
         path = os.path.normpath(path)
         args = (path,)
         kw = dict(parse_qsl(query))
@@ -101,6 +206,19 @@ class FileStorageURIResolver(Resolver):
         if 'blobstorage_layout' in kw:
             blobstorage_layout = kw.pop('blobstorage_layout')
 
+        if 'pack_rate' in kw:
+            kw['packer'] = throttled_packer(kw.pop('pack_rate'))
+
+        packkw = {
+            name: kw.pop(name)
+            for name in ('pack_interval', 'pack_days', 'pack_window')
+            if name in kw
+        }
+        if 'pack_interval' in packkw:
+            unused['databases'] = DatabaseMapping([pack_hook(**packkw)])
+        elif packkw:
+            raise MissingPackInterval(packkw)
+
         if demostorage and blobstorage_dir:
             def factory():
                 filestorage = FileStorage(*args, **kw)
@@ -122,16 +240,36 @@ class FileStorageURIResolver(Resolver):
 
         return factory, unused
 
+    def canonicalize(self, uri):
+        path, query = _split_uri(uri, 'file://')
+        path = os.path.normpath(path)
+        kw = self.canonicalize_kwargs(dict(parse_qsl(query)))
+        return f'file://{path}{_canonical_query(kw)}'
+
 
 class ClientStorageURIResolver(Resolver):
     _int_args = ('debug', 'min_disconnect_poll', 'max_disconnect_poll',
                  'wait_for_server_on_startup', 'wait', 'wait_timeout',
                  'read_only', 'read_only_fallback', 'shared_blob_dir',
                  'demostorage', 'drop_cache_rather_verify',
-                 'blob_cache_size_check')
+                 'blob_cache_size_check', 'verify_slots')
     _string_args = ('storage', 'name', 'client', 'var', 'username',
-                    'password', 'realm', 'blob_dir', 'client_label')
-    _bytesize_args = ('cache_size', 'blob_cache_size')
+                    'password', 'realm', 'blob_dir', 'client_label',
+                    'cache_verify', 'cache_prewarm', 'verify_lock',
+                    'cache_budget_dir', 'unix_socket')
+    _bytesize_args = ('blob_cache_size',)
+    _float_args = ('reconnect_backoff', 'reconnect_backoff_max',
+                   'reconnect_jitter', 'cache_budget_interval')
+    _default_port = 9991
+
+    def interpret_kwargs(self, kw):
+        # 'cache_size' is a bytesize, possibly shared by the host's clients.
+        cache_size = kw.get('cache_size')
+        new, unused = super().interpret_kwargs(
+            {k: v for k, v in kw.items() if k != 'cache_size'})
+        if cache_size is not None:
+            new['cache_size'] = convert_cache_size(cache_size)
+        return new, unused
 
     def __call__(self, uri):
         # urlsplit doesnt understand zeo URLs so force to something that
@@ -143,7 +281,7 @@ class ClientStorageURIResolver(Resolver):
             host = u.hostname
             port = u.port
             if port is None:
-                port = 9991
+                port = self._default_port
             if host is None:  # zeo://:123 used to parse into ('', 123) on py2
                 host = ''
             args = ((host, port),)
@@ -153,17 +291,120 @@ class ClientStorageURIResolver(Resolver):
             args = (path,)
         kw = dict(parse_qsl(u.query))
         kw, unused = self.interpret_kwargs(kw)
+
+        cache_verify = kw.pop('cache_verify', None)
+        if cache_verify is not None:
+            if cache_verify not in CACHE_VERIFY_MODES:
+                raise InvalidCacheVerifyMode(cache_verify)
+            if cache_verify != 'drop':
+                kw['wait'] = int(cache_verify == 'startup')
+
+        cache_prewarm = kw.pop('cache_prewarm', None)
+
+        # Unix socket preferred, when available, to the TCP address.
+        unix_socket = kw.pop('unix_socket', None)
+        if not u.netloc:
+            unix_socket = None
+        elif unix_socket == AUTO_UNIX_SOCKET:
+            unix_socket = (
+                default_unix_socket(args[0]) if is_local_host(host) else None)
+        elif unix_socket:
+            unix_socket = os.path.normpath(unix_socket)
+
+        reconnect_backoff = kw.pop('reconnect_backoff', None)
+        reconnect_backoff_max = kw.pop(
+            'reconnect_backoff_max', DEFAULT_RECONNECT_BACKOFF_MAX)
+        reconnect_jitter = kw.pop('reconnect_jitter', DEFAULT_RECONNECT_JITTER)
+        if not 0 <= reconnect_jitter <= 1:
+            raise InvalidReconnectJitter(reconnect_jitter)
+        slots = None
+        verify_slots = kw.pop('verify_slots', None)
+        verify_lock = kw.pop('verify_lock', None)
+        if verify_slots:
+            slots = VerificationSlots(
+                verify_lock or default_verify_lock(
+                    args[0], kw.get('storage', '1')),
+                verify_slots)
+
+        budget = None
+        cache_budget_dir = kw.pop('cache_budget_dir', None)
+        cache_budget_interval = kw.pop(
+            'cache_budget_interval', DEFAULT_CACHE_BUDGET_INTERVAL)
+        if isinstance(kw.get('cache_size'), HostCacheSize):
+            budget = HostCacheBudget(
+                kw['cache_size'],
+                cache_budget_dir or default_cache_budget_dir(
+                    args[0], kw.get('storage', '1')))
+
+        def client_storage():
+            storage_kw = kw
+            member = None
+            if budget is not None:
+                member = budget.join()
+                storage_kw = dict(kw, cache_size=budget.share())
+            try:
+                storage = _client_storage(storage_kw)
+            except BaseException:
+                if member is not None:
+                    budget.leave(member)
+                raise
+            if member is not None:
+                share_cache_budget(
+                    storage, budget, member, cache_budget_interval)
+            return storage
+
+        def _client_storage(storage_kw):
+            if cache_verify == 'drop':
+                storage_kw = dict(
+                    storage_kw, cache=open_dropped_cache(storage_kw))
+            addr = args[0]
+            address = None
+            if unix_socket:
+                # Chosen again each time the client reconnects.
+                address = functools.partial(
+                    prefer_unix_socket, args[0], unix_socket)
+                addr = address()
+                # Name the storage after its URI's address either way.
+                storage_kw = dict(storage_kw)
+                storage_kw.setdefault('name', str(args[0]))
+            if reconnect_backoff or slots is not None or address is not None:
+                backoff = None
+                if reconnect_backoff:
+                    backoff = Backoff(
+                        reconnect_backoff, reconnect_backoff_max,
+                        reconnect_jitter)
+                client_factory = functools.partial(
+                    ClientThread, backoff=backoff, slots=slots,
+                    address=address)
+                storage_kw = dict(storage_kw, _client_factory=client_factory)
+            storage = ClientStorage(addr, **storage_kw)
+            if cache_prewarm is not None:
+                warm_cache(storage, cache_prewarm,
+                           wait=cache_verify == 'startup')
+            return storage
+
         if 'demostorage' in kw:
             kw.pop('demostorage')
             warnings.warn("demostorage option is deprecated, use demo:// instead",
                           DeprecationWarning)
             def factory():
-                return DemoStorage(base=ClientStorage(*args, **kw))
+                return DemoStorage(base=client_storage())
         else:
-            def factory():
-                return ClientStorage(*args, **kw)
+            factory = client_storage
         return factory, unused
 
+    def canonicalize(self, uri):
+        u = urlsplit(uri.replace('zeo://', 'http://', 1))
+        if u.netloc:
+            host = u.hostname or ''
+            if ':' in host:
+                host = f'[{host}]'
+            location = f'{host}:{u.port or self._default_port}'
+        else:
+            location = os.path.normpath(u.path)
+        kw = self.canonicalize_kwargs(dict(parse_qsl(u.query)))
+        return f'zeo://{location}{_canonical_query(kw)}'
+
 
 class ZConfigURIResolver:
 
@@ -181,6 +422,15 @@ class ZConfigURIResolver:
         schema_xml = self.schema_xml_template
         schema = loadSchemaFile(BytesIO(schema_xml))
         config, handler = loadConfig(schema, path)
+        # Query string arguments, e.g. 'lazy' or 'fork_safe', apply to
+        # database sections too, overriding the section's own.
+        querykw = dict(parse_qsl(query))
+
+        if frag == '*':
+            factory, dbkw = self._multidatabase(config.databases)
+            dbkw.update(querykw)
+            return factory, dbkw
+
         for config_item in config.databases + config.storages:
             if not frag:
                 # use the first defined in the file
@@ -192,19 +442,79 @@ class ZConfigURIResolver:
             raise KeyError("No storage or database named %s found" % frag)
 
         if isinstance(config_item, ZODBDatabase):
-            config = config_item.config
-            factory = config.storage
-            dbkw = {'connection_' + name: getattr(config, name)
-                    for name in CONNECTION_PARAMETERS
-                    if getattr(config, name) is not None}
-            if config.database_name:
-                dbkw['database_name'] = config.database_name
+            factory = config_item.config.storage
+            dbkw = self._database_dbkw(config_item.config)
+            dbkw.update(querykw)
         else:
             factory = config_item
-            dbkw = dict(parse_qsl(query))
+            dbkw = querykw
 
         return factory.open, dbkw
 
+    def canonicalize(self, uri):
+        (scheme, netloc, path, query, frag) = urlsplit(uri)
+        path = os.path.normpath(path)
+        query = _canonical_query(_canonicalize_dbkw(dict(parse_qsl(query))))
+        frag = f'#{frag}' if frag else ''
+        return f'zconfig://{path}{query}{frag}'
+
+    def _database_dbkw(self, config):
+        dbkw = {'connection_' + name: getattr(config, name)
+                for name in CONNECTION_PARAMETERS
+                if getattr(config, name) is not None}
+        if config.database_name:
+            dbkw['database_name'] = config.database_name
+        return dbkw
+
+    def _multidatabase(self, databases):
+        # Resolve the first database, as for an empty fragment, but share a
+        # multi-database mapping with the others, which its factory opens.
+        if not databases:
+            raise KeyError("No databases found")
+
+        first, others = databases[0], databases[1:]
+        for config_item in databases:
+            # Mimic 'ZODB.config.ZODBDatabase.open', which defaults the
+            # database name to the section name.
+            if not config_item.config.database_name:
+                config_item.config.database_name = config_item.name
+        multidatabase = DatabaseMapping()
+        dbkw = self._database_dbkw(first.config)
+        dbkw['databases'] = multidatabase
+
+        def factory():
+            # Databases closed since an earlier call are replaced;  those
+            # still open, e.g. when a proxy reopens the first database's
+            # storage, are kept.
+            multidatabase.drop_closed()
+            pending = [
+                config_item for config_item in others
+                if config_item.config.database_name not in multidatabase
+            ]
+
+            with ThreadPoolExecutor(len(pending) + 1) as executor:
+                storage_future = executor.submit(first.config.storage.open)
+                db_futures = [
+                    executor.submit(config_item.open, multidatabase)
+                    for config_item in pending
+                ]
+
+            failed = [
+                future for future in [storage_future] + db_futures
+                if future.exception() is not None
+            ]
+            if failed:
+                for future in [storage_future] + db_futures:
+                    if future.exception() is None:
+                        future.result().close()
+                for config_item in pending:
+                    multidatabase.pop(config_item.config.database_name, None)
+                raise failed[0].exception()
+
+            return storage_future.result()
+
+        return factory, dbkw
+
 
 class InvalidDemoStorgeURI(ValueError):
 
@@ -261,9 +571,119 @@ class DemoStorageURIResolver:
 
         return factory, dbkw
 
+    def canonicalize(self, uri):
+        m = self._uri_re.match(uri)
+
+        if m is None:
+            raise InvalidDemoStorgeURI(uri)
+
+        base_uri = canonicalize(m.group('base'))
+        delta_uri = canonicalize(m.group('changes'))
+        frag = m.group('frag')
+        dbkw = _canonicalize_dbkw(dict(parse_qsl(frag[1:]))) if frag else {}
+        return f'demo:({base_uri})/({delta_uri}){_canonical_query(dbkw, "#")}'
+
+
+class InvalidWrapperURI(ValueError):
+
+    def __init__(self, uri, why):
+        self.uri = uri
+        self.why = why
+        scheme = uri.split(':', 1)[0]
+        super().__init__(f"{scheme}: invalid uri {uri} : {why}")
+
+
+class InvalidTraceURI(InvalidWrapperURI):
+    pass
+
+
+class InvalidPrefetchURI(InvalidWrapperURI):
+    pass
+
+
+class WrapperURIResolver(Resolver):
+    """Base class of the resolvers of ``<scheme>:(uri)?query`` URIs,
+    wrapping the storage at 'uri'.
+
+    Query string arguments which the resolver does not interpret, and the
+    database arguments of the wrapped URI, are returned as database
+    arguments.
+    """
+    _scheme = None
+    _invalid_uri = InvalidWrapperURI
+
+    def _match(self, uri):
+        m = re.match(
+            rf'^{self._scheme}:\((?P<uri>.*)\)(?:\?(?P<query>.*))?$', uri)
+        if m is None:
+            raise self._invalid_uri(
+                uri, f'expected {self._scheme}:(uri)?query')
+        return m.group('uri'), dict(parse_qsl(m.group('query') or ''))
+
+    def __call__(self, uri):
+        wrapped_uri, kw = self._match(uri)
+        kw, unused = self.interpret_kwargs(kw)
+        wrappedf, dbkw = _get_uri_factory_and_dbkw(wrapped_uri)
+        return self._wrap(uri, wrappedf, kw), dict(dbkw, **unused)
+
+    def _wrap(self, uri, factory, kw):
+        """Return a factory of the storage wrapping the one returned by
+        'factory', given the interpreted arguments 'kw'.
+        """
+        raise NotImplementedError  # pragma: no cover
+
+    def canonicalize(self, uri):
+        wrapped_uri, kw = self._match(uri)
+        kw = self.canonicalize_kwargs(kw)
+        return (
+            f'{self._scheme}:({canonicalize(wrapped_uri)})'
+            f'{_canonical_query(kw)}'
+        )
+
+
+class TraceURIResolver(WrapperURIResolver):
+
+    # trace:(uri)?out=path...
+    _scheme = 'trace'
+    _invalid_uri = InvalidTraceURI
+    _string_args = ('out',)
+    _float_args = ('flush_interval',)
+
+    def _wrap(self, uri, wrappedf, kw):
+        out = kw.pop('out', None)
+        if not out:
+            raise InvalidTraceURI(uri, 'missing out')
+
+        def factory():
+            return TracingStorage(wrappedf, TraceWriter(out, **kw))
+
+        return factory
+
+
+class PrefetchURIResolver(WrapperURIResolver):
+
+    # prefetch:(uri)?depth=2&workers=4...
+    _scheme = 'prefetch'
+    _invalid_uri = InvalidPrefetchURI
+    _int_args = ('depth', 'workers', 'buffer_size')
+
+    def _wrap(self, uri, wrappedf, kw):
+        if kw.get('depth', 0) < 0:
+            raise InvalidPrefetchURI(uri, 'negative depth')
+        for arg_name in ('workers', 'buffer_size'):
+            if kw.get(arg_name, 1) < 1:
+                raise InvalidPrefetchURI(uri, f'{arg_name} must be positive')
+
+        def factory():
+            return PrefetchingStorage(wrappedf, **kw)
+
+        return factory
+
 
 client_storage_resolver = ClientStorageURIResolver()
 file_storage_resolver = FileStorageURIResolver()
 zconfig_resolver = ZConfigURIResolver()
 mapping_storage_resolver = MappingStorageURIResolver()
 demo_storage_resolver = DemoStorageURIResolver()
+trace_resolver = TraceURIResolver()
+prefetch_resolver = PrefetchURIResolver()
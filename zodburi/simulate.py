@@ -0,0 +1,412 @@
+import bisect
+import struct
+
+from ZEO.cache import allocated_record_overhead
+from ZEO.cache import ZEC_HEADER_SIZE
+
+from zodburi import trace
+from zodburi.stats import _format_size
+
+
+# 1MB to 4GB
+DEFAULT_SIZES = tuple(1 << n for n in range(20, 33))
+# 1024 to about a million objects
+DEFAULT_COUNTS = tuple(1 << n for n in range(10, 21))
+# ZEO's default 'rearrange' ratio
+DEFAULT_REARRANGE = 0.8
+# The recommended size is the smallest whose hit rate is within this of
+# the hit rate of the largest size simulated.
+DEFAULT_TOLERANCE = 0.01
+
+# Normalized trace events
+LOAD = "load"
+STORE = "store"
+INVALIDATE = "invalidate"
+
+# ZEO client cache traces (written when ZEO_CACHE_TRACE is set):  time,
+# code (data length << 8 + event code), oid length, tid, end tid, then oid.
+ZEO_TRACE_RECORD = struct.Struct(">iiH8s8s")
+ZEO_LOAD_CODES = (0x20, 0x22)
+ZEO_STORE_CURRENT = 0x52
+ZEO_INVALIDATE = 0x10
+
+
+class InvalidTrace(ValueError):
+    def __init__(self, path, why):
+        self.path = path
+        self.why = why
+        super().__init__(f"Invalid trace {path!r}: {why}")
+
+
+def read_events(path):
+    """Iterate over the events of the trace at 'path', as (event, oid,
+    tid, size) tuples.
+
+    The trace is either written by the ``trace:`` scheme (see
+    :mod:`zodburi.trace`), or a ZEO client cache trace.  'event' is
+    :data:`LOAD` (of a record of 'size' bytes, 0 if unknown), :data:`STORE`
+    (of a new revision, 'tid' None if unknown) or :data:`INVALIDATE`.
+    """
+    with open(path, "rb") as f:
+        magic = f.read(len(trace.MAGIC))
+    if magic == trace.MAGIC:
+        return _read_trace_events(path)
+    return _read_zeo_events(path)
+
+
+def _read_trace_events(path):
+    for record in trace.read_trace(path):
+        if record.event == "store":
+            # The tid of the new revision is not known until committed.
+            yield STORE, record.oid, None, record.size
+        elif record.size:
+            yield LOAD, record.oid, record.tid, record.size
+
+
+def _read_zeo_events(path):
+    unpack = ZEO_TRACE_RECORD.unpack
+    size = ZEO_TRACE_RECORD.size
+    with open(path, "rb") as f:
+        read = f.read
+        while True:
+            header = read(size)
+            if len(header) < size:
+                return
+            t, code, oid_length, tid, end_tid = unpack(header)
+            if t == 0:
+                # A misaligned record, left by a crash:  like ZEO's
+                # cache_simul.py, skip 8 bytes and try again.
+                f.seek(f.tell() - size + 8)
+                continue
+            oid = read(oid_length)
+            if len(oid) < oid_length:
+                return
+
+            length, code = (code & 0x7fffff00) >> 8, code & 0x7e
+            if code in ZEO_LOAD_CODES:
+                yield LOAD, oid, tid, length
+            elif code == ZEO_STORE_CURRENT:
+                yield STORE, oid, tid, length
+            elif code & 0x70 == ZEO_INVALIDATE:
+                yield INVALIDATE, oid, tid, 0
+            elif code & 0x70 not in (0x00, 0x20, 0x40, 0x50):
+                raise InvalidTrace(path, f"unknown event code 0x{code:x}")
+
+
+class LRUSimulation:
+    """Simulate least-recently-used caches of all the 'counts' (in objects)
+    and 'sizes' (in bytes) at once.
+
+    LRU caches are stack algorithms:  a load hits in a cache of n objects
+    (or bytes) if the objects used since the object's last use, with it,
+    number (or weigh) at most n.  These reuse distances are computed with
+    Fenwick trees over the objects' last uses, so each event costs time
+    logarithmic in the number of objects, whatever the number of sizes.
+    """
+
+    def __init__(self, counts=DEFAULT_COUNTS, sizes=DEFAULT_SIZES):
+        self.counts = sorted(counts)
+        self.sizes = sorted(sizes)
+        self.loads = 0
+        # The number of loads hitting first in each count and size, the
+        # last items counting those missing in all.
+        self._count_hits = [0] * (len(self.counts) + 1)
+        self._size_hits = [0] * (len(self.sizes) + 1)
+        # oid -> (slot of last use, size)
+        self._objects = {}
+        self._total_size = 0
+        self._reset(1 << 10)
+
+    def _reset(self, capacity):
+        # Number the objects' last uses from 1, in order, in new trees.
+        objects = sorted(self._objects.items(), key=lambda item: item[1][0])
+        counts = [0] * (capacity + 1)
+        sizes = [0] * (capacity + 1)
+        for slot, (oid, (_, size)) in enumerate(objects, 1):
+            self._objects[oid] = slot, size
+            counts[slot] = 1
+            sizes[slot] = size
+        # Build the trees in linear time.
+        for i in range(1, capacity + 1):
+            parent = i + (i & -i)
+            if parent <= capacity:
+                counts[parent] += counts[i]
+                sizes[parent] += sizes[i]
+        self._capacity = capacity
+        self._counts = counts
+        self._sizes = sizes
+        self._slot = len(objects)
+
+    def _add(self, slot, count, size):
+        counts, sizes, capacity = self._counts, self._sizes, self._capacity
+        while slot <= capacity:
+            counts[slot] += count
+            sizes[slot] += size
+            slot += slot & -slot
+
+    def _prefix(self, slot):
+        counts, sizes = self._counts, self._sizes
+        count = size = 0
+        while slot:
+            count += counts[slot]
+            size += sizes[slot]
+            slot -= slot & -slot
+        return count, size
+
+    def _remove(self, oid):
+        slot, size = self._objects.pop(oid)
+        self._add(slot, -1, -size)
+        self._total_size -= size
+        return slot, size
+
+    def _use(self, oid, size):
+        if self._slot == self._capacity:
+            self._reset(max(2 * len(self._objects), 1 << 10))
+        self._slot += 1
+        self._objects[oid] = self._slot, size
+        self._add(self._slot, 1, size)
+        self._total_size += size
+
+    def load(self, oid, size):
+        self.loads += 1
+        last = self._objects.get(oid)
+        if last is None:
+            self._count_hits[-1] += 1
+            self._size_hits[-1] += 1
+            if size:
+                self._use(oid, size)
+            return
+
+        slot, old_size = last
+        count, used = self._prefix(slot)
+        distance = len(self._objects) - count + 1
+        self._count_hits[bisect.bisect_left(self.counts, distance)] += 1
+        used = self._total_size - used + old_size
+        self._size_hits[bisect.bisect_left(self.sizes, used)] += 1
+        self._remove(oid)
+        self._use(oid, size or old_size)
+
+    def store(self, oid, tid, size):
+        if oid in self._objects:
+            self._remove(oid)
+        self._use(oid, size)
+
+    def invalidate(self, oid):
+        if oid in self._objects:
+            self._remove(oid)
+
+    def _hit_rates(self, hits):
+        rates = []
+        total = 0
+        for n in hits[:-1]:
+            total += n
+            rates.append(total / self.loads if self.loads else 0.0)
+        return rates
+
+    def count_hit_rates(self):
+        """Return the hit rates of the caches of :attr:`counts` objects."""
+        return self._hit_rates(self._count_hits)
+
+    def size_hit_rates(self):
+        """Return the hit rates of the caches of :attr:`sizes` bytes."""
+        return self._hit_rates(self._size_hits)
+
+
+class ZEOCacheSimulation:
+    """Simulate a ZEO client cache of 'size' bytes.
+
+    Like ``ZEO.cache.ClientCache``, records are written in turn around a
+    circular file, evicting the records they overwrite, and records loaded
+    while in the oldest 'rearrange' fraction of the file are moved forward.
+    Only current revisions are simulated.
+    """
+
+    def __init__(self, size, rearrange=DEFAULT_REARRANGE):
+        self.size = size
+        self.rearrange = rearrange * size
+        self.loads = self.hits = 0
+        self._offset = ZEC_HEADER_SIZE
+        # offset -> (block size, oid or None for free blocks)
+        self._blocks = {ZEC_HEADER_SIZE: (size - ZEC_HEADER_SIZE, None)}
+        # oid -> (offset, tid)
+        self._current = {}
+
+    def load(self, oid, size):
+        self.loads += 1
+        current = self._current.get(oid)
+        if current is None:
+            if size:
+                self._store(oid, None, size)
+            return
+
+        self.hits += 1
+        offset, tid = current
+        block_size = self._blocks[offset][0]
+        distance = self._offset - offset
+        if distance < 0:
+            distance += self.size
+        record_size = block_size - allocated_record_overhead
+        if distance > self.rearrange and self.size > 10 * record_size:
+            self._remove(oid)
+            self._store(oid, tid, record_size)
+
+    def store(self, oid, tid, size):
+        current = self._current.get(oid)
+        if current is not None:
+            if tid is not None and current[1] == tid:
+                return
+            self._remove(oid)
+        self._store(oid, tid, size)
+
+    def invalidate(self, oid):
+        if oid in self._current:
+            self._remove(oid)
+
+    def _remove(self, oid):
+        offset, _ = self._current.pop(oid)
+        self._blocks[offset] = self._blocks[offset][0], None
+
+    def _store(self, oid, tid, size):
+        size += allocated_record_overhead
+        if size >= self.size - ZEC_HEADER_SIZE:
+            return  # ZEO does not cache records larger than the cache
+
+        # Like ZEO, keep a free block after the record.
+        available = self._make_room(size + 1)
+        self._blocks[self._offset] = size, oid
+        self._current[oid] = self._offset, tid
+        self._offset += size
+        self._blocks[self._offset] = available - size, None
+
+    def _make_room(self, needed):
+        if self._offset + needed > self.size:
+            self._offset = ZEC_HEADER_SIZE
+        offset = self._offset
+        blocks = self._blocks
+        while needed > 0:
+            size, oid = blocks.pop(offset)
+            if oid is not None:
+                del self._current[oid]
+            needed -= size
+            offset += size
+        return offset - self._offset
+
+    @property
+    def hit_rate(self):
+        return self.hits / self.loads if self.loads else 0.0
+
+
+class SimulationResults:
+    """The hit rates of the caches simulated by :func:`simulate`.
+
+    'lru_counts' and 'lru_sizes' are lists of (count or size, hit rate) for
+    LRU caches of a number of objects or bytes, 'zeo_sizes' of (size, hit
+    rate) for ZEO client caches.
+    """
+
+    def __init__(self, loads, objects, lru_counts, lru_sizes, zeo_sizes):
+        self.loads = loads
+        self.objects = objects
+        self.lru_counts = lru_counts
+        self.lru_sizes = lru_sizes
+        self.zeo_sizes = zeo_sizes
+
+    def recommendations(self, tolerance=DEFAULT_TOLERANCE):
+        """Return recommended parameters (as for the query string of a URI):
+        for each kind of cache, the smallest size with a hit rate within
+        'tolerance' of the largest simulated.
+        """
+        recommended = {}
+        for name, curve in [
+            ("connection_cache_size", self.lru_counts),
+            ("connection_cache_size_bytes", self.lru_sizes),
+            ("cache_size", self.zeo_sizes),
+        ]:
+            if curve and self.loads:
+                best = curve[-1][1]
+                recommended[name] = min(
+                    size for size, rate in curve if rate >= best - tolerance)
+        return recommended
+
+    def as_dict(self, tolerance=DEFAULT_TOLERANCE):
+        return {
+            "loads": self.loads,
+            "objects": self.objects,
+            "lru_counts": [list(point) for point in self.lru_counts],
+            "lru_sizes": [list(point) for point in self.lru_sizes],
+            "zeo_sizes": [list(point) for point in self.zeo_sizes],
+            "recommendations": self.recommendations(tolerance),
+        }
+
+
+def simulate(path, counts=DEFAULT_COUNTS, sizes=DEFAULT_SIZES,
+             rearrange=DEFAULT_REARRANGE, zeo=True):
+    """Replay the trace at 'path' (see :func:`read_events`) through LRU
+    caches of 'counts' objects and of 'sizes' bytes and, if 'zeo' is true,
+    through ZEO client caches of 'sizes' bytes, and return the
+    :class:`SimulationResults`.
+
+    The trace is streamed:  memory use depends on the number of objects it
+    references, not on its length.
+    """
+    counts = sorted(counts)
+    sizes = sorted(sizes)
+    lru = LRUSimulation(counts, sizes)
+    caches = [lru]
+    zeo_caches = []
+    if zeo:
+        zeo_caches = [ZEOCacheSimulation(size, rearrange) for size in sizes]
+        caches += zeo_caches
+    loads = [cache.load for cache in caches]
+    stores = [cache.store for cache in caches]
+    invalidates = [cache.invalidate for cache in caches]
+    objects = set()
+
+    for event, oid, tid, size in read_events(path):
+        objects.add(oid)
+        if event == LOAD:
+            for load in loads:
+                load(oid, size)
+        elif event == STORE:
+            for store in stores:
+                store(oid, tid, size)
+        else:
+            for invalidate in invalidates:
+                invalidate(oid)
+
+    return SimulationResults(
+        lru.loads,
+        len(objects),
+        list(zip(counts, lru.count_hit_rates())),
+        list(zip(sizes, lru.size_hit_rates())),
+        [(cache.size, cache.hit_rate) for cache in zeo_caches],
+    )
+
+
+def format_results(results, tolerance=DEFAULT_TOLERANCE):
+    """Return a report of 'results', a :class:`SimulationResults`, with a
+    hit rate curve per kind of cache.
+    """
+    lines = [
+        f"Loads: {results.loads}",
+        f"Objects: {results.objects}",
+    ]
+    for title, curve, format_size in [
+        ("LRU cache, by objects (connection_cache_size)",
+         results.lru_counts, str),
+        ("LRU cache, by size (connection_cache_size_bytes)",
+         results.lru_sizes, _format_size),
+        ("ZEO client cache (cache_size)", results.zeo_sizes, _format_size),
+    ]:
+        if not curve:
+            continue
+        lines += ["", title, f"  {'Size':>10} {'Hit rate':>9}"]
+        for size, rate in curve:
+            bar = "#" * round(rate * 40)
+            lines.append(f"  {format_size(size):>10} {rate:>9.1%} {bar}")
+
+    lines += ["", "Recommended parameters:"]
+    for name, value in results.recommendations(tolerance).items():
+        lines.append(f"  {name}={value}")
+
+    return "\n".join(lines)
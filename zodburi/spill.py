@@ -0,0 +1,129 @@
+import logging
+import os
+import shutil
+import tempfile
+import threading
+
+from ZODB.Connection import TransactionMetaData
+from ZODB.FileStorage import FileStorage
+from ZODB.MappingStorage import MappingStorage
+
+from zodburi.proxy import StorageProxy
+
+
+logger = logging.getLogger(__name__)
+
+
+def _copy_transactions(source, destination):
+    # Like 'destination.copyTransactionsFrom(source)', which fails for a
+    # 'MappingStorage' source:  its transaction records lack
+    # 'extension_bytes'.
+    for txn in source.iterator():
+        metadata = TransactionMetaData(
+            txn.user, txn.description, txn.extension)
+        destination.tpc_begin(metadata, txn.tid, txn.status)
+        for record in txn:
+            destination.restore(
+                record.oid, record.tid, record.data, '', record.data_txn,
+                metadata,
+            )
+        destination.tpc_vote(metadata)
+        destination.tpc_finish(metadata)
+
+
+class SpillStorage(StorageProxy):
+    """Keep committed data in a ``MappingStorage`` until it grows too large.
+
+    Once the size of the records committed exceeds 'spill_size' bytes, the
+    transactions are copied into a ``FileStorage`` in a temporary directory,
+    which is used from then on.  The directory is removed when the storage
+    is closed.
+
+    Meant as the changes storage of a ``DemoStorage``, e.g.
+    ``demo:(file:///Data.fs)/(memory://?spill_size=64mb)``.
+
+    'factory', if not None, is a no-arg callable returning the
+    ``MappingStorage`` to start with, e.g. one seeded with data.
+    """
+    def __init__(self, name, spill_size, factory=None):
+        self._spill_size = spill_size
+        self._size = 0
+        self._path = None
+        self._commit_lock = threading.Lock()
+        self._transaction = None
+        self._tsize = 0
+        if factory is None:
+            factory = lambda: MappingStorage(name)
+        super().__init__(factory)
+
+    def stats(self):
+        """Return a dict describing the size of the committed data.
+
+        - 'size' is the total size, in bytes, of the records committed.
+        - 'spill_size' is the size beyond which they are spilled to disk.
+        - 'spilled' is true once they have been.
+        - 'path' is the path of the FileStorage spilled to, or None.
+        """
+        return {
+            "size": self._size,
+            "spill_size": self._spill_size,
+            "spilled": self._path is not None,
+            "path": self._path,
+        }
+
+    def tpc_begin(self, transaction, *args):
+        self._commit_lock.acquire()
+        try:
+            self._get_storage().tpc_begin(transaction, *args)
+        except BaseException:
+            self._commit_lock.release()
+            raise
+        self._transaction = transaction
+        self._tsize = 0
+
+    def store(self, oid, serial, data, version, transaction):
+        result = self._get_storage().store(
+            oid, serial, data, version, transaction)
+        if transaction is self._transaction:
+            self._tsize += len(data)
+        return result
+
+    def tpc_finish(self, transaction, *args):
+        tid = self._get_storage().tpc_finish(transaction, *args)
+        self._size += self._tsize
+        self._transaction = None
+        try:
+            if self._path is None and self._size > self._spill_size:
+                self._spill()
+        finally:
+            self._commit_lock.release()
+        return tid
+
+    def tpc_abort(self, transaction):
+        self._get_storage().tpc_abort(transaction)
+        if transaction is self._transaction:
+            self._transaction = None
+            self._commit_lock.release()
+
+    def _spill(self):
+        # Caller holds 'self._commit_lock', so nothing is being committed.
+        mapping = self._get_storage()
+        path = os.path.join(
+            tempfile.mkdtemp(prefix="zodburi-spill-"), "Data.fs")
+        filestorage = FileStorage(path, create=True)
+        _copy_transactions(mapping, filestorage)
+
+        with self._lock:
+            self._storage, self._path = filestorage, path
+
+        # In-flight reads may still be using 'mapping', so leave it open.
+        # Its name is empty for e.g. 'memory://?spill_size=64mb'.
+        logger.warning(
+            "%s: spilled %d bytes of changes to %s",
+            mapping.getName() or "memory storage", self._size, path,
+        )
+
+    def close(self):
+        super().close()
+        if self._path is not None:
+            shutil.rmtree(os.path.dirname(self._path), ignore_errors=True)
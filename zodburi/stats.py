@@ -0,0 +1,306 @@
+from concurrent.futures import ProcessPoolExecutor
+import collections
+import functools
+import os
+from urllib.parse import parse_qsl
+from urllib.parse import urlencode
+from urllib.parse import urlsplit
+from urllib.parse import urlunsplit
+
+from ZODB.blob import is_blob_record
+from ZODB.interfaces import IBlobStorage
+from ZODB.POSException import POSKeyError
+from ZODB.utils import get_pickle_metadata
+from ZODB.utils import p64
+from ZODB.utils import u64
+
+
+DEFAULT_CACHE_BUDGET = 256 << 20
+# Rough ratio of the memory used by a loaded object to its record size.
+OBJECT_OVERHEAD = 3
+# Record size percentile above which records are considered large.
+LARGE_RECORD_PERCENTILE = 0.999
+MIN_LARGE_RECORD_SIZE = 1 << 20
+
+
+def _bucket(size):
+    # The histogram bucket of 'size':  n for sizes up to 2**n bytes.
+    return max(size - 1, 0).bit_length()
+
+
+class ClassStats:
+    """Count, total size and size histogram of the current records of the
+    objects of one class.
+
+    The histogram maps n to the number of records of more than 2**(n-1)
+    and at most 2**n bytes.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.bytes = 0
+        self.max = 0
+        self.histogram = collections.Counter()
+
+    def add(self, size):
+        self.count += 1
+        self.bytes += size
+        self.max = max(self.max, size)
+        self.histogram[_bucket(size)] += 1
+
+    def update(self, other):
+        self.count += other.count
+        self.bytes += other.bytes
+        self.max = max(self.max, other.max)
+        self.histogram.update(other.histogram)
+
+    @property
+    def mean(self):
+        return self.bytes / self.count if self.count else 0
+
+    def percentile(self, fraction):
+        """Return the upper bound of the histogram bucket holding the
+        'fraction' percentile of the record sizes.
+        """
+        seen = 0
+        for bucket in sorted(self.histogram):
+            seen += self.histogram[bucket]
+            if seen >= fraction * self.count:
+                return 1 << bucket
+        return 0
+
+    def as_dict(self):
+        return {
+            "count": self.count,
+            "bytes": self.bytes,
+            "max": self.max,
+            "histogram": {
+                str(1 << bucket): n
+                for bucket, n in sorted(self.histogram.items())
+            },
+        }
+
+
+class StorageStats:
+    """Statistics of the current objects of a storage, by class."""
+
+    def __init__(self, name=None):
+        self.name = name
+        self.transactions = 0
+        self.classes = collections.defaultdict(ClassStats)
+        self.blobs = 0
+        self.blob_bytes = 0
+
+    @property
+    def total(self):
+        total = ClassStats()
+        for class_stats in self.classes.values():
+            total.update(class_stats)
+        return total
+
+    def recommendations(self, cache_budget=DEFAULT_CACHE_BUDGET):
+        """Return recommended connection parameters (as for the query
+        string of a URI) for a connection cache of at most 'cache_budget'
+        bytes.
+
+        ``connection_cache_size`` is the number of objects of mean size
+        fitting in the budget (all of them, if they fit),
+        ``connection_cache_size_bytes`` the memory they take and
+        ``connection_large_record_size`` the bucket bound of the 99.9th
+        percentile of record sizes, so that only outliers are logged.
+        """
+        total = self.total
+        object_size = max(total.mean, 1) * OBJECT_OVERHEAD
+        cache_size = max(min(total.count, int(cache_budget / object_size)), 1)
+        return {
+            "connection_cache_size": cache_size,
+            "connection_cache_size_bytes": int(cache_size * object_size),
+            "connection_large_record_size": max(
+                total.percentile(LARGE_RECORD_PERCENTILE),
+                MIN_LARGE_RECORD_SIZE),
+        }
+
+    def as_dict(self, cache_budget=DEFAULT_CACHE_BUDGET):
+        return {
+            "name": self.name,
+            "transactions": self.transactions,
+            "objects": self.total.as_dict(),
+            "classes": {
+                name: class_stats.as_dict()
+                for name, class_stats in sorted(self.classes.items())
+            },
+            "blobs": {"count": self.blobs, "bytes": self.blob_bytes},
+            "recommendations": self.recommendations(cache_budget),
+        }
+
+
+def scan_storage(storage, start=None, stop=None):
+    """Scan the transactions of 'storage' from 'start' to 'stop' (both
+    included, None meaning from the first or up to the last) and return a
+    (transaction count, records) pair.
+
+    'records' maps the oid of each object written in the range to the
+    (tid, class name, size, blob size) of its last record;  the class name
+    is None for a deleted object, the blob size None for non-blobs.
+    """
+    blobs = IBlobStorage.providedBy(storage)
+    transactions = 0
+    records = {}
+    for txn in storage.iterator(start, stop):
+        transactions += 1
+        for record in txn:
+            data = record.data
+            if data is None:
+                records[record.oid] = (record.tid, None, 0, None)
+                continue
+
+            blob_size = None
+            if blobs and is_blob_record(data):
+                try:
+                    blob_size = os.path.getsize(
+                        storage.loadBlob(record.oid, record.tid))
+                except POSKeyError:
+                    blob_size = 0
+            module, name = get_pickle_metadata(data)
+            records[record.oid] = (
+                record.tid, f"{module}.{name}", len(data), blob_size)
+    return transactions, records
+
+
+def _open_storage(uri):
+    from zodburi import resolve_uri
+
+    factory, _ = resolve_uri(uri)
+    return factory()
+
+
+def _scan_uri(uri, start=None, stop=None):
+    storage = _open_storage(uri)
+    try:
+        return scan_storage(storage, start, stop)
+    finally:
+        storage.close()
+
+
+# Schemes whose storages are opened read-only with 'read_only=true'.
+READ_ONLY_SCHEMES = ("file", "zeo")
+
+
+def _read_only_uri(uri):
+    # 'uri', opening its storage read-only, and never creating it, if its
+    # scheme allows.
+    scheme, netloc, path, query, fragment = urlsplit(uri)
+    if scheme not in READ_ONLY_SCHEMES:
+        return uri
+    params = dict(parse_qsl(query, keep_blank_values=True))
+    params.pop("create", None)
+    params["read_only"] = "true"
+    return urlunsplit((scheme, netloc, path, urlencode(params), fragment))
+
+
+def _ranges(first, last, count):
+    # Split the tids from 'first' to 'last' into up to 'count' ranges.
+    first, last = u64(first), u64(last)
+    step = max((last - first + 1) // count, 1)
+    starts = list(range(first, last + 1, step))[:count]
+    stops = [start - 1 for start in starts[1:]] + [last]
+    return [(p64(start), p64(stop)) for start, stop in zip(starts, stops)]
+
+
+def analyze(uri, workers=None):
+    """Scan the storage at 'uri' and return its :class:`StorageStats`.
+
+    ``file://`` and ``zeo://`` storages are opened read-only, so that a
+    storage in use may be scanned.  For ``file://`` URIs, the transactions
+    are split in 'workers' (by default, the number of CPUs) ranges of
+    transaction ids, scanned in parallel by as many processes.  Other
+    storages are scanned in this process.
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    parallel = workers > 1 and urlsplit(uri).scheme == "file"
+    uri = _read_only_uri(uri)
+
+    storage = _open_storage(uri)
+    try:
+        stats = StorageStats(storage.getName())
+        if parallel:
+            transactions = storage.iterator()
+            first = next(iter(transactions), None)
+            transactions.close()
+            ranges = []
+            if first is not None:
+                ranges = _ranges(first.tid, storage.lastTransaction(), workers)
+        else:
+            results = [scan_storage(storage)]
+    finally:
+        storage.close()
+
+    if parallel:
+        results = []
+        if ranges:
+            with ProcessPoolExecutor(len(ranges)) as executor:
+                results = list(executor.map(
+                    functools.partial(_scan_uri, uri), *zip(*ranges)))
+
+    current = {}
+    for transactions, records in results:
+        stats.transactions += transactions
+        for oid, record in records.items():
+            if oid not in current or current[oid][0] < record[0]:
+                current[oid] = record
+
+    for _, name, size, blob_size in current.values():
+        if name is None:
+            continue
+        stats.classes[name].add(size)
+        if blob_size is not None:
+            stats.blobs += 1
+            stats.blob_bytes += blob_size
+
+    return stats
+
+
+def _format_size(size):
+    for unit in ("B", "KB", "MB", "GB"):
+        if size < 1024 or unit == "GB":
+            break
+        size /= 1024
+    return f"{size:.0f}{unit}" if unit == "B" else f"{size:.1f}{unit}"
+
+
+def format_stats(stats, cache_budget=DEFAULT_CACHE_BUDGET, top=20):
+    """Return a report of 'stats', a :class:`StorageStats`, listing the
+    'top' classes by total size.
+    """
+    total = stats.total
+    lines = [
+        f"Storage: {stats.name}",
+        f"Transactions: {stats.transactions}",
+        f"Objects: {total.count} ({_format_size(total.bytes)}, "
+        f"mean {_format_size(total.mean)}, max {_format_size(total.max)})",
+        f"Blobs: {stats.blobs} ({_format_size(stats.blob_bytes)})",
+        "",
+        f"{'Class':<50} {'Count':>10} {'Total':>10} {'Mean':>10} "
+        f"{'Max':>10}",
+    ]
+    classes = sorted(
+        stats.classes.items(), key=lambda item: (-item[1].bytes, item[0]))
+    for name, class_stats in classes[:top]:
+        lines.append(
+            f"{name:<50} {class_stats.count:>10} "
+            f"{_format_size(class_stats.bytes):>10} "
+            f"{_format_size(class_stats.mean):>10} "
+            f"{_format_size(class_stats.max):>10}")
+    if len(classes) > top:
+        lines.append(f"... and {len(classes) - top} more classes")
+
+    lines += ["", "Record sizes:"]
+    for bucket, n in sorted(total.histogram.items()):
+        lines.append(f"  <= {_format_size(1 << bucket):>8} {n:>10}")
+
+    lines += ["", "Recommended parameters:"]
+    for name, value in stats.recommendations(cache_budget).items():
+        lines.append(f"  {name}={value}")
+
+    return "\n".join(lines)
@@ -0,0 +1,64 @@
+import os
+import re
+import socket
+
+
+# Environment variable holding the id of the current worker process, e.g.
+# set by a server's post-fork hook.
+WORKER_ID_VARIABLE = "ZODBURI_WORKER_ID"
+
+PLACEHOLDER_RE = re.compile(
+    r"\{(?:(?P<name>worker_id|pid|hostname)"
+    r"|env:(?P<variable>[A-Za-z_][A-Za-z0-9_]*))\}"
+)
+
+
+class MissingTemplateValue(KeyError):
+    def __init__(self, uri, placeholder):
+        self.uri = uri
+        self.placeholder = placeholder
+        super().__init__(
+            f"No value for placeholder {placeholder} in uri: {uri}"
+        )
+
+
+def _worker_id():
+    return os.environ.get(WORKER_ID_VARIABLE) or None
+
+
+_VALUES = dict(
+    worker_id=_worker_id,
+    pid=lambda: str(os.getpid()),
+    hostname=socket.gethostname,
+)
+
+
+def expand_uri(uri):
+    """Return 'uri' with its placeholders replaced by their values in the
+    current process:
+
+    ``{worker_id}``
+      the ``ZODBURI_WORKER_ID`` environment variable
+
+    ``{pid}``
+      the process id
+
+    ``{hostname}``
+      the host name
+
+    ``{env:NAME}``
+      the ``NAME`` environment variable
+
+    Other text between braces is left as is.  Raise
+    'MissingTemplateValue' for placeholders without a value.
+    """
+    def replace(m):
+        if m.group("variable"):
+            value = os.environ.get(m.group("variable"))
+        else:
+            value = _VALUES[m.group("name")]()
+        if value is None:
+            raise MissingTemplateValue(uri, m.group(0))
+        return value
+
+    return PLACEHOLDER_RE.sub(replace, uri)
@@ -0,0 +1,126 @@
+"""pytest fixtures opening a database once per test session, and giving
+each test an isolated, throwaway view of it.
+
+Enable them in a ``conftest.py``::
+
+    pytest_plugins = ["zodburi.testing"]
+"""
+from urllib.parse import urlsplit
+
+import pytest
+import transaction
+from ZODB.DB import DB
+from ZODB.DemoStorage import DemoStorage
+
+from zodburi import resolve_uri
+from zodburi.proxy import StorageProxy
+
+
+DEFAULT_URI = "memory://"
+
+# Schemes whose storages live in the memory of the process, and so can be
+# used as inherited by the children it forks.
+IN_MEMORY_SCHEMES = ("memory",)
+
+
+class DatabaseLayer:
+    """The storage at 'uri', opened once, as the base of throwaway layers.
+
+    If not None, 'populate' is called with a database whose changes are
+    kept, in memory, in a first layer:  the fixtures it commits are seen by
+    every layer pushed on top with :meth:`push`, while the storage at 'uri'
+    is left untouched.
+
+    Storages other than ``memory://`` ones are opened through a
+    :class:`zodburi.proxy.StorageProxy`, so that a forked child reopens its
+    own rather than sharing the parent's files, sockets and threads.  Open
+    ``file://`` storages with ``read_only=true`` for that, as only one
+    process may hold a FileStorage open for writing.
+    """
+    def __init__(self, uri, populate=None):
+        self.uri = uri
+        factory, self.dbkw = resolve_uri(uri)
+        if urlsplit(uri).scheme in IN_MEMORY_SCHEMES:
+            self.base = factory()
+        else:
+            self.base = StorageProxy(factory)
+        self.storage = DemoStorage(
+            name=f"zodburi.testing {uri}", base=self.base,
+            close_base_on_close=False)
+
+        # Closing this database would discard the layer's changes:  it is
+        # only closed with the layer.
+        self._db = None
+        if populate is not None:
+            self._db = DB(self.storage, **self.dbkw)
+            populate(self._db)
+
+    def push(self):
+        """Return a new ``DemoStorage`` layered on top, whose changes are
+        discarded when it is closed.
+        """
+        return self.storage.push()
+
+    def open(self):
+        """Return a new database on a layer pushed with :meth:`push`."""
+        return DB(self.push(), **self.dbkw)
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+        else:
+            self.storage.close()
+        self.base.close()
+
+
+def pytest_addoption(parser):
+    parser.addini(
+        "zodburi_uri",
+        "URI of the database opened once per session by zodburi.testing",
+        default=DEFAULT_URI,
+    )
+
+
+@pytest.fixture(scope="session")
+def zodb_uri(pytestconfig):
+    """The URI of the session's database, by default the ``zodburi_uri``
+    ini option.
+    """
+    return pytestconfig.getini("zodburi_uri")
+
+
+@pytest.fixture(scope="session")
+def zodb_populate():
+    """A function called once per session with a database to commit
+    fixtures to, or None.  Override it to fill the session's database.
+    """
+    return None
+
+
+@pytest.fixture(scope="session")
+def zodb_layer(zodb_uri, zodb_populate):
+    """The session's :class:`DatabaseLayer`."""
+    layer = DatabaseLayer(zodb_uri, zodb_populate)
+    yield layer
+    layer.close()
+
+
+@pytest.fixture
+def zodb(zodb_layer):
+    """A database on a layer of the session's database, discarded after
+    the test.
+    """
+    db = zodb_layer.open()
+    yield db
+    db.close()
+
+
+@pytest.fixture
+def zodb_connection(zodb):
+    """A connection to :func:`zodb`, with its own transaction manager,
+    aborted after the test.
+    """
+    conn = zodb.open(transaction.TransactionManager())
+    yield conn
+    conn.transaction_manager.abort()
+    conn.close()
@@ -82,3 +82,204 @@ def test_resolve_uri_w_valid_scheme():
 
     assert factory is expected_factory
     assert dbkw == _expected_dbkw(database_name="foo")
+
+
+def test__get_proxy_factory_wo_proxy_parameters():
+    factory = object()
+    kw = {
+        "lazy": "0",
+        "background": "no",
+        "fork_safe": "false",
+        "database_name": "foo",
+    }
+
+    assert zodburi._get_proxy_factory(factory, kw) is factory
+    assert kw == {"database_name": "foo"}
+
+
+def test__get_proxy_factory_w_fork_safe():
+    factory = mock.Mock(spec_set=())
+    kw = {"fork_safe": "true"}
+
+    proxy_factory = zodburi._get_proxy_factory(factory, kw)
+
+    assert kw == {}
+    factory.assert_not_called()
+
+    with mock.patch("zodburi.StorageProxy") as proxy_klass:
+        proxy = proxy_factory()
+
+    assert proxy is proxy_klass.return_value
+    proxy_klass.assert_called_once_with(factory, fork_safe=1)
+
+
+def test__get_proxy_factory_w_lazy():
+    factory = mock.Mock(spec_set=())
+    kw = {"lazy": "on", "background": "off"}
+
+    proxy_factory = zodburi._get_proxy_factory(factory, kw)
+
+    with mock.patch("zodburi.StorageProxy") as proxy_klass:
+        proxy_factory()
+
+    proxy_klass.assert_called_once_with(factory, lazy=1, background=0)
+
+
+def test_canonicalize_w_bogus_scheme():
+    with pytest.raises(zodburi.NoResolverForScheme):
+        zodburi.canonicalize("bogus:never/gonna/happen?really=1")
+
+
+def test_canonicalize_w_resolver_wo_hook():
+    uri = "thirdparty://b?z=1&a=2"
+
+    with mock.patch("zodburi._get_resolver") as gr:
+        gr.return_value = mock.Mock(spec_set=("__call__",))
+        assert zodburi.canonicalize(uri) == uri
+
+
+def test_canonicalize_w_resolver_w_hook():
+    uri = "thirdparty://b?z=1&a=2"
+
+    with mock.patch("zodburi._get_resolver") as gr:
+        hook = gr.return_value.canonicalize
+        assert zodburi.canonicalize(uri) is hook.return_value
+
+    hook.assert_called_once_with(uri)
+
+
+def test__canonicalize_dbkw():
+    kw = {
+        "database_name": "foo",
+        "connection_pool_size": "07",
+        "connection_cache_size_bytes": "1kb",
+        "lazy": "yes",
+        "unknown": "value",
+    }
+
+    assert zodburi._canonicalize_dbkw(kw) == {
+        "database_name": "foo",
+        "connection_pool_size": "7",
+        "connection_cache_size_bytes": "1024",
+        "lazy": "1",
+        "unknown": "value",
+    }
+
+
+def test__canonicalize_dbkw_w_monitor_parameters():
+    kw = {
+        "activity_monitor": "on",
+        "activity_monitor_history": "060",
+        "metrics_interval": "5",
+    }
+
+    assert zodburi._canonicalize_dbkw(kw) == {
+        "activity_monitor": "1",
+        "activity_monitor_history": "60",
+        "metrics_interval": "5.0",
+    }
+
+
+def test__add_database_hook():
+    from zodburi.databases import DatabaseMapping
+
+    hook = mock.Mock()
+    dbkw = {}
+
+    zodburi._add_database_hook(dbkw, hook)
+
+    databases = dbkw["databases"]
+    assert isinstance(databases, DatabaseMapping)
+    assert databases.hooks == [hook]
+
+    db = mock.Mock()
+    databases["foo"] = db
+
+    assert databases["foo"] is db
+    hook.assert_called_once_with(db)
+
+
+def test__add_database_hook_w_plain_databases_mapping():
+    hook = mock.Mock()
+    plain = {}
+    dbkw = {"databases": plain}
+
+    zodburi._add_database_hook(dbkw, hook)
+
+    db = mock.Mock()
+    dbkw["databases"]["foo"] = db
+
+    assert plain == {"foo": db}
+    hook.assert_called_once_with(db)
+
+
+def test__get_dbkw_w_databases_from_query_string():
+    with pytest.raises(zodburi.UnknownDatabaseKeywords, match="databases"):
+        zodburi._get_dbkw({"databases": "oops", "activity_monitor": "1"})
+
+
+def test_resolve_uri_w_database_hooks_creates_databases_again():
+    from ZODB.DB import DB
+
+    factory, dbkw = zodburi.resolve_uri("memory://?activity_monitor=1")
+
+    first = DB(factory(), **dbkw)
+    first.close()
+    second = DB(factory(), **dbkw)
+
+    assert second.getActivityMonitor() is not None
+    assert list(dbkw["databases"].values()) == [second]
+    second.close()
+
+
+def test_resolve_uri_w_database_hooks_joins_databases():
+    from ZODB.DB import DB
+
+    from zodburi.databases import join_databases
+
+    factory, dbkw = zodburi.resolve_uri("memory://?activity_monitor=1")
+    other = DB(None, database_name="other")
+    databases = other.databases
+
+    db = DB(factory(), **join_databases(dbkw, databases))
+
+    assert databases == {"other": other, "unnamed": db}
+    assert db.getActivityMonitor() is not None
+    with db.transaction() as conn:
+        assert conn.get_connection("other").db() is other
+    db.close()
+    other.close()
+
+
+def test__get_dbkw_w_monitor_parameters():
+    with mock.patch("zodburi.monitor_hook") as monitor_hook:
+        dbkw = zodburi._get_dbkw({
+            "activity_monitor": "true",
+            "activity_monitor_history": "60",
+            "database_name": "foo",
+        })
+
+    monitor_hook.assert_called_once_with(
+        activity_monitor=1, activity_monitor_history=60)
+    assert dbkw["database_name"] == "foo"
+    assert dbkw["databases"].hooks == [monitor_hook.return_value]
+
+
+def test__get_dbkw_w_monitor_parameters_disabled():
+    dbkw = zodburi._get_dbkw({"activity_monitor": "false"})
+
+    assert dbkw == _expected_dbkw()
+
+
+def test__canonicalize_dbkw_w_adaptive_cache_parameters():
+    kw = {
+        "adaptive_cache": "yes",
+        "adaptive_cache_max": "0100",
+        "adaptive_cache_max_rss": "2GB",
+    }
+
+    assert zodburi._canonicalize_dbkw(kw) == {
+        "adaptive_cache": "1",
+        "adaptive_cache_max": "100",
+        "adaptive_cache_max_rss": str(2 << 30),
+    }
@@ -0,0 +1,356 @@
+import gzip
+import os
+from unittest import mock
+
+import pytest
+from ZODB.blob import Blob
+from ZODB.DB import DB
+from ZODB.FileStorage import FileStorage
+from ZODB.MappingStorage import MappingStorage
+
+
+def _commit(db, **kw):
+    with db.transaction() as conn:
+        conn.root().update(kw)
+
+
+def _make_blob(data):
+    blob = Blob()
+    with blob.open("w") as f:
+        f.write(data)
+    return blob
+
+
+def _file_uri(tmpdir, name, blobs=True):
+    uri = f"file://{tmpdir}/{name}.fs"
+    if blobs:
+        uri += f"?blobstorage_dir={tmpdir}/{name}-blobs"
+    return uri
+
+
+def _open(uri):
+    from zodburi import resolve_uri
+
+    factory, dbkw = resolve_uri(uri)
+    return DB(factory(), **dbkw)
+
+
+def _transactions(path):
+    storage = FileStorage(path, read_only=True)
+    transactions = [
+        (txn.tid, txn.user, txn.description, txn.extension,
+         [(r.oid, r.tid, r.data) for r in txn])
+        for txn in storage.iterator()
+    ]
+    storage.close()
+    return transactions
+
+
+def _read_blob(db, key):
+    with db.transaction() as conn:
+        with conn.root()[key].open() as f:
+            return f.read()
+
+
+@pytest.fixture
+def source_uri(tmpdir):
+    import transaction
+
+    uri = _file_uri(tmpdir, "source")
+    db = _open(uri)
+    _commit(db, answer=41)
+    with db.transaction() as conn:
+        conn.transaction_manager.get().note("with a blob")
+        conn.transaction_manager.get().setExtendedInfo("ticket", 42)
+        conn.root()["blob"] = _make_blob(b"blob data")
+        conn.root()["empty"] = _make_blob(b"")
+    transaction.abort()
+    db.close()
+    return uri
+
+
+@pytest.fixture
+def backup_dir(tmpdir):
+    return os.path.join(tmpdir, "backup")
+
+
+def test_backup_and_restore(tmpdir, source_uri, backup_dir):
+    from zodburi.backup import backup
+    from zodburi.backup import read_index
+    from zodburi.backup import restore
+
+    stats = backup(source_uri, backup_dir)
+
+    assert stats.transactions == 3
+    assert stats.blobs == 2
+    assert stats.blob_bytes == len(b"blob data")
+    segment, = read_index(backup_dir)
+    assert segment.last == stats.last_tid
+    assert sorted(os.listdir(backup_dir)) == [segment.name, "index"]
+
+    destination_uri = _file_uri(tmpdir, "destination")
+    stats = restore(backup_dir, destination_uri)
+
+    assert stats.transactions == 3
+    assert stats.records == 5
+    assert stats.blobs == 2
+    assert _transactions(f"{tmpdir}/destination.fs") == _transactions(
+        f"{tmpdir}/source.fs")
+    db = _open(destination_uri)
+    assert _read_blob(db, "blob") == b"blob data"
+    assert _read_blob(db, "empty") == b""
+    db.close()
+
+
+def test_backup_is_incremental(tmpdir, source_uri, backup_dir):
+    from zodburi.backup import backup
+    from zodburi.backup import read_index
+    from zodburi.backup import restore
+
+    backup(source_uri, backup_dir)
+    assert backup(source_uri, backup_dir).transactions == 0
+    db = _open(source_uri)
+    _commit(db, answer=42)
+    db.close()
+
+    stats = backup(source_uri, backup_dir)
+
+    assert stats.start is not None
+    assert stats.transactions == 1
+    first, second = read_index(backup_dir)
+    assert second.first > first.last
+
+    restore(backup_dir, _file_uri(tmpdir, "destination"))
+    assert _transactions(f"{tmpdir}/destination.fs") == _transactions(
+        f"{tmpdir}/source.fs")
+
+
+def test_backup_file_in_use(tmpdir, source_uri, backup_dir):
+    from zodburi.backup import backup
+    from zodburi.backup import restore
+
+    # The application's DB holds the lock of the file.
+    db = _open(source_uri)
+    try:
+        assert backup(source_uri, backup_dir).transactions == 3
+        _commit(db, answer=42)
+        assert backup(f"{source_uri}&create=1", backup_dir).transactions == 1
+    finally:
+        db.close()
+
+    restore(backup_dir, _file_uri(tmpdir, "destination"))
+    assert _transactions(f"{tmpdir}/destination.fs") == _transactions(
+        f"{tmpdir}/source.fs")
+
+
+def test_backup_rotates_segments(tmpdir, source_uri, backup_dir):
+    from zodburi.backup import backup
+    from zodburi.backup import read_index
+
+    backup(source_uri, backup_dir, segment_size=1)
+
+    assert len(read_index(backup_dir)) == 3
+
+
+def test_backup_discards_incomplete_segment(source_uri, backup_dir):
+    from zodburi.backup import backup
+    from zodburi.backup import read_index
+
+    with mock.patch(
+        "zodburi.backup._write_blob", side_effect=ValueError("testing"),
+    ):
+        with pytest.raises(ValueError):
+            backup(source_uri, backup_dir, segment_size=1)
+
+    # The segments of the transactions before the failing one are kept.
+    assert len(read_index(backup_dir)) == 2
+    assert not [
+        name for name in os.listdir(backup_dir) if name.endswith(".tmp")]
+
+
+def test_backup_w_missing_blob_file(tmpdir, source_uri, backup_dir):
+    from ZODB.POSException import POSKeyError
+
+    from zodburi.backup import backup
+    from zodburi.backup import restore
+
+    with mock.patch(
+        "ZODB.blob.BlobStorage.loadBlob", side_effect=POSKeyError("gone"),
+    ):
+        stats = backup(source_uri, backup_dir)
+
+    assert stats.blobs == 0
+    assert restore(backup_dir, _file_uri(tmpdir, "destination")).blobs == 0
+
+
+def test_backup_w_shrinking_blob_file(source_uri, backup_dir):
+    from zodburi.backup import backup
+
+    with mock.patch("os.fstat", return_value=mock.Mock(st_size=100)):
+        with pytest.raises(ValueError, match="shrank"):
+            backup(source_uri, backup_dir)
+
+
+def test_restore_resumes_after_last_transaction(
+        tmpdir, source_uri, backup_dir):
+    from zodburi.backup import backup
+    from zodburi.backup import restore
+
+    backup(source_uri, backup_dir, segment_size=1)
+    destination_uri = _file_uri(tmpdir, "destination")
+    restore(backup_dir, destination_uri)
+    db = _open(source_uri)
+    _commit(db, answer=42)
+    _commit(db, answer=43)
+    db.close()
+    # One segment holding both new transactions.
+    backup(source_uri, backup_dir)
+
+    # Restore the first of the new transactions only.
+    original = FileStorage.restore
+    calls = []
+
+    def restore_once(*args):
+        calls.append(args)
+        if len(calls) > 1:
+            raise ValueError("testing")
+        return original(*args)
+
+    with mock.patch.object(FileStorage, "restore", restore_once):
+        with pytest.raises(ValueError):
+            restore(backup_dir, destination_uri)
+    assert len(_transactions(f"{tmpdir}/destination.fs")) == 4
+
+    stats = restore(backup_dir, destination_uri)
+
+    assert stats.transactions == 1
+    assert _transactions(f"{tmpdir}/destination.fs") == _transactions(
+        f"{tmpdir}/source.fs")
+
+
+def test_restore_skips_transactions_in_destination(
+        tmpdir, source_uri, backup_dir):
+    from zodburi.backup import backup
+    from zodburi.backup import restore
+    from zodburi.migrate import copy
+
+    destination_uri = _file_uri(tmpdir, "destination")
+    copy(source_uri, destination_uri)
+    db = _open(source_uri)
+    _commit(db, answer=42)
+    db.close()
+    backup(source_uri, backup_dir)
+
+    stats = restore(backup_dir, destination_uri)
+
+    assert stats.transactions == 1
+    assert stats.blobs == 0
+    assert _transactions(f"{tmpdir}/destination.fs") == _transactions(
+        f"{tmpdir}/source.fs")
+
+
+def test_restore_verifies_checksums(tmpdir, source_uri, backup_dir):
+    from zodburi.backup import InvalidBackup
+    from zodburi.backup import backup
+    from zodburi.backup import read_index
+    from zodburi.backup import restore
+
+    backup(source_uri, backup_dir)
+    segment, = read_index(backup_dir)
+    with open(os.path.join(backup_dir, segment.name), "ab") as f:
+        f.write(b"corrupt")
+
+    with pytest.raises(InvalidBackup, match="checksum"):
+        restore(backup_dir, _file_uri(tmpdir, "destination"))
+
+    assert _transactions(f"{tmpdir}/destination.fs") == []
+
+
+def test__hashing_file_flush_and_checksum():
+    import hashlib
+    import io
+
+    from zodburi.backup import _HashingFile
+
+    f = io.BytesIO()
+    hashing = _HashingFile(f)
+
+    with gzip.GzipFile(fileobj=hashing, mode="wb") as gz:
+        gz.write(b"data")
+        gz.flush()
+
+    assert hashing.sha256.hexdigest() == hashlib.sha256(
+        f.getvalue()).hexdigest()
+    assert gzip.decompress(f.getvalue()) == b"data"
+
+
+@pytest.mark.parametrize("content, why", [
+    (b"X", "expected a transaction"),
+    (b"T" + b"\0" * 8, "truncated"),
+    (b"T" + b"\0" * 8 + b" " + b"\0\0\0\0" * 3 + b"X", "expected a record"),
+])
+def test_restore_w_invalid_segment(tmpdir, backup_dir, content, why):
+    from zodburi.backup import InvalidBackup
+    from zodburi.backup import _restore_segment
+    from zodburi.migrate import CopyStats
+
+    path = os.path.join(tmpdir, "invalid.seg.gz")
+    with gzip.open(path, "wb") as f:
+        f.write(content)
+    storage = FileStorage(os.path.join(tmpdir, "Data.fs"))
+
+    with pytest.raises(InvalidBackup, match=why):
+        _restore_segment(path, storage, storage.lastTransaction(), CopyStats())
+
+    storage.close()
+
+
+def test_restore_w_destination_wo_restore(backup_dir):
+    from zodburi.backup import restore_storage
+    from zodburi.migrate import DestinationNotRestorable
+
+    with pytest.raises(DestinationNotRestorable):
+        restore_storage(backup_dir, MappingStorage())
+
+
+def test_restore_w_destination_wo_blobs(tmpdir, source_uri, backup_dir):
+    from zodburi.backup import backup
+    from zodburi.backup import restore
+    from zodburi.migrate import DestinationWithoutBlobs
+
+    backup(source_uri, backup_dir)
+
+    with pytest.raises(DestinationWithoutBlobs):
+        restore(backup_dir, _file_uri(tmpdir, "destination", blobs=False))
+
+
+def test_backup_and_restore_report_progress(tmpdir, source_uri, backup_dir):
+    from zodburi.backup import backup
+    from zodburi.backup import restore
+
+    report = mock.Mock()
+    backup(source_uri, backup_dir, segment_size=1, report=report,
+           report_interval=0)
+    assert report.call_count == 3
+
+    report = mock.Mock()
+    restore(backup_dir, _file_uri(tmpdir, "destination"), report=report,
+            report_interval=0)
+    assert report.call_count == 3
+
+
+def test_main_backup_and_restore(tmpdir, source_uri, backup_dir, capsys):
+    from zodburi.__main__ import main
+
+    destination_uri = _file_uri(tmpdir, "destination")
+
+    assert main(["backup", "--segment-size", "1mb", source_uri,
+                 backup_dir]) == 0
+    assert main(["restore", backup_dir, destination_uri]) == 0
+
+    err = capsys.readouterr().err.splitlines()
+    assert err[0].startswith("backed up 3 transactions")
+    assert err[1].startswith("restored 3 transactions")
+    db = _open(destination_uri)
+    assert _read_blob(db, "blob") == b"blob data"
+    db.close()
@@ -0,0 +1,137 @@
+import os
+from unittest import mock
+
+import pytest
+import transaction
+from ZODB.blob import Blob
+from ZODB.DB import DB
+from ZODB.interfaces import BlobError
+
+DATA = b"0123456789" * 1000
+
+
+@pytest.fixture
+def db(tmpdir):
+    from zodburi import resolve_uri
+
+    factory, dbkw = resolve_uri(
+        f"file://{tmpdir}/Data.fs?blobstorage_dir={tmpdir}/blobs")
+    db = DB(factory(), **dbkw)
+
+    with db.transaction() as conn:
+        conn.root()["blob"] = _make_blob(DATA)
+        conn.root()["empty"] = _make_blob(b"")
+
+    yield db
+
+    db.close()
+
+
+def _make_blob(data):
+    blob = Blob()
+    with blob.open("w") as f:
+        f.write(data)
+    return blob
+
+
+@pytest.fixture
+def conn(db):
+    conn = db.open()
+    yield conn
+    transaction.abort()
+    conn.close()
+
+
+def test_blob_path(conn, tmpdir):
+    from zodburi.blobs import blob_path
+
+    blob = conn.root()["blob"]
+    blob._p_deactivate()
+
+    path = blob_path(blob)
+
+    assert path.startswith(os.path.join(str(tmpdir), "blobs"))
+    with open(path, "rb") as f:
+        assert f.read() == DATA
+
+
+def test_blob_path_w_uncommitted_changes(conn):
+    from zodburi.blobs import blob_path
+
+    blob = conn.root()["blob"]
+    with blob.open("w") as f:
+        f.write(b"changed")
+
+    with pytest.raises(BlobError):
+        blob_path(blob)
+
+
+def test_blob_size(conn):
+    from zodburi.blobs import blob_size
+
+    assert blob_size(conn.root()["blob"]) == len(DATA)
+
+
+def test_blob_mmap(conn):
+    from zodburi.blobs import blob_mmap
+
+    mapped = blob_mmap(conn.root()["blob"])
+
+    assert mapped[10:20] == DATA[10:20]
+    assert len(mapped) == len(DATA)
+    mapped.close()
+
+
+def test_blob_mmap_w_empty_blob(conn):
+    from zodburi.blobs import blob_mmap
+
+    assert blob_mmap(conn.root()["empty"]) == b""
+
+
+@pytest.mark.parametrize("offset, count, expected", [
+    (0, None, DATA),
+    (100, None, DATA[100:]),
+    (100, 50, DATA[100:150]),
+    (0, len(DATA) * 2, DATA),
+])
+def test_blob_sendfile(conn, tmpdir, offset, count, expected):
+    from zodburi.blobs import blob_sendfile
+
+    out_path = os.path.join(tmpdir, "out")
+    with open(out_path, "wb") as out:
+        sent = blob_sendfile(conn.root()["blob"], out.fileno(), offset, count)
+
+    assert sent == len(expected)
+    with open(out_path, "rb") as f:
+        assert f.read() == expected
+
+
+def test_blob_sendfile_stops_at_eof(conn, tmpdir):
+    from zodburi.blobs import blob_sendfile
+
+    with mock.patch("os.sendfile", return_value=0):
+        assert blob_sendfile(conn.root()["blob"], 1) == 0
+
+
+def test_blob_file_wrapper_w_server_file_wrapper(conn):
+    from zodburi.blobs import blob_file_wrapper
+
+    file_wrapper = mock.Mock()
+
+    result = blob_file_wrapper(
+        conn.root()["blob"], {"wsgi.file_wrapper": file_wrapper}, 4096)
+
+    assert result is file_wrapper.return_value
+    f, block_size = file_wrapper.call_args[0]
+    assert block_size == 4096
+    assert f.read() == DATA
+    f.close()
+
+
+def test_blob_file_wrapper_wo_server_file_wrapper(conn):
+    from zodburi.blobs import blob_file_wrapper
+
+    blocks = list(blob_file_wrapper(conn.root()["blob"], {}, 4096))
+
+    assert [len(block) for block in blocks] == [4096, 4096, 1808]
+    assert b"".join(blocks) == DATA
@@ -0,0 +1,269 @@
+from unittest import mock
+
+import pytest
+import transaction
+from persistent.mapping import PersistentMapping
+from ZODB.DB import DB
+from ZODB.MappingStorage import MappingStorage
+
+from zodburi.tests.util import wait_for
+
+
+def _make_db(objects=100, **kw):
+    db = DB(MappingStorage(), **kw)
+    with db.transaction() as conn:
+        for i in range(objects):
+            conn.root()[i] = PersistentMapping(value=i)
+    return db
+
+
+def _load_all(conn):
+    transaction.begin()
+    root = conn.root()
+    for key in list(root):
+        root[key]["value"]
+
+
+def _make_controller(**kw):
+    from zodburi.cachesize import CacheSizeController
+    return CacheSizeController(**kw)
+
+
+def test_current_rss():
+    from zodburi.cachesize import current_rss
+
+    rss = current_rss()
+
+    assert rss is None or rss > 0
+
+
+def test_current_rss_wo_proc():
+    from zodburi.cachesize import current_rss
+
+    with mock.patch("builtins.open", side_effect=FileNotFoundError):
+        assert current_rss() is None
+
+
+def test_cachesizecontroller_add_default_bounds():
+    controller = _make_controller()
+    db = DB(MappingStorage(), cache_size=400)
+
+    with mock.patch.object(controller, "_run"):
+        controller.add(db)
+
+    assert controller._bounds[db] == (100, 1600)
+    db.close()
+
+
+def test_cachesizecontroller_add_explicit_bounds():
+    controller = _make_controller(min_size=10, max_size=20)
+    db = DB(MappingStorage(), cache_size=400)
+
+    with mock.patch.object(controller, "_run"):
+        controller.add(db)
+
+    assert controller._bounds[db] == (10, 20)
+    db.close()
+
+
+def test_cachesizecontroller_grows_thrashing_cache():
+    controller = _make_controller(max_size=1000)
+    db = _make_db(cache_size=50, cache_size_bytes=1 << 20)
+    controller._bounds[db] = (10, 1000)
+    conn = db.open()
+    _load_all(conn)
+
+    assert controller.adjust() is False  # not added:  nothing to do
+    controller._dbs.add(db)
+    assert controller.adjust()
+
+    assert db.getCacheSize() == 75
+    assert db.getCacheSizeBytes() == int((1 << 20) * 1.5)
+    assert conn._cache.cache_size == 75
+    conn.close()
+    db.close()
+
+
+def test_cachesizecontroller_leaves_unfilled_cache_alone():
+    controller = _make_controller()
+    db = _make_db(objects=10, cache_size=1000)
+    controller._bounds[db] = (10, 5000)
+    controller._dbs.add(db)
+    conn = db.open()
+    _load_all(conn)
+
+    controller.adjust()
+
+    assert db.getCacheSize() == 1000
+    conn.close()
+    db.close()
+
+
+def test_cachesizecontroller_shrinks_cold_cache():
+    controller = _make_controller()
+    db = _make_db(cache_size=50)
+    controller._bounds[db] = (40, 1000)
+    controller._dbs.add(db)
+    conn = db.open()
+    _load_all(conn)
+    controller.adjust()  # records the load counts
+    db.setCacheSize(50)
+
+    controller.adjust()  # no loads since
+
+    assert db.getCacheSize() == 45
+    controller.adjust()
+    assert db.getCacheSize() == 40  # min_size
+    conn.close()
+    db.close()
+
+
+def test_cachesizecontroller_keeps_cache_w_moderate_misses():
+    controller = _make_controller()
+    db = _make_db(cache_size=50)
+    controller._bounds[db] = (10, 1000)
+    controller._dbs.add(db)
+    conn = db.open()
+    _load_all(conn)
+    controller.adjust()
+    db.setCacheSize(50)
+    conn._load_count += 2  # 4% of the target
+
+    controller.adjust()
+
+    assert db.getCacheSize() == 50
+    conn.close()
+    db.close()
+
+
+def test_cachesizecontroller_handles_cleared_load_counts():
+    controller = _make_controller()
+    db = _make_db(cache_size=50)
+    controller._bounds[db] = (10, 1000)
+    controller._dbs.add(db)
+    conn = db.open()
+    _load_all(conn)
+    controller.adjust()
+    db.setCacheSize(50)
+    conn.getTransferCounts(clear=True)
+    conn._load_count = 10  # 20% of the target, since cleared
+
+    controller.adjust()
+
+    assert db.getCacheSize() == 75
+    conn.close()
+    db.close()
+
+
+def test_cachesizecontroller_shrinks_over_max_rss():
+    controller = _make_controller(max_rss=1 << 20)
+    db = _make_db(cache_size=100)
+    controller._bounds[db] = (10, 1000)
+    controller._dbs.add(db)
+    conn = db.open()
+    _load_all(conn)
+    conn.close()
+
+    with mock.patch("zodburi.cachesize.current_rss", return_value=2 << 20):
+        controller.adjust()
+
+    assert db.getCacheSize() == 75
+    # Over the limit, idle connections are minimized regardless of 'idle'.
+    assert conn._cache.cache_non_ghost_count == 0
+    db.close()
+
+
+def test_cachesizecontroller_minimizes_idle_connections():
+    controller = _make_controller(idle=60)
+    db = _make_db(cache_size=1000)
+    controller._bounds[db] = (10, 1000)
+    controller._dbs.add(db)
+    conn = db.open()
+    _load_all(conn)
+    conn.close()
+
+    controller.adjust()
+
+    assert conn._cache.cache_non_ghost_count > 0  # not idle for long
+
+    db.pool.available[:] = [
+        (returned - 120, c) for returned, c in db.pool.available
+    ]
+    controller.adjust()
+
+    assert conn._cache.cache_non_ghost_count == 0
+    db.close()
+
+
+def test_cache_size_hook():
+    from zodburi.cachesize import cache_size_hook
+
+    hook = cache_size_hook(
+        adaptive_cache_min=10, adaptive_cache_max=20,
+        adaptive_cache_max_rss=1 << 30, adaptive_cache_interval=5,
+        adaptive_cache_idle=7,
+    )
+    controller = hook.__self__
+
+    assert controller.min_size == 10
+    assert controller.max_size == 20
+    assert controller.max_rss == 1 << 30
+    assert controller.interval == 5
+    assert controller.idle == 7
+
+
+@pytest.mark.parametrize("value", ["false", "0"])
+def test_resolve_uri_wo_adaptive_cache(value):
+    from zodburi import resolve_uri
+
+    factory, dbkw = resolve_uri(f"memory://?adaptive_cache={value}")
+
+    assert "databases" not in dbkw
+
+
+def test_resolve_uri_w_adaptive_cache():
+    from zodburi import resolve_uri
+    from zodburi.cachesize import CacheSizeController
+
+    factory, dbkw = resolve_uri(
+        "memory://?connection_cache_size=50&adaptive_cache=true"
+        "&adaptive_cache_max=60&adaptive_cache_interval=0.01"
+    )
+    hook, = dbkw["databases"].hooks
+    controller = hook.__self__
+    assert isinstance(controller, CacheSizeController)
+
+    db = DB(factory(), **dbkw)
+    with db.transaction() as conn:
+        for i in range(100):
+            conn.root()[i] = PersistentMapping(value=i)
+    conn = db.open()
+    _load_all(conn)
+
+    wait_for(lambda: db.getCacheSize() == 60)
+
+    assert db.getCacheSize() == 60
+    conn.close()
+    db.close()
+    controller._thread.join(5)
+    assert not controller._thread.is_alive()
+
+
+def test_resolve_uri_w_adaptive_cache_creates_databases_again():
+    import gc
+
+    from zodburi import resolve_uri
+
+    factory, dbkw = resolve_uri("memory://?adaptive_cache=true")
+    hook, = dbkw["databases"].hooks
+    controller = hook.__self__
+
+    first = DB(factory(), **dbkw)
+    first.close()
+    second = DB(factory(), **dbkw)
+
+    # The closed database is no longer kept alive by the mapping.
+    del first
+    gc.collect()
+    assert list(controller._dbs) == [second]
+    second.close()
@@ -0,0 +1,82 @@
+import threading
+
+import pytest
+
+
+def _lazy_database(tmpdir, **dbkw):
+    from zodburi import resolve_uri
+    from zodburi.databases import LazyDatabase
+
+    factory, resolved_dbkw = resolve_uri(f"file://{tmpdir}/Data.fs?lazy=1")
+    storage = factory()
+    return LazyDatabase(storage, **dict(resolved_dbkw, **dbkw)), storage
+
+
+def test_lazy_database_defers_opening_storage(tmpdir):
+    database, storage = _lazy_database(tmpdir, database_name="main")
+
+    assert not database.created()
+    assert storage.state() == "unopened"
+    assert "uncreated" in repr(database)
+
+    with database.transaction() as conn:
+        conn.root.answer = 42
+
+    assert database.created()
+    assert storage.state() == "ready"
+    assert database.database_name == "main"
+    assert "ZODB.DB.DB" in repr(database)
+    with pytest.raises(AttributeError):
+        database.__bogus__
+    database.close()
+    database.close()
+
+
+def test_lazy_database_creates_database_once(tmpdir):
+    database, _ = _lazy_database(tmpdir)
+    dbs = []
+
+    def use():
+        dbs.append(database._get_db())
+
+    threads = [threading.Thread(target=use) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(set(map(id, dbs))) == 1
+    database.close()
+
+
+def test_lazy_database_close_before_use(tmpdir):
+    from zodburi.databases import LazyDatabaseClosed
+
+    database, storage = _lazy_database(tmpdir)
+
+    database.close()
+
+    assert storage.state() == "closed"
+    with pytest.raises(LazyDatabaseClosed):
+        database.open()
+
+
+def test_database_mapping_drops_closed_databases():
+    from ZODB.DB import DB
+
+    from zodburi.databases import DatabaseMapping
+
+    hook = []
+    databases = DatabaseMapping([hook.append])
+    closed = DB(None, databases=databases, database_name="closed")
+    db = DB(None, databases=databases)
+    closed.close()
+
+    assert "closed" not in databases
+    assert list(databases) == ["unnamed"] and len(databases) == 1
+    assert hook == [closed, db]
+    assert "unnamed" in repr(databases)
+
+    del databases["unnamed"]
+    assert not databases
+    db.close()
@@ -0,0 +1,234 @@
+import os
+from unittest import mock
+
+import pytest
+import transaction
+from ZODB.DB import DB
+from ZODB.FileStorage import FileStorage
+from ZODB.MappingStorage import MappingStorage
+from ZODB.POSException import POSKeyError
+from ZODB.POSException import ReadOnlyError
+from ZODB.utils import p64
+from ZODB.utils import z64
+
+
+def _commit(db, **kw):
+    with db.transaction() as conn:
+        conn.root().update(kw)
+
+
+def _make_source():
+    storage = MappingStorage()
+    db = DB(storage)
+    _commit(db, answer=41)
+    _commit(db, answer=42, question="?")
+    return storage
+
+
+@pytest.fixture
+def mapped_path(tmpdir):
+    from zodburi.mapped import write_mapped
+
+    path = os.path.join(tmpdir, "reference.map")
+    write_mapped(_make_source(), path)
+    return path
+
+
+def test_write_mapped(mapped_path):
+    assert sorted(os.listdir(os.path.dirname(mapped_path))) == [
+        "reference.map",
+    ]
+
+
+def test_write_mapped_skips_undone_creations(tmpdir):
+    from zodburi.mapped import MappedStorage
+    from zodburi.mapped import write_mapped
+
+    created = mock.Mock(oid=p64(1), tid=p64(2), data=b"data")
+    undone = mock.Mock(oid=p64(1), tid=p64(3), data=None)
+    source = mock.Mock()
+    source.iterator.return_value = [[created], [undone]]
+    source.lastTransaction.return_value = p64(3)
+    path = os.path.join(tmpdir, "reference.map")
+
+    write_mapped(source, path)
+
+    storage = MappedStorage(path)
+    assert len(storage) == 0
+    assert storage.lastTransaction() == p64(3)
+    storage.close()
+
+
+def test_write_mapped_removes_temporary_file_on_failure(tmpdir):
+    from zodburi.mapped import write_mapped
+
+    source = mock.Mock()
+    source.iterator.return_value = []
+    source.lastTransaction.side_effect = ValueError("testing")
+    path = os.path.join(tmpdir, "reference.map")
+
+    with pytest.raises(ValueError):
+        write_mapped(source, path)
+
+    assert os.listdir(tmpdir) == []
+
+
+@pytest.mark.parametrize("content", [b"\0", b"not a mapped storage file" * 2])
+def test_mappedstorage_w_invalid_file(tmpdir, content):
+    from zodburi.mapped import InvalidMappedFile
+    from zodburi.mapped import MappedStorage
+
+    path = os.path.join(tmpdir, "invalid.map")
+    with open(path, "wb") as f:
+        f.write(content)
+
+    with pytest.raises(InvalidMappedFile):
+        MappedStorage(path)
+
+
+def test_mappedstorage_as_database(mapped_path):
+    from zodburi.mapped import MappedStorage
+
+    storage = MappedStorage(mapped_path, "reference")
+    db = DB(storage)
+
+    conn = db.open()
+    assert dict(conn.root()) == {"answer": 42, "question": "?"}
+    conn.root()["answer"] = 43
+    with pytest.raises(ReadOnlyError):
+        transaction.commit()
+    transaction.abort()
+    conn.close()
+    db.close()
+
+
+def test_mappedstorage_reads(tmpdir):
+    from zodburi.mapped import MappedStorage
+    from zodburi.mapped import write_mapped
+
+    source = _make_source()
+    mapped_path = os.path.join(tmpdir, "reference.map")
+    write_mapped(source, mapped_path)
+    storage = MappedStorage(mapped_path)
+
+    assert storage.getName() == mapped_path
+    assert storage.sortKey() == mapped_path
+    assert storage.isReadOnly()
+    assert not storage.supportsUndo()
+    assert len(storage) == 1
+    assert storage.getSize() == os.path.getsize(mapped_path)
+    assert storage.lastTransaction() == source.lastTransaction()
+
+    data, tid = source.load(z64)
+    assert storage.load(z64) == (data, tid)
+    assert storage.getTid(z64) == tid
+    assert storage.loadSerial(z64, tid) == data
+    assert storage.loadBefore(z64, p64(1 + int.from_bytes(tid, "big"))) == (
+        data, tid, None)
+    assert storage.loadBefore(z64, tid) is None
+    history, = storage.history(z64)
+    assert history["tid"] == tid
+    assert history["size"] == len(data)
+
+    view, view_tid = storage.load_view(z64)
+    assert isinstance(view, memoryview)
+    assert view == data
+    assert view_tid == tid
+    view.release()
+    storage.close()
+
+
+def test_mappedstorage_missing_records(mapped_path):
+    from zodburi.mapped import MappedStorage
+
+    storage = MappedStorage(mapped_path)
+
+    with pytest.raises(POSKeyError):
+        storage.load(p64(42))
+    with pytest.raises(POSKeyError):
+        storage.load(b"\xff" * 8)
+    with pytest.raises(POSKeyError):
+        storage.loadSerial(z64, z64)
+    storage.close()
+
+
+def test_mappedstorage_refuses_writes(mapped_path):
+    from zodburi.mapped import MappedStorage
+
+    storage = MappedStorage(mapped_path)
+    txn = transaction.get()
+
+    for call in [
+        lambda: storage.new_oid(),
+        lambda: storage.pack(0, None),
+        lambda: storage.store(z64, z64, b"", "", txn),
+        lambda: storage.tpc_begin(txn),
+        lambda: storage.tpc_vote(txn),
+        lambda: storage.tpc_finish(txn),
+    ]:
+        with pytest.raises(ReadOnlyError):
+            call()
+
+    storage.tpc_abort(txn)
+    storage.registerDB(None)
+    storage.close()
+
+
+def test_mappedstorage_close_w_live_views(mapped_path):
+    from zodburi.mapped import MappedStorage
+
+    storage = MappedStorage(mapped_path)
+    view, _ = storage.load_view(z64)
+
+    storage.close()
+    storage.close()  # no-op
+
+    assert bytes(view)
+
+
+def test_resolve_uri_w_mapped_from(tmpdir):
+    from zodburi import resolve_uri
+    from zodburi.mapped import MappedStorage
+
+    source = os.path.join(tmpdir, "Data.fs")
+    db = DB(FileStorage(source))
+    _commit(db, answer=42)
+    db.close()
+    path = os.path.join(tmpdir, "reference.map")
+
+    factory, dbkw = resolve_uri(
+        f"memory://reference?mapped={path}&from=file://{source}")
+    first = factory()
+
+    assert isinstance(first, MappedStorage)
+    assert first.getName() == "reference"
+    assert os.path.exists(path)
+
+    with mock.patch("zodburi.resolvers.write_mapped") as write:
+        second = factory()
+
+    write.assert_not_called()
+    db = DB(second, **dbkw)
+    conn = db.open()
+    assert conn.root()["answer"] == 42
+    conn.close()
+    db.close()
+    first.close()
+
+
+def test_resolve_uri_w_mapped_wo_file(tmpdir):
+    from zodburi import resolve_uri
+
+    path = os.path.join(tmpdir, "missing.map")
+    factory, dbkw = resolve_uri(f"memory://?mapped={path}")
+
+    with pytest.raises(FileNotFoundError):
+        factory()
+
+
+def test_resolve_uri_w_mapped_and_spill_size():
+    from zodburi import resolve_uri
+    from zodburi.resolvers import InvalidMemoryStorageURI
+
+    with pytest.raises(InvalidMemoryStorageURI):
+        resolve_uri("memory://?mapped=/tmp/x.map&spill_size=1mb")
@@ -0,0 +1,327 @@
+import os
+from unittest import mock
+
+import pytest
+import transaction
+from ZODB.DB import DB
+from ZODB.FileStorage import FileStorage
+from ZODB.MappingStorage import MappingStorage
+
+
+@pytest.fixture(autouse=True)
+def clear_snapshots():
+    from zodburi.memory import clear_snapshots
+
+    clear_snapshots()
+    yield
+    clear_snapshots()
+
+
+@pytest.fixture(autouse=True)
+def dispose_shared():
+    from zodburi.memory import dispose_shared
+    from zodburi.memory import shared_storages
+
+    yield
+    for name in shared_storages():
+        dispose_shared(name)
+
+
+def _commit(db, **kw):
+    with db.transaction() as conn:
+        conn.root().update(kw)
+
+
+def _root(db):
+    conn = db.open()
+    transaction.begin()
+    root = dict(conn.root())
+    conn.close()
+    return root
+
+
+@pytest.fixture
+def fixture_path(tmpdir):
+    path = os.path.join(tmpdir, "Data.fs")
+    db = DB(FileStorage(path))
+    _commit(db, answer=41)
+    _commit(db, answer=42, question="?")
+    db.close()
+    return path
+
+
+def test_load_snapshot(fixture_path):
+    from zodburi.memory import load_snapshot
+
+    snapshot = load_snapshot(f"file://{fixture_path}")
+
+    assert isinstance(snapshot, MappingStorage)
+    assert snapshot.getName() == f"file://{fixture_path}"
+    assert len(list(snapshot.iterator())) == 3  # with the root's creation
+    assert _root(DB(snapshot)) == {"answer": 42, "question": "?"}
+
+
+def test_load_snapshot_is_cached_per_canonical_uri(fixture_path):
+    from zodburi.memory import load_snapshot
+
+    snapshot = load_snapshot(f"file://{fixture_path}")
+
+    with mock.patch("zodburi._get_uri_factory_and_dbkw") as get_factory:
+        again = load_snapshot(
+            f"file://{os.path.dirname(fixture_path)}/./Data.fs")
+
+    assert again is snapshot
+    get_factory.assert_not_called()
+
+
+def test_load_snapshot_closes_source_on_failure():
+    from zodburi.memory import _snapshots
+    from zodburi.memory import load_snapshot
+
+    source = mock.Mock()
+    source.iterator.side_effect = ValueError("testing")
+
+    with mock.patch("zodburi._get_uri_factory_and_dbkw") as get_factory:
+        get_factory.return_value = (lambda: source), {}
+        with pytest.raises(ValueError):
+            load_snapshot("memory://source")
+
+    source.close.assert_called_once_with()
+    assert _snapshots == {}
+
+
+def test_load_snapshot_skips_undone_creations():
+    from zodburi.memory import _load_transactions
+
+    record = mock.Mock(oid=b"\0" * 7 + b"\1", data=None)
+    txn = mock.MagicMock(
+        user="", description="", extension={}, tid=b"\0" * 7 + b"\2")
+    txn.__iter__.return_value = [record]
+    source = mock.Mock()
+    source.iterator.return_value = [txn]
+    destination = MappingStorage()
+
+    _load_transactions(source, destination)
+
+    assert destination._data == {}
+    assert destination._oid == 0
+
+
+def test_clone_snapshot_is_independent(fixture_path):
+    from zodburi.memory import clone_snapshot
+    from zodburi.memory import load_snapshot
+
+    snapshot = load_snapshot(f"file://{fixture_path}")
+    size = snapshot.getSize()
+
+    clone = clone_snapshot(snapshot, "clone")
+
+    assert clone.getName() == "clone"
+    assert clone.lastTransaction() == snapshot.lastTransaction()
+    db = DB(clone)
+    _commit(db, answer=43)
+    db.pack()
+
+    assert _root(db) == {"answer": 43, "question": "?"}
+    assert snapshot.getSize() == size
+    assert _root(DB(snapshot)) == {"answer": 42, "question": "?"}
+    assert len(list(snapshot.iterator())) == 3
+    db.close()
+
+
+def test_clone_snapshot_new_oids_dont_collide(fixture_path):
+    from zodburi.memory import clone_snapshot
+    from zodburi.memory import load_snapshot
+
+    snapshot = load_snapshot(f"file://{fixture_path}")
+    clone = clone_snapshot(snapshot)
+
+    assert clone.new_oid() not in snapshot._data
+
+
+def test_resolve_uri_w_from(fixture_path):
+    from zodburi import resolve_uri
+
+    factory, dbkw = resolve_uri(f"memory://test?from=file://{fixture_path}")
+
+    first = factory()
+    with mock.patch("zodburi.memory._load_transactions") as load:
+        second = factory()
+
+    load.assert_not_called()
+    assert first.getName() == second.getName() == "test"
+    db = DB(first, **dbkw)
+    _commit(db, answer=0)
+    assert _root(db)["answer"] == 0
+    assert _root(DB(second))["answer"] == 42
+    db.close()
+
+
+def test_resolve_uri_w_from_and_spill_size(fixture_path):
+    from zodburi import resolve_uri
+    from zodburi.spill import SpillStorage
+
+    factory, dbkw = resolve_uri(
+        f"memory://test?from=file://{fixture_path}&spill_size=1kb")
+    storage = factory()
+
+    assert isinstance(storage, SpillStorage)
+    db = DB(storage, **dbkw)
+    _commit(db, big="x" * 2048)
+
+    assert storage.stats()["spilled"]
+    assert _root(db)["answer"] == 42
+    db.close()
+
+
+def test_open_shared_creates_storage_once():
+    from zodburi.memory import open_shared
+    from zodburi.memory import shared_storages
+
+    factory = mock.Mock(side_effect=lambda: MappingStorage("shared"))
+
+    first = open_shared("shared", factory)
+    second = open_shared("shared", factory)
+
+    factory.assert_called_once_with()
+    assert first is not second
+    assert first._get_storage() is second._get_storage()
+    assert shared_storages() == {"shared": 2}
+
+
+def test_sharedstorage_close_keeps_storage_until_disposed():
+    from zodburi.memory import dispose_shared
+    from zodburi.memory import open_shared
+    from zodburi.memory import shared_storages
+
+    handle = open_shared("shared", lambda: MappingStorage("shared"))
+    storage = handle._get_storage()
+    other = open_shared("shared", None)
+
+    handle.close()
+    handle.close()  # no-op
+
+    assert shared_storages() == {"shared": 1}
+    assert storage.opened()
+
+    dispose_shared("shared")
+
+    assert shared_storages() == {}
+    assert storage.opened()  # still in use by 'other'
+
+    other.close()
+
+    assert not storage.opened()
+
+
+def test_dispose_shared_wo_handles_closes_storage():
+    from zodburi.memory import dispose_shared
+    from zodburi.memory import open_shared
+
+    handle = open_shared("shared", lambda: MappingStorage("shared"))
+    storage = handle._get_storage()
+    handle.close()
+
+    dispose_shared("shared")
+
+    assert not storage.opened()
+    fresh = open_shared("shared", lambda: MappingStorage("shared"))
+    assert fresh._get_storage() is not storage
+    fresh.close()
+
+
+def test_dispose_shared_w_unknown_name():
+    from zodburi.memory import dispose_shared
+
+    with pytest.raises(KeyError):
+        dispose_shared("unknown")
+
+
+def test_sharedstorage_invalidates_other_databases():
+    from zodburi.memory import open_shared
+
+    first = DB(open_shared("shared", lambda: MappingStorage("shared")))
+    second = DB(open_shared("shared", None))
+    _commit(first, answer=41)
+
+    conn = second.open()
+    transaction.begin()
+    assert conn.root()["answer"] == 41
+    transaction.abort()
+
+    _commit(first, answer=42)
+
+    transaction.begin()
+    assert conn.root()["answer"] == 42
+    conn.close()
+
+    _commit(second, question="?")
+    assert _root(first) == {"answer": 42, "question": "?"}
+    first.close()
+    second.close()
+
+
+def test_sharedstorage_tpc_abort_forgets_oids():
+    from zodburi.memory import open_shared
+
+    handle = open_shared("shared", lambda: MappingStorage("shared"))
+    db = DB(handle)
+
+    conn = db.open()
+    conn.root()["answer"] = 42
+    transaction.abort()
+    conn.close()
+
+    assert handle._oids == {}
+    db.close()
+
+
+def test_sharedstorage_tpc_abort_after_tpc_begin():
+    from ZODB.utils import p64
+    from ZODB.utils import z64
+
+    from zodburi.memory import open_shared
+
+    handle = open_shared("shared", lambda: MappingStorage("shared"))
+    txn = transaction.Transaction()
+
+    handle.tpc_begin(txn)
+    handle.store(p64(1), z64, b"data", "", txn)
+    assert handle._oids == {txn: [p64(1)]}
+    handle.tpc_abort(txn)
+
+    assert handle._oids == {}
+    handle.close()
+
+
+def test_resolve_uri_w_shared():
+    from zodburi import resolve_uri
+    from zodburi.memory import SharedStorage
+    from zodburi.memory import shared_storages
+
+    factory, dbkw = resolve_uri("memory://fixtures?shared=true")
+    first = DB(factory(), **dbkw)
+    second = DB(factory(), **dbkw)
+
+    assert isinstance(first.storage, SharedStorage)
+    assert shared_storages() == {"fixtures": 2}
+    _commit(first, answer=42)
+    assert _root(second) == {"answer": 42}
+    first.close()
+    second.close()
+
+    assert shared_storages() == {"fixtures": 0}
+    third = DB(factory(), **dbkw)
+    assert _root(third) == {"answer": 42}
+    third.close()
+
+
+def test_resolve_uri_w_shared_and_from(fixture_path):
+    from zodburi import resolve_uri
+
+    factory, dbkw = resolve_uri(
+        f"memory://fixtures?shared=1&from=file://{fixture_path}")
+    db = DB(factory(), **dbkw)
+
+    assert _root(db)["answer"] == 42
+    db.close()
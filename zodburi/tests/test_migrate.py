@@ -0,0 +1,283 @@
+import os
+from unittest import mock
+
+import pytest
+from ZODB.blob import Blob
+from ZODB.DB import DB
+from ZODB.FileStorage import FileStorage
+from ZODB.MappingStorage import MappingStorage
+
+
+def _commit(db, **kw):
+    with db.transaction() as conn:
+        conn.root().update(kw)
+
+
+def _make_blob(data):
+    blob = Blob()
+    with blob.open("w") as f:
+        f.write(data)
+    return blob
+
+
+def _file_uri(tmpdir, name, blobs=True):
+    uri = f"file://{tmpdir}/{name}.fs"
+    if blobs:
+        uri += f"?blobstorage_dir={tmpdir}/{name}-blobs"
+    return uri
+
+
+def _open(uri):
+    from zodburi import resolve_uri
+
+    factory, dbkw = resolve_uri(uri)
+    return DB(factory(), **dbkw)
+
+
+def _transactions(storage):
+    return [
+        (txn.tid, txn.description, [(r.oid, r.tid, r.data) for r in txn])
+        for txn in storage.iterator()
+    ]
+
+
+def _read_blob(db, key):
+    with db.transaction() as conn:
+        with conn.root()[key].open() as f:
+            return f.read()
+
+
+@pytest.fixture
+def source_uri(tmpdir):
+    uri = _file_uri(tmpdir, "source")
+    db = _open(uri)
+    _commit(db, answer=41)
+    _commit(db, answer=42, blob=_make_blob(b"blob data"))
+    db.close()
+    return uri
+
+
+def test_copy(tmpdir, source_uri):
+    from zodburi.migrate import copy
+
+    destination_uri = _file_uri(tmpdir, "destination")
+
+    stats = copy(source_uri, destination_uri, blob_workers=2, queue_size=1)
+
+    assert stats.start is None
+    assert stats.transactions == 3
+    assert stats.records == 4
+    assert stats.blobs == 1
+    assert stats.blob_bytes == len(b"blob data")
+    assert "3 transactions, 4 records, 1 blobs" in str(stats)
+
+    source = _open(source_uri)
+    destination = _open(destination_uri)
+    assert _transactions(destination.storage) == _transactions(source.storage)
+    assert stats.last_tid == source.storage.lastTransaction()
+    assert _read_blob(destination, "blob") == b"blob data"
+    # The source's blob file is untouched.
+    assert _read_blob(source, "blob") == b"blob data"
+    source.close()
+    destination.close()
+
+
+def test_copy_resumes_after_last_transaction(tmpdir, source_uri):
+    from zodburi.migrate import copy
+
+    destination_uri = _file_uri(tmpdir, "destination")
+    copy(source_uri, destination_uri)
+    db = _open(source_uri)
+    _commit(db, answer=43)
+    db.close()
+
+    stats = copy(source_uri, destination_uri)
+
+    assert stats.start is not None
+    assert stats.transactions == 1
+    source = FileStorage(f"{tmpdir}/source.fs", read_only=True)
+    destination = FileStorage(f"{tmpdir}/destination.fs", read_only=True)
+    assert _transactions(destination) == _transactions(source)
+    source.close()
+    destination.close()
+
+
+def test_copy_storage_falls_back_to_copying_blob_files(tmpdir, source_uri):
+    from zodburi.migrate import copy
+
+    destination_uri = _file_uri(tmpdir, "destination")
+
+    with mock.patch("os.link", side_effect=OSError("cross-device link")):
+        stats = copy(source_uri, destination_uri)
+
+    assert stats.blobs == 1
+    destination = _open(destination_uri)
+    assert _read_blob(destination, "blob") == b"blob data"
+    destination.close()
+
+
+def test_copy_storage_from_memory_wo_blobs(tmpdir):
+    from zodburi.migrate import copy_storage
+
+    source = MappingStorage()
+    db = DB(source)
+    _commit(db, answer=42)
+    destination = FileStorage(os.path.join(tmpdir, "Data.fs"))
+
+    stats = copy_storage(source, destination)
+
+    assert stats.transactions == 2
+    assert _transactions(destination) == _transactions(source)
+    db.close()
+    destination.close()
+
+
+def test_copy_storage_reports_progress(tmpdir, source_uri):
+    from zodburi.migrate import copy
+
+    report = mock.Mock()
+
+    stats = copy(
+        source_uri, _file_uri(tmpdir, "destination"),
+        report=report, report_interval=0)
+
+    assert report.call_count == 3
+    report.assert_called_with(stats)
+
+
+def test_copy_storage_skips_missing_blob_files(tmpdir, source_uri):
+    from ZODB.POSException import POSKeyError
+
+    from zodburi.migrate import copy
+
+    destination_uri = _file_uri(tmpdir, "destination")
+
+    with mock.patch(
+        "ZODB.blob.BlobStorage.loadBlob", side_effect=POSKeyError("gone"),
+    ):
+        stats = copy(source_uri, destination_uri)
+
+    assert stats.transactions == 3
+    assert stats.blobs == 0
+
+
+def test_copy_storage_w_destination_wo_restore():
+    from zodburi.migrate import DestinationNotRestorable
+    from zodburi.migrate import copy_storage
+
+    destination = MappingStorage()
+
+    with pytest.raises(DestinationNotRestorable):
+        copy_storage(MappingStorage(), destination)
+
+
+def test_copy_storage_w_destination_wo_blobs(tmpdir, source_uri):
+    from zodburi.migrate import DestinationWithoutBlobs
+    from zodburi.migrate import copy
+
+    with pytest.raises(DestinationWithoutBlobs):
+        copy(source_uri, _file_uri(tmpdir, "destination", blobs=False))
+
+
+def test_copy_storage_w_failing_read(tmpdir):
+    from zodburi.migrate import copy_storage
+
+    source = mock.Mock(spec=["iterator"])
+    source.iterator.side_effect = ValueError("testing")
+    destination = FileStorage(os.path.join(tmpdir, "Data.fs"))
+
+    with pytest.raises(ValueError, match="testing"):
+        copy_storage(source, destination)
+
+    destination.close()
+
+
+def test__read_retries_full_queue_and_stops():
+    import queue
+    import threading
+
+    from zodburi.migrate import _read
+
+    db = DB(MappingStorage())
+    _commit(db, a=1)
+    stopped = threading.Event()
+    items = []
+
+    class _Queue:
+        full = True
+
+        def put(self, item, timeout):
+            if self.full:
+                self.full = False
+                raise queue.Full
+            items.append(item)
+            stopped.set()
+
+    _read(db.storage, None, None, None, _Queue(), stopped)
+
+    assert len(items) == 1
+    db.close()
+
+
+def test__read_w_failing_iterator():
+    import queue
+    import threading
+
+    from zodburi.migrate import _read
+
+    source = mock.Mock(spec=["iterator"])
+    source.iterator.side_effect = ValueError("testing")
+    transactions = queue.Queue()
+
+    _read(source, None, None, None, transactions, threading.Event())
+
+    error = transactions.get_nowait()
+    assert isinstance(error, ValueError)
+    assert transactions.empty()
+
+
+def test_copy_storage_w_failing_write_aborts(tmpdir, source_uri):
+    from zodburi.migrate import copy
+
+    destination_uri = _file_uri(tmpdir, "destination")
+
+    with mock.patch(
+        "ZODB.FileStorage.FileStorage.FileStorage.restore",
+        side_effect=[None, ValueError("testing")],
+    ):
+        with pytest.raises(ValueError, match="testing"):
+            copy(source_uri, destination_uri, queue_size=1)
+
+    destination = FileStorage(f"{tmpdir}/destination.fs", read_only=True)
+    assert len(_transactions(destination)) == 1
+    destination.close()
+
+
+def test_main_copy(tmpdir, source_uri, capsys):
+    from zodburi.__main__ import main
+
+    destination_uri = _file_uri(tmpdir, "destination")
+
+    assert main(["copy", source_uri, destination_uri]) == 0
+
+    assert capsys.readouterr().err.startswith("copied 3 transactions")
+    destination = _open(destination_uri)
+    assert _read_blob(destination, "blob") == b"blob data"
+    destination.close()
+
+
+def test_main_copy_quiet(tmpdir, source_uri, capsys):
+    from zodburi.__main__ import main
+
+    destination_uri = _file_uri(tmpdir, "destination")
+
+    assert main(["copy", "-q", source_uri, destination_uri]) == 0
+
+    assert capsys.readouterr().err == ""
+
+
+def test_main_wo_command(capsys):
+    from zodburi.__main__ import main
+
+    with pytest.raises(SystemExit):
+        main([])
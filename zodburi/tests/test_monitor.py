@@ -0,0 +1,241 @@
+import pathlib
+import socket
+import tempfile
+import threading
+from unittest import mock
+
+import pytest
+import ZEO
+from ZODB.DB import DB
+from ZODB.MappingStorage import MappingStorage
+
+from zodburi.tests.util import wait_for
+
+
+@pytest.fixture(scope="function")
+def tmpdir():
+    with tempfile.TemporaryDirectory() as tmp:
+        yield tmp
+
+
+def _commit(db, **kw):
+    with db.transaction() as conn:
+        conn.root().update(kw)
+
+
+def test_countingactivitymonitor_keeps_totals():
+    from zodburi.monitor import CountingActivityMonitor
+
+    db = DB(MappingStorage())
+    monitor = CountingActivityMonitor(60)
+    db.setActivityMonitor(monitor)
+
+    _commit(db, answer=42)
+    _commit(db, question="?")
+
+    assert monitor.getHistoryLength() == 60
+    assert monitor.totals == {
+        "connections": len(monitor.log),
+        "loads": sum(loads for _, loads, _ in monitor.log),
+        "stores": sum(stores for _, _, stores in monitor.log),
+    }
+    assert monitor.totals["connections"] >= 2
+    assert monitor.totals["stores"] >= 2
+    db.close()
+
+
+def test_collect_metrics_wo_activity_monitor():
+    from zodburi.monitor import collect_metrics
+
+    db = DB(MappingStorage(), pool_size=3, cache_size=123)
+    conn = db.open()
+    conn.root()
+
+    metrics = {name: value for name, _, _, value in collect_metrics(db)}
+
+    assert metrics == {
+        "zodb_connection_pool_size": 3,
+        "zodb_connections": 1,
+        "zodb_connections_in_use": 1,
+        "zodb_cache_size_target": 123,
+        "zodb_cache_objects": 1,
+        "zodb_cache_bytes": metrics["zodb_cache_bytes"],
+    }
+    conn.close()
+    db.close()
+
+
+def test_collect_metrics_w_zeo_client_cache():
+    from zodburi.monitor import collect_metrics
+
+    addr, stop = ZEO.server()
+    try:
+        db = ZEO.DB(addr)
+        _commit(db, answer=42)
+        metrics = {name: value for name, _, _, value in collect_metrics(db)}
+        db.close()
+    finally:
+        stop()
+
+    assert metrics["zodb_zeo_cache_adds_total"] > 0
+    assert "zodb_zeo_cache_hits_total" in metrics
+    assert "zodb_zeo_cache_evicts_total" in metrics
+
+
+def test_format_metrics():
+    from zodburi.databases import DatabaseMapping
+    from zodburi.monitor import CountingActivityMonitor
+    from zodburi.monitor import format_metrics
+
+    databases = DatabaseMapping()
+    first = DB(MappingStorage(), databases=databases, database_name="first")
+    second = DB(MappingStorage(), databases=databases, database_name='s"2')
+    first.setActivityMonitor(CountingActivityMonitor())
+    _commit(first, answer=42)
+
+    text = format_metrics([first, second])
+
+    lines = text.splitlines()
+    assert lines[:3] == [
+        "# HELP zodb_connections_closed_total Connections closed.",
+        "# TYPE zodb_connections_closed_total counter",
+        'zodb_connections_closed_total{database="first"} 1',
+    ]
+    assert 'zodb_connection_pool_size{database="first"} 7' in lines
+    assert 'zodb_connection_pool_size{database="s\\"2"} 7' in lines
+    assert lines.count("# TYPE zodb_connection_pool_size gauge") == 1
+    assert text.endswith("\n")
+    first.close()
+    second.close()
+
+
+def test_metricsexporter_export_to_file(tmpdir):
+    from zodburi.monitor import MetricsExporter
+
+    path = pathlib.Path(tmpdir) / "zodb.prom"
+    exporter = MetricsExporter(path=str(path))
+
+    assert not exporter.export()
+
+    db = DB(MappingStorage())
+    exporter._dbs.add(db)
+
+    assert exporter.export()
+    assert 'zodb_connections{database="unnamed"} ' in path.read_text()
+    assert sorted(p.name for p in path.parent.iterdir()) == ["zodb.prom"]
+
+    db.close()
+
+    assert not exporter.export()
+
+
+def test_metricsexporter_export_to_socket(tmpdir):
+    from zodburi.monitor import MetricsExporter
+
+    socket_path = str(pathlib.Path(tmpdir) / "metrics.sock")
+    received = []
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as server:
+        server.bind(socket_path)
+        server.listen(1)
+
+        def accept():
+            conn, _ = server.accept()
+            with conn:
+                received.append(conn.makefile("rb").read())
+
+        thread = threading.Thread(target=accept)
+        thread.start()
+
+        exporter = MetricsExporter(socket_path=socket_path)
+        db = DB(MappingStorage())
+        exporter._dbs.add(db)
+        assert exporter.export()
+        thread.join(5)
+
+    assert b"# TYPE zodb_connections gauge" in received[0]
+    db.close()
+
+
+def test_metricsexporter_thread_until_databases_closed(tmpdir):
+    from zodburi.monitor import MetricsExporter
+
+    path = pathlib.Path(tmpdir) / "zodb.prom"
+    exporter = MetricsExporter(0.01, path=str(path))
+    db = DB(MappingStorage())
+
+    exporter.add(db)
+    thread = exporter._thread
+
+    wait_for(path.exists)
+    assert path.exists()
+
+    db.close()
+    thread.join(5)
+    assert not thread.is_alive()
+
+    other = DB(MappingStorage())
+    exporter.add(other)
+    assert exporter._thread is not thread
+    exporter.stop()
+    exporter._thread.join(5)
+    other.close()
+
+
+def test_metricsexporter_thread_logs_failures():
+    from zodburi.monitor import MetricsExporter
+
+    exporter = MetricsExporter(0.01)
+
+    with mock.patch.object(exporter, "run") as run:
+        run.side_effect = [ValueError("testing"), False]
+        with mock.patch("zodburi.databases.logger") as logger:
+            exporter._run()
+
+    logger.exception.assert_called_once()
+
+
+@pytest.mark.parametrize("kw, expected_monitor, expected_exporter", [
+    ({"activity_monitor": 1}, True, False),
+    ({"metrics_file": "/tmp/zodb.prom"}, False, True),
+    ({"metrics_socket": "/tmp/zodb.sock"}, False, True),
+])
+def test_monitor_hook(kw, expected_monitor, expected_exporter):
+    from zodburi.monitor import CountingActivityMonitor
+    from zodburi.monitor import monitor_hook
+
+    with mock.patch("zodburi.monitor.MetricsExporter") as exporter_klass:
+        hook = monitor_hook(**kw)
+        db = DB(MappingStorage())
+        hook(db)
+
+    monitor = db.getActivityMonitor()
+    assert isinstance(monitor, CountingActivityMonitor) == expected_monitor
+    assert exporter_klass.return_value.add.called == expected_exporter
+    db.close()
+
+
+def test_resolve_uri_w_monitor_parameters(tmpdir):
+    from zodburi import resolve_uri
+    from zodburi.monitor import CountingActivityMonitor
+
+    path = pathlib.Path(tmpdir) / "zodb.prom"
+    factory, dbkw = resolve_uri(
+        f"memory://?activity_monitor=true&activity_monitor_history=60"
+        f"&metrics_file={path}&metrics_interval=0.01"
+    )
+    db = DB(factory(), **dbkw)
+
+    monitor = db.getActivityMonitor()
+    assert isinstance(monitor, CountingActivityMonitor)
+    assert monitor.getHistoryLength() == 60
+
+    _commit(db, answer=42)
+
+    stores = monitor.totals["stores"]
+    expected = f'zodb_stores_total{{database="unnamed"}} {stores}'
+
+    wait_for(lambda: path.exists() and expected in path.read_text())
+
+    assert expected in path.read_text()
+    db.close()
@@ -0,0 +1,230 @@
+import datetime
+import os
+import time
+from unittest import mock
+
+import pytest
+from ZODB.DB import DB
+from ZODB.FileStorage import FileStorage
+from ZODB.MappingStorage import MappingStorage
+
+from zodburi.tests.util import wait_for
+
+
+def _commit(db, **kw):
+    with db.transaction() as conn:
+        conn.root().update(kw)
+
+
+def _make_garbage(db, count=20):
+    for i in range(count):
+        _commit(db, value="x" * 1000 + str(i))
+
+
+@pytest.mark.parametrize("window, expected", [
+    ("02:00-04:30", (datetime.time(2), datetime.time(4, 30))),
+    (" 22:00 - 4:00 ", (datetime.time(22), datetime.time(4))),
+])
+def test_parse_window(window, expected):
+    from zodburi.pack import parse_window
+
+    assert parse_window(window) == expected
+
+
+@pytest.mark.parametrize("window", ["02:00", "2am-4am", "25:00-04:00"])
+def test_parse_window_w_invalid(window):
+    from zodburi.pack import InvalidPackWindow
+    from zodburi.pack import parse_window
+
+    with pytest.raises(InvalidPackWindow):
+        parse_window(window)
+
+
+@pytest.mark.parametrize("window, now, expected", [
+    ("02:00-04:00", datetime.time(1, 59), False),
+    ("02:00-04:00", datetime.time(2), True),
+    ("02:00-04:00", datetime.time(4), False),
+    ("22:00-04:00", datetime.time(23), True),
+    ("22:00-04:00", datetime.time(3), True),
+    ("22:00-04:00", datetime.time(12), False),
+])
+def test_in_window(window, now, expected):
+    from zodburi.pack import in_window
+    from zodburi.pack import parse_window
+
+    assert in_window(parse_window(window), now) == expected
+
+
+def test_in_window_wo_now():
+    from zodburi.pack import in_window
+
+    assert in_window((datetime.time(0), datetime.time(23, 59, 59, 999999)))
+
+
+def test_throttled_packer(tmpdir):
+    from zodburi.pack import throttled_packer
+
+    path = os.path.join(tmpdir, "Data.fs")
+    storage = FileStorage(path, packer=throttled_packer(1 << 30))
+    db = DB(storage)
+    _make_garbage(db)
+    size = db.getSize()
+
+    with mock.patch("zodburi.pack.time.sleep") as sleep:
+        db.pack()
+
+    assert db.getSize() < size
+    assert not sleep.called  # far below the rate
+
+    _make_garbage(db)
+    storage.packer = throttled_packer(1)
+
+    with mock.patch("zodburi.pack.time.sleep") as sleep:
+        db.pack()
+
+    assert sleep.called
+    db.close()
+
+
+def test_throttled_packer_wo_garbage(tmpdir):
+    from zodburi.pack import throttled_packer
+
+    path = os.path.join(tmpdir, "Data.fs")
+    storage = FileStorage(path, packer=throttled_packer(None))
+    db = DB(storage)
+    size = db.getSize()
+    # Only the root object:  the packer frees nothing.
+    db.pack()
+    assert db.getSize() == size
+    _commit(db, value=1)
+    db.pack()
+    size = db.getSize()
+
+    db.pack()
+
+    assert db.getSize() == size
+    db.close()
+
+
+def test_packscheduler_packs_when_due(tmpdir):
+    from zodburi.pack import PackScheduler
+    from zodburi.pack import pack_stats
+
+    db = DB(FileStorage(os.path.join(tmpdir, "Data.fs")))
+    _make_garbage(db)
+    scheduler = PackScheduler(3600)
+
+    with mock.patch.object(scheduler, "_run"):
+        scheduler.add(db)
+
+    assert scheduler.interval == 60.0
+    stats = pack_stats(db)
+    assert stats["packs"] == 0
+    assert stats["next_pack"] > time.time()
+
+    scheduler.run()
+    assert pack_stats(db)["packs"] == 0
+
+    scheduler._stats[db]["next_pack"] = 0
+    scheduler.run()
+
+    stats = pack_stats(db)
+    assert stats["packs"] == 1
+    assert stats["failures"] == 0
+    assert stats["last_size_after"] < stats["last_size_before"]
+    assert stats["last_error"] is None
+    assert stats["last_duration"] >= 0
+    assert stats["next_pack"] == stats["last_pack"] + 3600
+    db.close()
+
+
+def test_packscheduler_waits_for_window():
+    from zodburi.pack import PackScheduler
+
+    db = DB(MappingStorage())
+    scheduler = PackScheduler(10, window=mock.sentinel.window)
+    scheduler._dbs.add(db)
+    scheduler._stats[db] = {"next_pack": 0}
+
+    with mock.patch("zodburi.pack.in_window", return_value=False):
+        with mock.patch.object(scheduler, "pack") as pack:
+            scheduler.run()
+
+    assert not pack.called
+    db.close()
+
+
+def test_packscheduler_records_failures():
+    from zodburi.pack import PackScheduler
+
+    db = DB(MappingStorage())
+    scheduler = PackScheduler(10, pack_days=2)
+
+    with mock.patch.object(scheduler, "_run"):
+        scheduler.add(db)
+
+    with mock.patch.object(db, "pack", side_effect=ValueError("testing")):
+        scheduler.pack(db)
+
+    stats = scheduler.stats(db)
+    assert stats["packs"] == 0
+    assert stats["failures"] == 1
+    assert stats["last_error"] == "ValueError('testing')"
+    db.close()
+
+
+def test_pack_stats_wo_scheduler():
+    from zodburi.pack import pack_stats
+
+    db = DB(MappingStorage())
+    assert pack_stats(db) is None
+    db.close()
+
+
+def test_pack_hook():
+    from zodburi.pack import pack_hook
+
+    hook = pack_hook(3600, 7, "02:00-04:00")
+    scheduler = hook.__self__
+
+    assert scheduler.pack_interval == 3600
+    assert scheduler.pack_days == 7
+    assert scheduler.window == (datetime.time(2), datetime.time(4))
+
+
+def test_resolve_uri_w_pack_interval(tmpdir):
+    from zodburi import resolve_uri
+    from zodburi.pack import pack_stats
+
+    path = os.path.join(tmpdir, "Data.fs")
+    factory, dbkw = resolve_uri(
+        f"file://{path}?pack_interval=0.05&pack_rate=10mb"
+        f"&activity_monitor=true"
+    )
+    db = DB(factory(), **dbkw)
+    _make_garbage(db)
+
+    assert wait_for(lambda: pack_stats(db)["packs"])
+    assert len(dbkw["databases"].hooks) == 2
+    db.close()
+
+
+def test_resolve_uri_w_pack_interval_creates_databases_again(tmpdir):
+    from zodburi import resolve_uri
+    from zodburi.databases import join_databases
+
+    path = os.path.join(tmpdir, "Data.fs")
+    factory, dbkw = resolve_uri(f"file://{path}?pack_interval=3600")
+
+    DB(factory(), **dbkw).close()
+    db = DB(factory(), **dbkw)
+    db.close()
+
+    # Joining a multi-database of the caller's.
+    other = DB(None, database_name="other")
+    db = DB(factory(), **join_databases(dbkw, other.databases))
+    assert other.databases == {"other": other, "unnamed": db}
+    hook, = dbkw["databases"].hooks
+    assert hook.__self__.open_databases() == [db]
+    db.close()
+    other.close()
@@ -0,0 +1,304 @@
+import threading
+from unittest import mock
+
+import persistent
+import pytest
+from ZODB.DB import DB
+from ZODB.MappingStorage import MappingStorage
+from ZODB.utils import p64
+from ZODB.utils import z64
+
+from zodburi.tests.util import wait_for
+
+
+class Node(persistent.Persistent):
+
+    def __init__(self, *children):
+        self.children = list(children)
+
+
+def _populate(storage):
+    # root -> tree -> a, b -> a1, b1
+    db = DB(storage)
+    with db.transaction() as conn:
+        a = Node(Node())
+        b = Node(Node())
+        tree = conn.root()["tree"] = Node(a, b)
+    oids = {
+        "tree": tree._p_oid,
+        "a": a._p_oid,
+        "b": b._p_oid,
+        "a1": a.children[0]._p_oid,
+        "b1": b.children[0]._p_oid,
+    }
+    return db, oids
+
+
+class RecordingStorage:
+    # Record the loads of the wrapped storage, letting tests hold them.
+
+    def __init__(self, storage):
+        self._storage = storage
+        self.loads = []
+        self.release = threading.Event()
+        self.release.set()
+
+    def loadBefore(self, oid, tid):
+        self.release.wait()
+        self.loads.append(oid)
+        return self._storage.loadBefore(oid, tid)
+
+    def __getattr__(self, name):
+        return getattr(self._storage, name)
+
+
+def _wait_idle(storage):
+    storage._executor.submit(lambda: None).result()
+    while storage._pending:
+        next(iter(storage._pending.values())).result()
+
+
+@pytest.fixture
+def mapping():
+    storage = MappingStorage()
+    db, oids = _populate(storage)
+    yield storage, oids
+    db.close()
+
+
+def _prefetching(mapping, **kw):
+    from zodburi.prefetch import PrefetchingStorage
+
+    recording = RecordingStorage(mapping[0])
+    return PrefetchingStorage(lambda: recording, **kw), recording
+
+
+def test_prefetching_storage_buffers_children(mapping):
+    _, oids = mapping
+    storage, recording = _prefetching(mapping)
+    tid = p64(2 ** 62)
+
+    tree = storage.loadBefore(oids["tree"], tid)
+    _wait_idle(storage)
+
+    assert tree == mapping[0].loadBefore(oids["tree"], tid)
+    assert sorted(recording.loads) == sorted(
+        [oids["tree"], oids["a"], oids["b"]])
+    assert set(storage._buffer) == {(oids["a"], tid), (oids["b"], tid)}
+
+    # Buffered records are served once, and their children prefetched.
+    recording.loads.clear()
+    assert storage.loadBefore(oids["a"], tid) == mapping[0].loadBefore(
+        oids["a"], tid)
+    _wait_idle(storage)
+    assert recording.loads == [oids["a1"]]
+    assert (oids["a"], tid) not in storage._buffer
+    assert (oids["a1"], tid) in storage._buffer
+    storage.close()
+
+
+def test_prefetching_storage_waits_for_pending_fetch(mapping):
+    _, oids = mapping
+    storage, recording = _prefetching(mapping, workers=1)
+    tid = p64(2 ** 62)
+
+    storage.loadBefore(oids["tree"], tid)
+    recording.release.clear()
+    storage._prefetch(
+        mapping[0].loadBefore(oids["a"], tid)[0], tid, depth=1)
+    assert (oids["a1"], tid) in storage._pending
+    threading.Timer(0.05, recording.release.set).start()
+
+    assert storage.loadBefore(oids["a1"], tid) == mapping[0].loadBefore(
+        oids["a1"], tid)
+    assert recording.loads.count(oids["a1"]) == 1
+    storage.close()
+
+
+def test_prefetching_storage_w_depth(mapping):
+    _, oids = mapping
+    storage, recording = _prefetching(mapping, depth=2)
+    tid = p64(2 ** 62)
+
+    storage.loadBefore(oids["tree"], tid)
+    _wait_idle(storage)
+
+    assert {key[0] for key in storage._buffer} == {
+        oids["a"], oids["b"], oids["a1"], oids["b1"]}
+    storage.close()
+
+
+def test_prefetching_storage_wo_depth(mapping):
+    _, oids = mapping
+    storage, recording = _prefetching(mapping, depth=0)
+
+    storage.loadBefore(oids["tree"], p64(2 ** 62))
+
+    assert recording.loads == [oids["tree"]]
+    assert not storage._pending
+    storage.close()
+
+
+def test_prefetching_storage_w_full_buffer(mapping):
+    _, oids = mapping
+    storage, recording = _prefetching(mapping, depth=2, buffer_size=1)
+    tid = p64(2 ** 62)
+
+    storage.loadBefore(oids["tree"], tid)
+    _wait_idle(storage)
+    assert len(storage._buffer) == 1
+    recording.loads.clear()
+
+    storage.loadBefore(oids["b"], tid)
+    _wait_idle(storage)
+    assert len(recording.loads) <= 2
+    assert len(storage._buffer) <= 1
+    storage.close()
+
+
+def test_prefetching_storage_w_failing_fetch(mapping):
+    from zodburi.prefetch import PrefetchingStorage
+
+    _, oids = mapping
+    base = mapping[0]
+    failing = mock.Mock(wraps=base)
+
+    def loadBefore(oid, tid):
+        if oid == oids["a"]:
+            raise OSError("boom")
+        return base.loadBefore(oid, tid)
+
+    failing.loadBefore.side_effect = loadBefore
+    storage = PrefetchingStorage(lambda: failing)
+    tid = p64(2 ** 62)
+
+    storage.loadBefore(oids["tree"], tid)
+    _wait_idle(storage)
+
+    assert set(storage._buffer) == {(oids["b"], tid)}
+    with pytest.raises(OSError):
+        storage.loadBefore(oids["a"], tid)
+    storage.close()
+
+
+def test_prefetching_storage_w_storage_prefetch(mapping):
+    from zodburi.prefetch import PrefetchingStorage
+
+    _, oids = mapping
+    base = mapping[0]
+    zeo = mock.Mock(wraps=base)
+    zeo.prefetch = mock.Mock()
+    storage = PrefetchingStorage(lambda: zeo, depth=2)
+    tid = p64(2 ** 62)
+
+    storage.loadBefore(oids["tree"], tid)
+    storage._executor.submit(lambda: None).result()
+    storage.close()
+
+    assert zeo.prefetch.call_args_list == [
+        mock.call([oids["a"], oids["b"]], tid),
+        mock.call([oids["a1"]], tid),
+        mock.call([oids["b1"]], tid),
+    ]
+    assert not storage._buffer
+
+
+def test_prefetching_storage_w_storage_prefetch_w_failing_load(mapping):
+    from zodburi.prefetch import PrefetchingStorage
+
+    _, oids = mapping
+    base = mapping[0]
+    zeo = mock.Mock(wraps=base)
+    zeo.prefetch = mock.Mock()
+
+    def loadBefore(oid, tid):
+        if oid == oids["a"]:
+            raise OSError("boom")
+        return base.loadBefore(oid, tid)
+
+    zeo.loadBefore.side_effect = loadBefore
+    storage = PrefetchingStorage(lambda: zeo, depth=2)
+    tid = p64(2 ** 62)
+
+    storage.loadBefore(oids["tree"], tid)
+    storage._executor.submit(lambda: None).result()
+    storage.close()
+
+    assert zeo.prefetch.call_args_list == [
+        mock.call([oids["a"], oids["b"]], tid),
+        mock.call([oids["b1"]], tid),
+    ]
+
+
+def test_prefetching_storage_fetch_evicts_oldest(mapping):
+    _, oids = mapping
+    storage, recording = _prefetching(mapping, depth=0, buffer_size=2)
+    tid = p64(2 ** 62)
+    storage._buffer[oids["a"], tid] = None
+    storage._buffer[oids["b"], tid] = None
+    storage._pending[oids["a1"], tid] = None
+
+    assert storage._fetch(recording, oids["a1"], tid, 0) == (
+        mapping[0].loadBefore(oids["a1"], tid))
+
+    assert list(storage._buffer) == [(oids["b"], tid), (oids["a1"], tid)]
+    assert not storage._pending
+    storage.close()
+
+
+def test_prefetching_storage_w_zeo(tmpdir):
+    import ZEO
+
+    from zodburi.prefetch import PrefetchingStorage
+
+    address, stop = ZEO.server(path=f"{tmpdir}/Data.fs")
+    try:
+        db, oids = _populate(ZEO.client(address))
+        db.close()
+
+        client = ZEO.client(address)
+        storage = PrefetchingStorage(lambda: client)
+        db = DB(storage)
+        with db.transaction() as conn:
+            tree = conn.root()["tree"]
+            assert len(tree.children) == 2
+            cache = client._cache
+            # The children were prefetched into the ZEO client cache.
+            wait_for(lambda: cache.load(oids["b"]) is not None)
+            assert cache.load(oids["a"]) is not None
+            assert cache.load(oids["b"]) is not None
+        db.close()
+    finally:
+        stop()
+
+
+def test_prefetching_storage_w_db(tmpdir):
+    from ZODB.FileStorage import FileStorage
+
+    from zodburi.prefetch import PrefetchingStorage
+
+    path = f"{tmpdir}/Data.fs"
+    db, oids = _populate(FileStorage(path))
+    db.close()
+
+    storage = PrefetchingStorage(lambda: FileStorage(path), depth=2)
+    db = DB(storage)
+    with db.transaction() as conn:
+        tree = conn.root()["tree"]
+        assert [len(child.children) for child in tree.children] == [1, 1]
+        tree.children.append(Node())
+    with db.transaction() as conn:
+        assert len(conn.root()["tree"].children) == 3
+    db.close()
+
+    assert not storage._buffer
+
+
+def test_prefetching_storage_close(mapping):
+    storage, _ = _prefetching(mapping)
+    storage.loadBefore(z64, p64(2 ** 62))
+
+    storage.close()
+
+    with pytest.raises(RuntimeError):
+        storage._executor.submit(lambda: None)
@@ -0,0 +1,342 @@
+import os
+import tempfile
+import threading
+from unittest import mock
+
+import pytest
+from ZODB.DB import DB
+from ZODB.interfaces import IBlobStorage
+from ZODB.interfaces import IStorage
+from ZODB.MappingStorage import MappingStorage
+
+
+@pytest.fixture(scope="function")
+def tmpdir():
+    with tempfile.TemporaryDirectory() as tmp:
+        yield tmp
+
+
+def _make_proxy(factory=MappingStorage, **kw):
+    from zodburi.proxy import StorageProxy
+    return StorageProxy(factory, **kw)
+
+
+def test_storageproxy_opens_eagerly():
+    factory = mock.Mock(spec_set=())
+
+    proxy = _make_proxy(factory)
+
+    factory.assert_called_once_with()
+    assert proxy._storage is factory.return_value
+    assert proxy._pid == os.getpid()
+
+
+def test_storageproxy_w_lazy_defers_open():
+    factory = mock.Mock(spec_set=(), return_value=MappingStorage())
+
+    proxy = _make_proxy(factory, lazy=True)
+
+    factory.assert_not_called()
+    assert repr(proxy) == "<StorageProxy for unopened storage>"
+
+    assert proxy.getName() == "MappingStorage"
+    factory.assert_called_once_with()
+
+
+def test_storageproxy_w_lazy_opens_once_across_threads():
+    opened = []
+    started = threading.Event()
+
+    def factory():
+        opened.append(None)
+        started.wait(1)
+        return MappingStorage()
+
+    proxy = _make_proxy(factory, lazy=True)
+    threads = [
+        threading.Thread(target=proxy.lastTransaction) for _ in range(4)
+    ]
+
+    for thread in threads:
+        thread.start()
+    started.set()
+    for thread in threads:
+        thread.join()
+
+    assert len(opened) == 1
+
+
+def test_storageproxy_w_lazy_defers_registerDB():
+    proxy = _make_proxy(lazy=True)
+    db = mock.Mock(spec_set=("invalidateCache",))
+
+    proxy.registerDB(db)
+
+    assert proxy._storage is None
+
+    with mock.patch("ZODB.MappingStorage.MappingStorage.registerDB") as rdb:
+        proxy.lastTransaction()
+
+    rdb.assert_called_once_with(db)
+
+
+def test_storageproxy_w_lazy_under_db():
+    proxy = _make_proxy(lazy=True)
+
+    db = DB(proxy)
+    with db.transaction() as conn:
+        conn.root.answer = 42
+
+    assert proxy._storage.getSize() > 0
+    db.close()
+
+
+def test_storageproxy_w_background_opens_in_thread():
+    release = threading.Event()
+
+    def factory():
+        release.wait(5)
+        return MappingStorage()
+
+    proxy = _make_proxy(factory, background=True)
+
+    assert proxy.state() == "opening"
+    assert not proxy.ready()
+    assert not proxy.wait(0.01)
+
+    release.set()
+
+    assert proxy.wait(5)
+    assert proxy.ready()
+    assert proxy.state() == "ready"
+    assert proxy.getName() == "MappingStorage"
+
+    proxy.close()
+
+    assert proxy.state() == "closed"
+    assert not proxy.ready()
+
+
+def test_storageproxy_w_background_open_failure_retries_on_use():
+    factory = mock.Mock(spec_set=(), side_effect=[ValueError("testing")])
+
+    with mock.patch("zodburi.proxy.logger") as logger:
+        proxy = _make_proxy(factory, background=True)
+        assert not proxy.wait(5)
+
+    logger.exception.assert_called_once()
+    assert proxy.state() == "failed"
+
+    factory.side_effect = None
+    factory.return_value = MappingStorage()
+
+    assert proxy.getName() == "MappingStorage"
+    assert proxy.state() == "ready"
+
+
+def test_storageproxy_wait_for_connection():
+    storage = mock.Mock(spec_set=("is_connected", "close"))
+    storage.is_connected.return_value = False
+    proxy = _make_proxy(lambda: storage)
+
+    with mock.patch("zodburi.proxy.READY_POLL_INTERVAL", 0.01):
+        assert not proxy.wait(0.05)
+        assert proxy.state() == "disconnected"
+
+        connect = threading.Timer(
+            0.05, setattr, (storage.is_connected, "return_value", True),
+        )
+        connect.start()
+
+        assert proxy.wait()
+        assert proxy.state() == "ready"
+
+
+def test_storageproxy_wait_gives_up_if_released():
+    storage = mock.Mock(spec_set=("is_connected", "close"))
+    storage.is_connected.return_value = False
+    proxy = _make_proxy(lambda: storage)
+    proxy.close()
+
+    assert not proxy.wait()
+
+
+def test_storageproxy_state_w_lazy():
+    proxy = _make_proxy(lazy=True)
+
+    assert proxy.state() == "unopened"
+
+
+def test_storageproxy_w_background_zeo():
+    import ZEO
+    from zodburi import resolve_uri
+
+    addr, stop = ZEO.server()
+    try:
+        host, port = addr
+        factory, dbkw = resolve_uri(
+            f"zeo://{host}:{port}?wait=false&background=true"
+        )
+        proxy = factory()
+
+        assert proxy.wait(10)
+        assert proxy.state() == "ready"
+        proxy.close()
+    finally:
+        stop()
+
+
+def test_storageproxy_delegates_attributes_and_interfaces():
+    proxy = _make_proxy(lambda: MappingStorage("foo"))
+
+    assert proxy.getName() == "foo"
+    assert proxy.getName.__name__ == "getName"
+    assert proxy._ltid == proxy._storage._ltid
+    assert len(proxy) == 0
+    assert IStorage.providedBy(proxy)
+    assert not IBlobStorage.providedBy(proxy)
+    assert "MappingStorage" in repr(proxy)
+
+    with pytest.raises(AttributeError):
+        proxy.__bogus__
+
+
+def test_storageproxy_cached_methods_follow_reopen():
+    storages = []
+
+    def factory():
+        storages.append(MappingStorage(str(len(storages))))
+        return storages[-1]
+
+    proxy = _make_proxy(factory, fork_safe=True)
+    getName = proxy.getName
+    assert getName() == "0"
+
+    proxy._release()
+
+    assert getName() == "1"
+    assert storages[0].opened() is False
+
+
+def test_storageproxy_reregisters_dbs_on_reopen():
+    proxy = _make_proxy()
+    db = mock.Mock(spec_set=("invalidateCache",))
+    proxy.registerDB(db)
+
+    with proxy._lock:
+        proxy._release()
+
+    with mock.patch("ZODB.MappingStorage.MappingStorage.registerDB") as rdb:
+        proxy.lastTransaction()
+
+    rdb.assert_called_once_with(db)
+    db.invalidateCache.assert_called_once_with()
+
+
+def test_storageproxy_abandons_storage_inherited_across_fork():
+    proxy = _make_proxy()
+    inherited = proxy._storage
+
+    child_pid = proxy._pid + 1
+
+    with mock.patch("os.getpid", return_value=child_pid):
+        proxy.lastTransaction()
+        assert proxy._storage is not inherited
+        assert proxy._pid == child_pid
+
+    assert inherited.opened()
+
+
+def test_storageproxy_close():
+    from zodburi.proxy import StorageProxyClosed
+    from zodburi.proxy import _fork_safe_proxies
+
+    proxy = _make_proxy(fork_safe=True)
+    storage = proxy._storage
+    assert proxy in _fork_safe_proxies
+
+    proxy.close()
+    proxy.close()
+
+    assert not storage.opened()
+    assert proxy not in _fork_safe_proxies
+
+    with pytest.raises(StorageProxyClosed):
+        proxy.lastTransaction()
+
+
+def test_fork_hooks_leave_parent_storages_open():
+    from zodburi.proxy import after_fork_in_parent
+    from zodburi.proxy import before_fork
+
+    safe = _make_proxy(fork_safe=True)
+    storage, lock = safe._storage, safe._lock
+
+    before_fork()
+    after_fork_in_parent()
+
+    assert safe._storage is storage
+    assert safe._lock is lock
+    assert storage.opened()
+
+
+def test_fork_hooks_abandon_fork_safe_storages_in_child():
+    from zodburi.proxy import after_fork_in_child
+    from zodburi.proxy import before_fork
+
+    safe = _make_proxy(fork_safe=True)
+    unsafe = _make_proxy()
+    safe_storage, unsafe_storage = safe._storage, unsafe._storage
+    lock = safe._lock
+
+    before_fork()
+    after_fork_in_child()
+
+    assert safe._storage is None
+    assert safe._lock is not lock
+    assert unsafe._storage is unsafe_storage
+    # Abandoned, not closed:  the parent still uses it.
+    assert safe_storage.opened()
+    assert safe.lastTransaction() == safe._storage.lastTransaction()
+    assert safe._storage is not safe_storage
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="requires os.fork")
+def test_fork_safe_zeo_db_in_child(tmpdir):
+    import ZEO
+
+    from zodburi import resolve_uri
+
+    addr, stop = ZEO.server(path=f"{tmpdir}/Data.fs")
+    try:
+        factory, dbkw = resolve_uri(
+            f"zeo://localhost:{addr[1]}?fork_safe=1")
+        db = DB(factory(), **dbkw)
+        storage = db.storage._storage
+
+        with db.transaction() as conn:
+            conn.root.answer = 42
+
+        pid = os.fork()
+
+        if pid == 0:  # pragma: NO COVER child
+            status = 1
+            try:
+                with db.transaction() as conn:
+                    conn.root.answer += 1
+                db.close()
+                status = 0
+            finally:
+                os._exit(status)
+
+        _, status = os.waitpid(pid, 0)
+        assert os.waitstatus_to_exitcode(status) == 0
+
+        # The parent kept its storage open throughout.
+        assert db.storage._storage is storage
+        storage.sync()
+        with db.transaction() as conn:
+            assert conn.root.answer == 43
+        db.close()
+    finally:
+        stop()
@@ -60,6 +60,14 @@ def _demo_resolver():
     from zodburi.resolvers import DemoStorageURIResolver
     return DemoStorageURIResolver()
 
+def _trace_resolver():
+    from zodburi.resolvers import TraceURIResolver
+    return TraceURIResolver()
+
+def _prefetch_resolver():
+    from zodburi.resolvers import PrefetchURIResolver
+    return PrefetchURIResolver()
+
 
 @pytest.mark.parametrize("factory", [_fs_resolver, _mapping_resolver])
 def test_interpret_kwargs_noargs(factory):
@@ -194,6 +202,11 @@ def test_fsresolver_interpres_kwargs_bool_args(factory, passed, expected):
         ("/foo/bar",),
         {"read_only": 1}
     ),
+    (
+        "file:///tmp/foo/bar?pack_gc=false&pack_keep_old=0",
+        ("/tmp/foo/bar",),
+        {"pack_gc": 0, "pack_keep_old": 0}
+    ),
 ])
 def test_fsresolver___call___mock_invoke_factory(
     uri, expected_args, expected_kwargs,
@@ -225,6 +238,63 @@ def test_fsresolver___call___check_dbkw():
     }
 
 
+def test_fsresolver___call___w_pack_interval():
+    from zodburi.databases import DatabaseMapping
+    from zodburi.pack import PackScheduler
+
+    resolver = _fs_resolver()
+
+    factory, dbkw = resolver(
+        "file:///tmp/foo/bar?pack_interval=86400&pack_days=7"
+        "&pack_window=02:00-04:00&database_name=dbname"
+    )
+
+    databases = dbkw.pop("databases")
+    assert dbkw == {"database_name": "dbname"}
+    assert isinstance(databases, DatabaseMapping)
+    hook, = databases.hooks
+    scheduler = hook.__self__
+    assert isinstance(scheduler, PackScheduler)
+    assert scheduler.pack_interval == 86400.0
+    assert scheduler.pack_days == 7.0
+
+
+@pytest.mark.parametrize("query", [
+    "pack_days=7",
+    "pack_window=02:00-04:00",
+])
+def test_fsresolver___call___w_pack_options_wo_pack_interval(query):
+    from zodburi.pack import MissingPackInterval
+
+    resolver = _fs_resolver()
+
+    with pytest.raises(MissingPackInterval):
+        resolver(f"file:///tmp/foo/bar?{query}")
+
+
+def test_fsresolver___call___w_invalid_pack_window():
+    from zodburi.pack import InvalidPackWindow
+
+    resolver = _fs_resolver()
+
+    with pytest.raises(InvalidPackWindow):
+        resolver("file:///tmp/foo/bar?pack_interval=60&pack_window=2-4")
+
+
+def test_fsresolver___call___w_pack_rate():
+    resolver = _fs_resolver()
+
+    with mock.patch("zodburi.resolvers.throttled_packer") as packer:
+        factory, dbkw = resolver("file:///tmp/foo/bar?pack_rate=10mb")
+
+    with mock.patch("zodburi.resolvers.FileStorage") as fs_klass:
+        factory()
+
+    packer.assert_called_once_with(10 * 1024 * 1024)
+    fs_klass.assert_called_once_with(
+        "/tmp/foo/bar", packer=packer.return_value)
+
+
 def test_fsresolver_invoke_factory(tmpdir):
     fs_dir = pathlib.Path(tmpdir)
     db_path = fs_dir / FS_FILENAME
@@ -401,6 +471,202 @@ def test_client_resolver___call___check_dbkw():
     }
 
 
+@pytest.mark.parametrize("query, expected_kwargs", [
+    ("cache_verify=startup", {"wait": 1}),
+    ("cache_verify=background&wait=true", {"wait": 0}),
+    ("cache_verify=drop&wait=false", {"wait": 0}),
+])
+def test_client_resolver___call___w_cache_verify(query, expected_kwargs):
+    resolver = _client_resolver()
+
+    factory, dbkw = resolver(f"zeo://localhost?{query}")
+
+    with mock.patch("zodburi.resolvers.ClientStorage") as cs:
+        with mock.patch("zodburi.resolvers.open_dropped_cache") as odc:
+            factory()
+
+    if "drop" in query:
+        odc.assert_called_once_with(expected_kwargs)
+        expected_kwargs = dict(expected_kwargs, cache=odc.return_value)
+    else:
+        odc.assert_not_called()
+
+    cs.assert_called_once_with(("localhost", 9991), **expected_kwargs)
+
+
+def test_client_resolver___call___w_invalid_cache_verify():
+    from zodburi.zeo import InvalidCacheVerifyMode
+
+    resolver = _client_resolver()
+
+    with pytest.raises(InvalidCacheVerifyMode):
+        resolver("zeo://localhost?cache_verify=never")
+
+
+@pytest.mark.parametrize("query, expected_wait", [
+    ("cache_prewarm=/tmp/hot.oids", False),
+    ("cache_prewarm=/tmp/hot.oids&cache_verify=startup", True),
+])
+def test_client_resolver___call___w_cache_prewarm(query, expected_wait):
+    resolver = _client_resolver()
+
+    factory, dbkw = resolver(f"zeo://localhost?{query}")
+
+    with mock.patch("zodburi.resolvers.ClientStorage") as cs:
+        with mock.patch("zodburi.resolvers.warm_cache") as wc:
+            storage = factory()
+
+    assert storage is cs.return_value
+    wc.assert_called_once_with(
+        storage, "/tmp/hot.oids", wait=expected_wait,
+    )
+
+
+@pytest.mark.parametrize("query, backoff, verify_lock", [
+    ("reconnect_backoff=0.5", (0.5, 60.0, 0.5), None),
+    (
+        "reconnect_backoff=1&reconnect_backoff_max=30&reconnect_jitter=1",
+        (1.0, 30.0, 1.0),
+        None,
+    ),
+    ("verify_slots=4&verify_lock=/tmp/verify", None, "/tmp/verify"),
+    ("verify_slots=4", None, "default"),
+])
+def test_client_resolver___call___w_reconnect_policy(
+        query, backoff, verify_lock):
+    from zodburi.zeo import ClientThread
+    from zodburi.zeo import default_verify_lock
+
+    resolver = _client_resolver()
+
+    factory, dbkw = resolver(f"zeo://localhost?{query}")
+
+    with mock.patch("zodburi.resolvers.ClientStorage") as cs:
+        factory()
+        factory()
+
+    (first_args, first_kw), (_, second_kw) = cs.call_args_list
+    assert first_args == (("localhost", 9991),)
+    client_factory = first_kw.pop("_client_factory")
+    assert first_kw == {}
+    assert client_factory.func is ClientThread
+    if backoff is None:
+        assert client_factory.keywords["backoff"] is None
+    else:
+        first = client_factory.keywords["backoff"]
+        assert (first.initial, first.maximum, first.jitter) == backoff
+        # Each storage backs off on its own.
+        assert second_kw["_client_factory"].keywords["backoff"] is not first
+    slots = client_factory.keywords["slots"]
+    if verify_lock is None:
+        assert slots is None
+    else:
+        if verify_lock == "default":
+            verify_lock = default_verify_lock(("localhost", 9991))
+        assert (slots.path, slots.count) == (verify_lock, 4)
+
+
+@pytest.mark.parametrize("jitter", ["-0.1", "1.5"])
+def test_client_resolver___call___w_invalid_reconnect_jitter(jitter):
+    from zodburi.zeo import InvalidReconnectJitter
+
+    resolver = _client_resolver()
+
+    with pytest.raises(InvalidReconnectJitter):
+        resolver(
+            f"zeo://localhost?reconnect_backoff=1&reconnect_jitter={jitter}")
+
+
+@pytest.mark.parametrize("query, expected_dir", [
+    ("cache_size=host:1mb", "default"),
+    ("cache_size=host:1mb&cache_budget_dir=/tmp/budget", "/tmp/budget"),
+])
+def test_client_resolver___call___w_host_cache_size(query, expected_dir):
+    from zodburi.zeo import default_cache_budget_dir
+    from zodburi.zeo import DEFAULT_CACHE_BUDGET_INTERVAL
+
+    resolver = _client_resolver()
+
+    with mock.patch("zodburi.resolvers.HostCacheBudget") as hcb:
+        factory, dbkw = resolver(f"zeo://localhost?{query}")
+        with mock.patch("zodburi.resolvers.ClientStorage") as cs:
+            with mock.patch("zodburi.resolvers.share_cache_budget") as scb:
+                storage = factory()
+
+    if expected_dir == "default":
+        expected_dir = default_cache_budget_dir(("localhost", 9991))
+    hcb.assert_called_once_with(1 << 20, expected_dir)
+    budget = hcb.return_value
+    cs.assert_called_once_with(
+        ("localhost", 9991), cache_size=budget.share.return_value)
+    scb.assert_called_once_with(
+        storage, budget, budget.join.return_value,
+        DEFAULT_CACHE_BUDGET_INTERVAL)
+
+
+@pytest.mark.parametrize("uri, expected_socket", [
+    ("zeo://localhost:8100?unix_socket=auto", "default"),
+    ("zeo://127.0.0.1:8100?unix_socket=auto", "default"),
+    ("zeo://localhost:8100?unix_socket=/run/zeo/../zeo.sock", "/run/zeo.sock"),
+    ("zeo://zeo.example.com:8100?unix_socket=/run/zeo.sock", "/run/zeo.sock"),
+])
+def test_client_resolver___call___w_unix_socket(uri, expected_socket):
+    from zodburi.zeo import default_unix_socket
+
+    resolver = _client_resolver()
+    host = uri[6:uri.index(":", 6)]
+
+    factory, dbkw = resolver(uri)
+    with mock.patch("zodburi.resolvers.ClientStorage") as cs:
+        with mock.patch("zodburi.resolvers.prefer_unix_socket") as pus:
+            factory()
+
+    if expected_socket == "default":
+        expected_socket = default_unix_socket((host, 8100))
+    pus.assert_called_once_with((host, 8100), expected_socket)
+    cs.assert_called_once_with(
+        pus.return_value, name=str((host, 8100)), _client_factory=mock.ANY)
+    # Chosen again each time the client reconnects.
+    address = cs.call_args.kwargs["_client_factory"].keywords["address"]
+    address()
+    assert pus.call_count == 2
+    pus.assert_called_with((host, 8100), expected_socket)
+
+
+@pytest.mark.parametrize("uri", [
+    "zeo://zeo.example.com:8100?unix_socket=auto",
+    "zeo:///run/zeo.sock?unix_socket=auto",
+    "zeo://localhost:8100?unix_socket=",
+])
+def test_client_resolver___call___wo_unix_socket(uri):
+    resolver = _client_resolver()
+
+    factory, dbkw = resolver(uri)
+    with mock.patch("zodburi.resolvers.ClientStorage") as cs:
+        with mock.patch("zodburi.resolvers.prefer_unix_socket") as pus:
+            factory()
+
+    pus.assert_not_called()
+    assert cs.call_args.kwargs == {}
+    assert dbkw == {}
+
+
+def test_client_resolver___call___w_host_cache_size_leaves_on_failure():
+    resolver = _client_resolver()
+
+    with mock.patch("zodburi.resolvers.HostCacheBudget") as hcb:
+        factory, dbkw = resolver(
+            "zeo://localhost?cache_size=host:1mb&cache_budget_interval=5")
+        with mock.patch(
+            "zodburi.resolvers.ClientStorage", side_effect=ValueError,
+        ):
+            with pytest.raises(ValueError):
+                factory()
+
+    budget = hcb.return_value
+    budget.leave.assert_called_once_with(budget.join.return_value)
+
+
 def test_client_resolver_invoke_factory():
     resolver = _client_resolver()
 
@@ -603,6 +869,175 @@ database-name foo
 
 
 
+MULTIDATABASE_ZCONFIG = """\
+<zodb first>
+ <mappingstorage>
+ </mappingstorage>
+ cache-size 100
+</zodb>
+<zodb>
+ <mappingstorage>
+ </mappingstorage>
+ database-name second
+ cache-size 200
+</zodb>
+<zodb third>
+ %s
+ cache-size 300
+</zodb>
+<mappingstorage storage>
+</mappingstorage>
+"""
+
+
+def test_zconfig_resolver_w_all_databases(zconfig_path):
+    from ZODB.DB import DB
+
+    zconfig_path.write_text(
+        MULTIDATABASE_ZCONFIG % "<mappingstorage>\n</mappingstorage>"
+    )
+    resolver = _zconfig_resolver()
+
+    factory, dbkw = resolver(f"zconfig://{zconfig_path}#*")
+
+    databases = dbkw.pop("databases")
+    assert databases == {}
+    assert dbkw["database_name"] == "first"
+    assert dbkw["connection_cache_size"] == 100
+
+    storage = factory()
+    assert isinstance(storage, MappingStorage)
+    assert sorted(databases) == ["second", "third"]
+
+    db = DB(storage, databases=databases, cache_size=100,
+            database_name="first")
+    try:
+        assert sorted(db.databases) == ["first", "second", "third"]
+        assert databases["second"].getCacheSize() == 200
+        assert databases["third"].getCacheSize() == 300
+
+        with db.transaction() as conn:
+            assert conn.get_connection("third").root() == {}
+    finally:
+        for database in databases.values():
+            database.close()
+
+
+def test_zconfig_resolver_w_all_databases_factory_called_twice(zconfig_path):
+    from ZODB.DB import DB
+
+    zconfig_path.write_text(
+        MULTIDATABASE_ZCONFIG % "<mappingstorage>\n</mappingstorage>"
+    )
+    resolver = _zconfig_resolver()
+    factory, dbkw = resolver(f"zconfig://{zconfig_path}#*")
+    databases = dbkw["databases"]
+
+    # Reopening once all databases are closed replaces them.
+    db = DB(factory(), **{"databases": databases, "database_name": "first"})
+    second = databases["second"]
+    for database in list(databases.values()):
+        database.close()
+
+    db = DB(factory(), **{"databases": databases, "database_name": "first"})
+    try:
+        assert sorted(databases) == ["first", "second", "third"]
+        assert databases["second"] is not second
+
+        # Databases still open, e.g. when a proxy reopens the storage of
+        # the first, are kept.
+        third = databases["third"]
+        with contextlib.closing(factory()) as storage:
+            assert isinstance(storage, MappingStorage)
+        assert databases["third"] is third
+        assert databases["first"] is db
+    finally:
+        for database in databases.values():
+            database.close()
+
+
+def test_zconfig_resolver_w_all_databases_w_failure(zconfig_path, tmpdir):
+    zconfig_path.write_text(
+        MULTIDATABASE_ZCONFIG
+        % (
+            f"<filestorage>\npath {tmpdir}/Data.fs\nread-only true\n"
+            f"</filestorage>"
+        )
+    )
+    resolver = _zconfig_resolver()
+    factory, dbkw = resolver(f"zconfig://{zconfig_path}#*")
+
+    with mock.patch("ZODB.DB.DB.close") as db_close:
+        with pytest.raises(FileNotFoundError):
+            factory()
+
+    db_close.assert_called_once_with()
+    assert dbkw["databases"] == {}
+
+
+def test_zconfig_resolver_w_all_databases_wo_databases(zconfig_path):
+    zconfig_path.write_text(
+        """\
+<mappingstorage>
+</mappingstorage>
+"""
+    )
+    resolver = _zconfig_resolver()
+
+    with pytest.raises(KeyError):
+        resolver(f"zconfig://{zconfig_path}#*")
+
+
+def test_resolve_uri_w_zconfig_all_databases(zconfig_path):
+    from ZODB.DB import DB
+    from zodburi import resolve_uri
+
+    zconfig_path.write_text(
+        MULTIDATABASE_ZCONFIG % "<mappingstorage>\n</mappingstorage>"
+    )
+
+    factory, dbkw = resolve_uri(f"zconfig://{zconfig_path}#*")
+    db = DB(factory(), **dbkw)
+
+    try:
+        assert sorted(db.databases) == ["first", "second", "third"]
+        assert db.getCacheSize() == 100
+    finally:
+        for database in db.databases.values():
+            database.close()
+
+
+@pytest.mark.parametrize("fragment", ["", "#*"])
+def test_resolve_uri_w_zconfig_database_w_query(zconfig_path, fragment):
+    from zodburi import resolve_uri
+    from zodburi.proxy import StorageProxy
+
+    zconfig_path.write_text(
+        MULTIDATABASE_ZCONFIG % "<mappingstorage>\n</mappingstorage>"
+    )
+
+    factory, dbkw = resolve_uri(
+        f"zconfig://{zconfig_path}?fork_safe=1&lazy=1"
+        f"&connection_cache_size=10{fragment}")
+
+    assert dbkw["cache_size"] == 10
+    with contextlib.closing(factory()) as storage:
+        assert isinstance(storage, StorageProxy)
+        assert storage.state() == "unopened"
+
+
+def test_resolve_uri_w_zconfig_database_w_unknown_query(zconfig_path):
+    from zodburi import resolve_uri
+    from zodburi import UnknownDatabaseKeywords
+
+    zconfig_path.write_text(
+        MULTIDATABASE_ZCONFIG % "<mappingstorage>\n</mappingstorage>"
+    )
+
+    with pytest.raises(UnknownDatabaseKeywords):
+        resolve_uri(f"zconfig://{zconfig_path}?bogus=1#first")
+
+
 def test_resolve_uri_w_zconfig(zconfig_path):
     from zodburi import resolve_uri
 
@@ -745,6 +1180,151 @@ def test_demo_resolver_invoke_factory_w_qs_parms(tmpdir):
         assert demo.changes.__name__ == '222'
 
 
+@pytest.mark.parametrize("uri, expected", [
+    ("memory://", "memory://"),
+    (
+        "memory://foo?spill_size=1kb&database_name=x&lazy=yes",
+        "memory://foo?database_name=x&lazy=1&spill_size=1024",
+    ),
+    (
+        "memory://foo?from=file:///a/../Data.fs%3Fread_only%3Dtrue",
+        "memory://foo?from=file:///Data.fs%3Fread_only%3D1",
+    ),
+    (
+        "file:///a/../Data.fs?create=1&read_only=0",
+        "file:///Data.fs?create=1&read_only=0",
+    ),
+    (
+        "file:///Data.fs?read_only=false&create=true",
+        "file:///Data.fs?create=1&read_only=0",
+    ),
+    (
+        "file:///Data.fs?blobstorage_dir=/tmp/blobs&quota=1mb",
+        "file:///Data.fs?blobstorage_dir=/tmp/blobs&quota=1048576",
+    ),
+    ("zeo://LocalHost", "zeo://localhost:9991"),
+    ("zeo://localhost:9991?wait=no", "zeo://localhost:9991?wait=0"),
+    ("zeo://:1234", "zeo://:1234"),
+    ("zeo://[::1]", "zeo://[::1]:9991"),
+    ("zeo:///var/../sock?cache_size=1kb", "zeo:///sock?cache_size=1024"),
+    ("zeo:///sock?cache_size=HOST:1gb", "zeo:///sock?cache_size=host:1073741824"),
+    (
+        "zconfig:///etc/../z.conf?b=1&connection_pool_size=01#*",
+        "zconfig:///z.conf?b=1&connection_pool_size=1#*",
+    ),
+    ("zconfig:///etc/z.conf", "zconfig:///etc/z.conf"),
+    (
+        "demo:(memory://a)/(file:///x/./y.fs?quota=1kb)"
+        "#connection_pool_size=07",
+        "demo:(memory://a)/(file:///x/y.fs?quota=1024)"
+        "#connection_pool_size=7",
+    ),
+    ("demo:(memory://a)/(memory://b)", "demo:(memory://a)/(memory://b)"),
+    (
+        "trace:(file:///x/./y.fs?quota=1kb)?out=/tmp/t.bin&flush_interval=2",
+        "trace:(file:///x/y.fs?quota=1024)?flush_interval=2.0&out=/tmp/t.bin",
+    ),
+    (
+        "prefetch:(trace:(memory://)?out=/tmp/t.bin)?workers=08&depth=2",
+        "prefetch:(trace:(memory://)?out=/tmp/t.bin)?depth=2&workers=8",
+    ),
+    (
+        "zeo://localhost:9001?var=/var/{hostname}&client=app-{worker_id}",
+        "zeo://localhost:9001?client=app-{worker_id}&var=/var/{hostname}",
+    ),
+])
+def test_canonicalize(uri, expected):
+    from zodburi import canonicalize
+
+    canonical = canonicalize(uri)
+
+    assert canonical == expected
+    assert canonicalize(canonical) == canonical
+
+
+def test_canonicalize_w_tuple_and_float_args():
+    resolver = _fs_resolver()
+    resolver._tuple_args = ("foo",)
+    resolver._float_args = ("pi",)
+
+    canonical = resolver.canonicalize("file:///Data.fs?pi=3.140&foo=a,b")
+
+    assert canonical == "file:///Data.fs?foo=a,b&pi=3.14"
+
+
+@pytest.mark.parametrize("uri", [
+    "trace:memory://",
+    "trace:(memory://)",
+    "trace:(memory://)?out=",
+])
+def test_trace_resolver_w_invalid_uri(uri):
+    from zodburi.resolvers import InvalidTraceURI
+
+    resolver = _trace_resolver()
+
+    with pytest.raises(InvalidTraceURI):
+        resolver(uri)
+
+
+def test_trace_resolver_invoke_factory(tmpdir):
+    from zodburi.trace import TracingStorage
+
+    resolver = _trace_resolver()
+
+    factory, dbkw = resolver(
+        f"trace:(memory://name?database_name=x)"
+        f"?out={tmpdir}/trace.bin&flush_interval=5&connection_pool_size=2")
+
+    assert dbkw == {"database_name": "x", "connection_pool_size": "2"}
+    with contextlib.closing(factory()) as storage:
+        assert isinstance(storage, TracingStorage)
+        assert storage.getName() == "name"
+        assert storage._writer.path == f"{tmpdir}/trace.bin"
+        assert storage._writer.flush_interval == 5.0
+
+
+@pytest.mark.parametrize("uri", [
+    "prefetch:memory://",
+    "prefetch:(memory://)?depth=-1",
+    "prefetch:(memory://)?workers=0",
+    "prefetch:(memory://)?buffer_size=0",
+])
+def test_prefetch_resolver_w_invalid_uri(uri):
+    from zodburi.resolvers import InvalidPrefetchURI
+
+    resolver = _prefetch_resolver()
+
+    with pytest.raises(InvalidPrefetchURI):
+        resolver(uri)
+
+
+def test_prefetch_resolver_invoke_factory():
+    from zodburi.prefetch import PrefetchingStorage
+
+    resolver = _prefetch_resolver()
+
+    factory, dbkw = resolver(
+        "prefetch:(memory://name?database_name=x)"
+        "?depth=2&workers=3&buffer_size=10&connection_pool_size=2")
+
+    assert dbkw == {"database_name": "x", "connection_pool_size": "2"}
+    with contextlib.closing(factory()) as storage:
+        assert isinstance(storage, PrefetchingStorage)
+        assert storage.getName() == "name"
+        assert storage.depth == 2
+        assert storage.buffer_size == 10
+        assert storage._executor._max_workers == 3
+
+
+def test_demo_resolver_canonicalize_w_invalid_uri():
+    from zodburi.resolvers import InvalidDemoStorgeURI
+
+    resolver = _demo_resolver()
+
+    with pytest.raises(InvalidDemoStorgeURI):
+        resolver.canonicalize("demo:bogus")
+
+
 def test_entry_points():
     from zodburi import resolvers
 
@@ -757,6 +1337,8 @@ def test_entry_points():
         ('file', resolvers.FileStorageURIResolver),
         ('zconfig', resolvers.ZConfigURIResolver),
         ('demo', resolvers.DemoStorageURIResolver),
+        ('trace', resolvers.TraceURIResolver),
+        ('prefetch', resolvers.PrefetchURIResolver),
     ]
     for name, cls in expected:
         target = our_eps[name].load()
@@ -0,0 +1,319 @@
+import collections
+import json
+import random
+import struct
+
+import pytest
+from ZODB.utils import p64
+from ZODB.utils import z64
+
+
+def _accesses(n=5000, objects=300, seed=42):
+    # Skewed accesses to objects of varied sizes.
+    rng = random.Random(seed)
+    sizes = {oid: rng.randint(1, 2000) for oid in range(objects)}
+    for _ in range(n):
+        oid = int(rng.paretovariate(0.8)) % objects
+        yield p64(oid), sizes[oid]
+
+
+def _lru_hits(accesses, count=None, size=None):
+    # A straightforward LRU cache.
+    cache = collections.OrderedDict()
+    hits = 0
+    for oid, record_size in accesses:
+        if oid in cache:
+            hits += 1
+            cache.move_to_end(oid)
+            continue
+        cache[oid] = record_size
+        while (count is not None and len(cache) > count) or (
+                size is not None and sum(cache.values()) > size):
+            cache.popitem(last=False)
+    return hits
+
+
+def test_lru_simulation_matches_lru_caches():
+    from zodburi.simulate import LRUSimulation
+
+    counts = [1, 10, 50, 100, 1000]
+    sizes = [1000, 10_000, 100_000, 1 << 20]
+    accesses = list(_accesses())
+    simulation = LRUSimulation(counts, sizes)
+    for oid, size in accesses:
+        simulation.load(oid, size)
+
+    assert simulation.loads == len(accesses)
+    assert simulation.count_hit_rates() == [
+        _lru_hits(accesses, count=count) / len(accesses) for count in counts]
+    assert simulation.size_hit_rates() == [
+        _lru_hits(accesses, size=size) / len(accesses) for size in sizes]
+
+
+def test_lru_simulation_w_stores_and_invalidations():
+    from zodburi.simulate import LRUSimulation
+
+    simulation = LRUSimulation([1, 2], [100, 1000])
+    simulation.load(p64(1), 0)  # unknown size:  not cached
+    simulation.store(p64(1), None, 500)
+    simulation.load(p64(1), 0)
+    simulation.store(p64(2), None, 10)
+    simulation.store(p64(2), None, 20)
+    simulation.load(p64(1), 500)
+    simulation.invalidate(p64(1))
+    simulation.invalidate(p64(3))
+    simulation.load(p64(1), 500)
+
+    assert simulation.loads == 4
+    # Hits:  the second load, at distance 1 (500 bytes), and the third, at
+    # distance 2 (520 bytes).
+    assert simulation.count_hit_rates() == [0.25, 0.5]
+    assert simulation.size_hit_rates() == [0.0, 0.5]
+
+
+def test_zeo_cache_simulation_matches_zeo_cache(tmpdir):
+    from ZEO.cache import ClientCache
+
+    from zodburi.simulate import ZEOCacheSimulation
+
+    size = 100_000
+    cache = ClientCache(None, size)
+    simulation = ZEOCacheSimulation(size)
+    hits = 0
+    for oid, record_size in _accesses():
+        if cache.load(oid) is None:
+            cache.store(oid, p64(1), None, b"x" * record_size)
+        else:
+            hits += 1
+        simulation.load(oid, record_size)
+    cache.close()
+
+    assert simulation.loads == 5000
+    assert 0 < simulation.hits == hits
+    assert simulation.hit_rate == hits / 5000
+
+
+def test_zeo_cache_simulation_w_stores_and_invalidations():
+    from zodburi.simulate import ZEOCacheSimulation
+
+    simulation = ZEOCacheSimulation(1000)
+    simulation.load(p64(1), 0)
+    simulation.store(p64(1), p64(1), 10)
+    simulation.store(p64(1), p64(1), 10)  # already cached
+    simulation.load(p64(1), 0)
+    simulation.store(p64(1), p64(2), 20)
+    simulation.load(p64(1), 20)
+    simulation.invalidate(p64(1))
+    simulation.invalidate(p64(2))
+    simulation.load(p64(1), 0)
+    # Too large to be cached.
+    simulation.load(p64(2), 1000)
+    simulation.load(p64(2), 1000)
+
+    assert (simulation.loads, simulation.hits) == (6, 2)
+    assert ZEOCacheSimulation(1000).hit_rate == 0.0
+
+
+def _write_trace(path, records):
+    from zodburi.trace import TraceWriter
+
+    writer = TraceWriter(path)
+    for record in records:
+        writer.record(*record)
+    writer.close()
+
+
+def _write_zeo_trace(path, records):
+    with open(path, "wb") as f:
+        for code, oid, tid, size in records:
+            f.write(struct.pack(
+                ">iiH8s8s", 1, (size << 8) + code, len(oid), tid, z64) + oid)
+
+
+def test_read_events_w_trace(tmpdir):
+    from zodburi.simulate import read_events
+    from zodburi.trace import LOAD
+    from zodburi.trace import LOAD_BEFORE
+    from zodburi.trace import STORE
+
+    path = f"{tmpdir}/trace.bin"
+    _write_trace(path, [
+        (LOAD, p64(1), p64(5), 10, 0),
+        (LOAD_BEFORE, p64(2), z64, 0, 0),  # no such revision
+        (LOAD_BEFORE, p64(2), p64(6), 20, 0),
+        (STORE, p64(2), p64(6), 30, 0),
+    ])
+
+    assert list(read_events(path)) == [
+        ("load", p64(1), p64(5), 10),
+        ("load", p64(2), p64(6), 20),
+        ("store", p64(2), None, 30),
+    ]
+
+
+def test_read_events_w_zeo_trace(tmpdir):
+    from zodburi.simulate import read_events
+
+    path = f"{tmpdir}/cache.trace"
+    _write_zeo_trace(path, [
+        (0x00, b"", z64, 0),
+        (0x20, p64(1), z64, 0),
+        (0x52, p64(1), p64(5), 10),
+        (0x22, p64(1), p64(5), 10),
+        (0x54, p64(1), p64(4), 10),
+        (0x1c, p64(1), p64(6), 0),
+    ])
+    with open(path, "ab") as f:
+        # A misaligned record, then a truncated one.
+        f.write(b"\0" * 8)
+        f.write(struct.pack(
+            ">iiH8s8s", 1, (10 << 8) + 0x22, 8, p64(1), z64) + p64(1))
+        f.write(struct.pack(">iiH8s8s", 1, 0x22, 8, z64, z64) + b"\0")
+
+    assert list(read_events(path)) == [
+        ("load", p64(1), z64, 0),
+        ("store", p64(1), p64(5), 10),
+        ("load", p64(1), p64(5), 10),
+        ("invalidate", p64(1), p64(6), 0),
+        ("load", p64(1), p64(1), 10),
+    ]
+
+
+def test_read_events_w_real_zeo_trace(tmpdir, monkeypatch):
+    from ZEO.cache import ClientCache
+
+    from zodburi.simulate import read_events
+
+    monkeypatch.setenv("ZEO_CACHE_TRACE", "1")
+    cache = ClientCache(f"{tmpdir}/cache", 100_000)
+    assert cache.load(p64(1)) is None
+    cache.store(p64(1), p64(5), None, b"x" * 10)
+    assert cache.load(p64(1)) == (b"x" * 10, p64(5))
+    cache.close()
+
+    assert list(read_events(f"{tmpdir}/cache.trace")) == [
+        ("load", p64(1), z64, 0),
+        ("store", p64(1), p64(5), 10),
+        ("load", p64(1), p64(5), 10),
+    ]
+
+
+def test_read_events_w_invalid_trace(tmpdir):
+    from zodburi.simulate import InvalidTrace
+    from zodburi.simulate import read_events
+
+    path = f"{tmpdir}/cache.trace"
+    _write_zeo_trace(path, [(0x3e, p64(1), z64, 0)])
+
+    with pytest.raises(InvalidTrace, match="unknown event code 0x3e"):
+        list(read_events(path))
+
+
+@pytest.fixture
+def trace_path(tmpdir):
+    from zodburi.trace import LOAD
+
+    path = f"{tmpdir}/trace.bin"
+    _write_trace(path, [
+        (LOAD, oid, p64(1), size, 0) for oid, size in _accesses()])
+    return path
+
+
+def test_simulate(trace_path):
+    from zodburi.simulate import simulate
+
+    results = simulate(
+        trace_path, counts=[100, 10, 1000], sizes=[10_000, 1 << 20])
+
+    assert results.loads == 5000
+    assert 0 < results.objects <= 300
+    assert [count for count, _ in results.lru_counts] == [10, 100, 1000]
+    rates = [rate for _, rate in results.lru_counts]
+    assert rates == sorted(rates)
+    assert rates[-1] == (5000 - results.objects) / 5000
+    assert [size for size, _ in results.zeo_sizes] == [10_000, 1 << 20]
+    assert results.recommendations(tolerance=1) == {
+        "connection_cache_size": 10,
+        "connection_cache_size_bytes": 10_000,
+        "cache_size": 10_000,
+    }
+    assert results.recommendations(tolerance=0) == {
+        "connection_cache_size": 1000,
+        "connection_cache_size_bytes": 1 << 20,
+        "cache_size": 1 << 20,
+    }
+
+
+def test_simulate_wo_zeo_or_loads(tmpdir):
+    from zodburi.simulate import simulate
+
+    path = f"{tmpdir}/trace.bin"
+    _write_trace(path, [])
+
+    results = simulate(path, zeo=False)
+
+    assert results.zeo_sizes == []
+    assert results.loads == 0
+    assert results.recommendations() == {}
+
+
+def test_simulate_w_stores_and_invalidations(tmpdir):
+    from zodburi.simulate import format_results
+    from zodburi.simulate import simulate
+
+    path = f"{tmpdir}/cache.trace"
+    _write_zeo_trace(path, [
+        (0x20, p64(1), z64, 0),  # miss
+        (0x52, p64(1), p64(5), 10),  # store
+        (0x22, p64(1), p64(5), 10),  # hit
+        (0x1c, p64(1), p64(6), 0),  # invalidate
+        (0x20, p64(1), z64, 0),  # miss
+    ])
+
+    results = simulate(path, counts=[10], sizes=[1000])
+
+    assert results.loads == 3
+    assert results.objects == 1
+    assert results.lru_counts == [(10, 1 / 3)]
+    assert results.lru_sizes == [(1000, 1 / 3)]
+    assert results.zeo_sizes == [(1000, 1 / 3)]
+
+    report = format_results(
+        simulate(path, counts=[10], sizes=[1000], zeo=False))
+    assert "ZEO client cache" not in report
+    assert "  cache_size=" not in report
+
+
+def test_format_results(trace_path):
+    from zodburi.simulate import format_results
+    from zodburi.simulate import simulate
+
+    report = format_results(simulate(trace_path, counts=[10], sizes=[1 << 20]))
+
+    assert "Loads: 5000" in report
+    assert "ZEO client cache (cache_size)" in report
+    assert "1.0MB" in report
+    assert "cache_size=1048576" in report
+
+
+def test_main_simulate(trace_path, capsys):
+    from zodburi.__main__ import main
+
+    assert main(["simulate", "--counts", "10,100", "--sizes", "10kb,1mb",
+                 trace_path]) == 0
+
+    assert "connection_cache_size=" in capsys.readouterr().out
+
+
+def test_main_simulate_json(trace_path, capsys):
+    from zodburi.__main__ import main
+
+    assert main(["simulate", "--no-zeo", "--json", "--sizes", "1mb",
+                 trace_path]) == 0
+
+    result = json.loads(capsys.readouterr().out)
+    assert result["loads"] == 5000
+    assert result["zeo_sizes"] == []
+    assert result["lru_sizes"][0][0] == 1 << 20
+    assert set(result["recommendations"]) == {
+        "connection_cache_size", "connection_cache_size_bytes"}
@@ -0,0 +1,143 @@
+import os
+from unittest import mock
+
+import pytest
+import transaction
+from ZODB.DB import DB
+from ZODB.DemoStorage import DemoStorage
+from ZODB.FileStorage import FileStorage
+from ZODB.MappingStorage import MappingStorage
+
+
+def _make_spill(name="changes", spill_size=1024):
+    from zodburi.spill import SpillStorage
+    return SpillStorage(name, spill_size)
+
+
+def _commit(db, **kw):
+    with db.transaction() as conn:
+        conn.root().update(kw)
+
+
+def test_spillstorage_stays_in_memory_below_spill_size():
+    storage = _make_spill()
+    db = DB(storage)
+
+    _commit(db, small="x" * 10)
+
+    assert isinstance(storage._storage, MappingStorage)
+    stats = storage.stats()
+    assert 0 < stats["size"] <= 1024
+    assert stats == {
+        "size": stats["size"],
+        "spill_size": 1024,
+        "spilled": False,
+        "path": None,
+    }
+    db.close()
+
+
+def test_spillstorage_spills_to_filestorage():
+    storage = _make_spill()
+    db = DB(storage)
+    _commit(db, small="x" * 10)
+
+    _commit(db, big="y" * 2048)
+
+    assert isinstance(storage._storage, FileStorage)
+    stats = storage.stats()
+    assert stats["spilled"]
+    assert stats["size"] > 2048
+    path = stats["path"]
+    assert os.path.exists(path)
+
+    _commit(db, more="z")
+
+    conn = db.open()
+    transaction.begin()
+    assert conn.root()["small"] == "x" * 10
+    assert conn.root()["big"] == "y" * 2048
+    assert conn.root()["more"] == "z"
+    conn.close()
+    db.close()
+
+    assert not os.path.exists(os.path.dirname(path))
+
+
+@pytest.mark.parametrize("name, logged", [
+    ("changes", "changes"),
+    ("", "memory storage"),
+], ids=["named", "unnamed"])
+def test_spillstorage_logs_spill(name, logged):
+    storage = _make_spill(name)
+    db = DB(storage)
+
+    with mock.patch("zodburi.spill.logger") as logger:
+        _commit(db, big="y" * 2048)
+
+    logger.warning.assert_called_once_with(
+        "%s: spilled %d bytes of changes to %s",
+        logged, storage.stats()["size"], storage.stats()["path"],
+    )
+    db.close()
+
+
+def test_spillstorage_tpc_abort_discards_pending_size():
+    storage = _make_spill()
+    db = DB(storage)
+    size = storage.stats()["size"]
+
+    conn = db.open()
+    conn.root()["big"] = "y" * 2048
+    transaction.abort()
+    conn.close()
+
+    assert storage.stats()["size"] == size
+    assert not storage._commit_lock.locked()
+    storage.tpc_abort(transaction.get())  # not begun: no-op
+    db.close()
+
+
+def test_spillstorage_tpc_abort_after_tpc_begin():
+    from ZODB.utils import p64
+    from ZODB.utils import z64
+
+    storage = _make_spill()
+    size = storage.stats()["size"]
+    txn = transaction.Transaction()
+
+    storage.tpc_begin(txn)
+    storage.store(p64(1), z64, b"x" * 2048, "", txn)
+    storage.tpc_abort(txn)
+
+    assert storage.stats()["size"] == size
+    assert storage._transaction is None
+    assert not storage._commit_lock.locked()
+    storage.close()
+
+
+def test_spillstorage_tpc_begin_failure_releases_commit_lock():
+    storage = _make_spill()
+    storage.close()
+
+    with pytest.raises(Exception):
+        storage.tpc_begin(transaction.get())
+
+    assert not storage._commit_lock.locked()
+
+
+def test_spillstorage_as_demostorage_changes(tmpdir):
+    from zodburi import resolve_uri
+
+    base = os.path.join(tmpdir, "base.fs")
+    factory, dbkw = resolve_uri(
+        f"demo:(file://{base})/(memory://changes?spill_size=1kb)"
+    )
+    db = DB(factory(), **dbkw)
+    demo = db.storage
+    assert isinstance(demo, DemoStorage)
+
+    _commit(db, big="y" * 2048)
+
+    assert demo.changes.stats()["spilled"]
+    db.close()
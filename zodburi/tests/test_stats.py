@@ -0,0 +1,318 @@
+import json
+from unittest import mock
+
+import pytest
+from BTrees.OOBTree import OOBTree
+from persistent.mapping import PersistentMapping
+from ZODB.blob import Blob
+from ZODB.DB import DB
+from ZODB.utils import p64
+
+
+def _make_blob(data):
+    blob = Blob()
+    with blob.open("w") as f:
+        f.write(data)
+    return blob
+
+
+def _fill(db):
+    with db.transaction() as conn:
+        conn.root()["tree"] = OOBTree()
+        conn.root()["small"] = PersistentMapping(x=1)
+    with db.transaction() as conn:
+        conn.root()["large"] = PersistentMapping(data=b"x" * 5000)
+        conn.root()["tree"]["key"] = "value"
+    with db.transaction() as conn:
+        conn.root()["blob"] = _make_blob(b"blob data")
+        del conn.root()["small"]
+
+
+@pytest.fixture
+def file_uri(tmpdir):
+    from zodburi import resolve_uri
+
+    uri = f"file://{tmpdir}/Data.fs?blobstorage_dir={tmpdir}/blobs"
+    factory, dbkw = resolve_uri(uri)
+    db = DB(factory(), **dbkw)
+    _fill(db)
+    db.close()
+    return uri
+
+
+def _check(stats):
+    assert stats.transactions == 4
+    assert set(stats.classes) == {
+        "persistent.mapping.PersistentMapping",
+        "BTrees.OOBTree.OOBTree",
+        "ZODB.blob.Blob",
+    }
+    # The root, 'large' and 'small', which stays until the storage is
+    # packed although no longer referenced.
+    assert stats.classes["persistent.mapping.PersistentMapping"].count == 3
+    assert stats.classes["persistent.mapping.PersistentMapping"].max > 5000
+    assert stats.classes["BTrees.OOBTree.OOBTree"].count == 1
+    assert stats.blobs == 1
+    assert stats.blob_bytes == len(b"blob data")
+    assert stats.total.count == 5
+
+
+@pytest.mark.parametrize("workers", [1, 2, 3])
+def test_analyze_file(file_uri, workers):
+    from zodburi.stats import analyze
+
+    stats = analyze(file_uri, workers=workers)
+
+    _check(stats)
+    assert stats.name.endswith("Data.fs")
+
+
+def test_analyze_w_default_workers(file_uri):
+    from zodburi.stats import analyze
+
+    with mock.patch("os.cpu_count", return_value=None):
+        _check(analyze(file_uri))
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_analyze_file_in_use(file_uri, workers):
+    from ZODB.FileStorage import FileStorage
+
+    from zodburi.stats import analyze
+
+    # A live FileStorage holds the lock of the file.
+    storage = FileStorage(file_uri[len("file://"):].split("?")[0])
+    try:
+        stats = analyze(file_uri, workers=workers)
+    finally:
+        storage.close()
+
+    _check(stats)
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_analyze_file_w_create(file_uri, workers):
+    from zodburi.stats import analyze
+
+    _check(analyze(f"{file_uri}&create=1", workers=workers))
+    # The file was not truncated.
+    _check(analyze(file_uri, workers=workers))
+
+
+def test_analyze_empty_file(tmpdir):
+    from ZODB.FileStorage import FileStorage
+
+    from zodburi.stats import analyze
+
+    FileStorage(f"{tmpdir}/Data.fs").close()
+
+    stats = analyze(f"file://{tmpdir}/Data.fs", workers=2)
+
+    assert stats.transactions == 0
+    assert stats.total.count == 0
+
+
+def test_analyze_memory():
+    from zodburi import resolve_uri
+    from zodburi.memory import dispose_shared
+    from zodburi.stats import analyze
+
+    factory, _ = resolve_uri("memory://stats?shared=true")
+    storage = factory()
+    db = DB(storage)
+    with db.transaction() as conn:
+        conn.root()["tree"] = OOBTree()
+
+    stats = analyze("memory://stats?shared=true", workers=4)
+
+    assert stats.transactions == 2
+    assert stats.classes["BTrees.OOBTree.OOBTree"].count == 1
+    db.close()
+    dispose_shared("stats")
+
+
+def test_scan_storage_w_missing_blob_file(file_uri):
+    from ZODB.POSException import POSKeyError
+
+    from zodburi.stats import analyze
+
+    with mock.patch(
+        "ZODB.blob.BlobStorage.loadBlob", side_effect=POSKeyError("gone"),
+    ):
+        stats = analyze(file_uri, workers=1)
+
+    assert stats.blobs == 1
+    assert stats.blob_bytes == 0
+
+
+def test_scan_storage_w_undone_creation():
+    from zodburi.stats import scan_storage
+
+    created = mock.Mock(oid=p64(1), tid=p64(2), data=b"data")
+    undone = mock.Mock(oid=p64(1), tid=p64(3), data=None)
+    storage = mock.Mock(spec=["iterator"])
+    storage.iterator.return_value = [[created], [undone]]
+
+    with mock.patch(
+        "zodburi.stats.get_pickle_metadata", return_value=("mod", "Class"),
+    ):
+        assert scan_storage(storage) == (2, {p64(1): (p64(3), None, 0, None)})
+
+
+def test_analyze_skips_deleted_objects():
+    from zodburi.stats import analyze
+
+    records = {
+        p64(1): (p64(2), "mod.Class", 10, None),
+        p64(2): (p64(2), None, 0, None),
+    }
+    with mock.patch(
+        "zodburi.stats.scan_storage", return_value=(1, records),
+    ):
+        stats = analyze("memory://", workers=1)
+
+    assert stats.transactions == 1
+    assert set(stats.classes) == {"mod.Class"}
+    assert stats.total.count == 1
+
+
+def test_scan_uri(file_uri):
+    from zodburi.stats import _read_only_uri
+    from zodburi.stats import _scan_uri
+
+    transactions, records = _scan_uri(_read_only_uri(file_uri))
+
+    assert transactions == 4
+    assert len(records) == 5
+
+
+def test_scan_uri_w_range_closes_storage():
+    from zodburi.stats import _scan_uri
+
+    with mock.patch("zodburi.stats._open_storage") as open_storage:
+        storage = open_storage.return_value
+        storage.iterator.return_value = []
+        assert _scan_uri("file:///Data.fs", p64(1), p64(2)) == (0, {})
+
+    open_storage.assert_called_once_with("file:///Data.fs")
+    storage.iterator.assert_called_once_with(p64(1), p64(2))
+    storage.close.assert_called_once_with()
+
+
+@pytest.mark.parametrize("first, last, count, expected", [
+    (0, 9, 2, [(0, 4), (5, 9)]),
+    (0, 9, 3, [(0, 2), (3, 5), (6, 9)]),
+    (5, 6, 4, [(5, 5), (6, 6)]),
+    (7, 7, 4, [(7, 7)]),
+])
+def test_ranges(first, last, count, expected):
+    from zodburi.stats import _ranges
+
+    assert _ranges(p64(first), p64(last), count) == [
+        (p64(start), p64(stop)) for start, stop in expected]
+
+
+def test_read_only_uri():
+    from zodburi.stats import _read_only_uri
+
+    assert _read_only_uri("file:///tmp/Data.fs?quota=1mb") == (
+        "file:///tmp/Data.fs?quota=1mb&read_only=true")
+    assert _read_only_uri("file:///tmp/Data.fs?create=1&read_only=0") == (
+        "file:///tmp/Data.fs?read_only=true")
+    assert _read_only_uri("zeo://localhost:9001?storage=main") == (
+        "zeo://localhost:9001?storage=main&read_only=true")
+    assert _read_only_uri("memory://stats?shared=true") == (
+        "memory://stats?shared=true")
+
+
+def test_classstats_histogram_and_percentile():
+    from zodburi.stats import ClassStats
+
+    class_stats = ClassStats()
+    for size in [0, 1, 2, 3, 4, 1000, 1024, 1025]:
+        class_stats.add(size)
+
+    assert class_stats.histogram == {0: 2, 1: 1, 2: 2, 10: 2, 11: 1}
+    assert class_stats.percentile(0.5) == 4
+    assert class_stats.percentile(1) == 2048
+    assert ClassStats().percentile(0.5) == 0
+    assert ClassStats().mean == 0
+    assert class_stats.as_dict()["histogram"] == {
+        "1": 2, "2": 1, "4": 2, "1024": 2, "2048": 1}
+
+
+def test_recommendations():
+    from zodburi.stats import MIN_LARGE_RECORD_SIZE
+    from zodburi.stats import OBJECT_OVERHEAD
+    from zodburi.stats import StorageStats
+
+    stats = StorageStats()
+    for _ in range(1000):
+        stats.classes["a.A"].add(1000)
+    stats.classes["a.B"].add(10 << 20)
+
+    # Everything fits.
+    assert stats.recommendations(1 << 30)["connection_cache_size"] == 1001
+
+    recommended = stats.recommendations(1 << 20)
+    object_size = stats.total.mean * OBJECT_OVERHEAD
+    assert recommended["connection_cache_size"] == int((1 << 20) / object_size)
+    assert recommended["connection_cache_size_bytes"] <= 1 << 20
+    assert recommended["connection_large_record_size"] == MIN_LARGE_RECORD_SIZE
+
+    for _ in range(10):
+        stats.classes["a.B"].add(10 << 20)
+    assert stats.recommendations()["connection_large_record_size"] == 16 << 20
+
+    assert StorageStats().recommendations()["connection_cache_size"] == 1
+
+
+def test_format_stats(file_uri):
+    from zodburi.stats import analyze
+    from zodburi.stats import format_stats
+
+    report = format_stats(analyze(file_uri, workers=1), top=1)
+
+    assert "Transactions: 4" in report
+    assert "Objects: 5" in report
+    assert "Blobs: 1 (9B)" in report
+    assert "persistent.mapping.PersistentMapping" in report
+    assert "... and 2 more classes" in report
+    assert "connection_cache_size=5" in report
+
+
+@pytest.mark.parametrize("size, expected", [
+    (0, "0B"),
+    (1023, "1023B"),
+    (1536, "1.5KB"),
+    (3 << 20, "3.0MB"),
+    (5 << 40, "5120.0GB"),
+])
+def test_format_size(size, expected):
+    from zodburi.stats import _format_size
+
+    assert _format_size(size) == expected
+
+
+def test_main_stats(file_uri, capsys):
+    from zodburi.__main__ import main
+
+    assert main(["stats", "--workers", "2", file_uri]) == 0
+
+    assert "Recommended parameters:" in capsys.readouterr().out
+
+
+def test_main_stats_json(file_uri, capsys):
+    from zodburi.__main__ import main
+
+    assert main(["stats", "--workers", "1", "--json", file_uri]) == 0
+
+    result = json.loads(capsys.readouterr().out)
+    assert result["transactions"] == 4
+    assert result["blobs"] == {"count": 1, "bytes": 9}
+    assert result["classes"]["BTrees.OOBTree.OOBTree"]["count"] == 1
+    assert set(result["recommendations"]) == {
+        "connection_cache_size",
+        "connection_cache_size_bytes",
+        "connection_large_record_size",
+    }
@@ -0,0 +1,60 @@
+import os
+import socket
+
+import pytest
+
+
+def test_expand_uri(monkeypatch):
+    from zodburi.template import expand_uri
+
+    monkeypatch.setenv("ZODBURI_WORKER_ID", "3")
+    monkeypatch.setenv("APP_VAR", "/var/app")
+
+    assert expand_uri(
+        "zeo://localhost:9001?client=app-{worker_id}&var={env:APP_VAR}"
+    ) == "zeo://localhost:9001?client=app-3&var=/var/app"
+    assert expand_uri("file:///tmp/{hostname}-{pid}.fs") == (
+        f"file:///tmp/{socket.gethostname()}-{os.getpid()}.fs")
+
+
+def test_expand_uri_wo_placeholders():
+    from zodburi.template import expand_uri
+
+    uri = "file:///tmp/{other}/{env:}/Data.fs?quota=1kb"
+
+    assert expand_uri(uri) == uri
+
+
+@pytest.mark.parametrize("uri, placeholder", [
+    ("zeo://localhost:9001?client={worker_id}", "{worker_id}"),
+    ("file:///{env:ZODBURI_TEST_UNSET}/Data.fs", "{env:ZODBURI_TEST_UNSET}"),
+])
+def test_expand_uri_w_missing_value(monkeypatch, uri, placeholder):
+    from zodburi.template import expand_uri
+    from zodburi.template import MissingTemplateValue
+
+    monkeypatch.delenv("ZODBURI_WORKER_ID", raising=False)
+    monkeypatch.delenv("ZODBURI_TEST_UNSET", raising=False)
+
+    with pytest.raises(MissingTemplateValue) as exc_info:
+        expand_uri(uri)
+
+    assert exc_info.value.placeholder == placeholder
+    assert exc_info.value.uri == uri
+
+
+def test_resolve_uri_w_template(tmpdir, monkeypatch):
+    import contextlib
+
+    from zodburi import resolve_uri
+
+    monkeypatch.setenv("ZODBURI_WORKER_ID", "7")
+
+    factory, dbkw = resolve_uri(
+        f"demo:(file://{tmpdir}/w{{worker_id}}.fs)/(memory://{{pid}})"
+        f"#database_name=db{{worker_id}}")
+
+    assert dbkw["database_name"] == "db7"
+    with contextlib.closing(factory()) as storage:
+        assert storage.base.getName() == f"{tmpdir}/w7.fs"
+        assert storage.changes.getName() == str(os.getpid())
@@ -0,0 +1,161 @@
+import os
+
+from ZODB.DB import DB
+
+
+pytest_plugins = ["pytester"]
+
+
+def _populate(db):
+    with db.transaction() as conn:
+        conn.root()["fixture"] = 42
+
+
+def _fill_file(path):
+    from ZODB.FileStorage import FileStorage
+
+    db = DB(FileStorage(path))
+    _populate(db)
+    db.close()
+
+
+def test_database_layer_isolates_layers():
+    from zodburi.testing import DatabaseLayer
+
+    layer = DatabaseLayer("memory://", _populate)
+
+    first = layer.open()
+    with first.transaction() as conn:
+        assert conn.root()["fixture"] == 42
+        conn.root()["fixture"] = 43
+        conn.root()["mine"] = True
+    first.close()
+
+    second = layer.open()
+    with second.transaction() as conn:
+        assert conn.root()["fixture"] == 42
+        assert "mine" not in conn.root()
+    second.close()
+
+    layer.close()
+
+
+def test_database_layer_leaves_base_untouched(tmpdir):
+    from zodburi.testing import DatabaseLayer
+
+    path = f"{tmpdir}/Data.fs"
+    _fill_file(path)
+    size = os.path.getsize(path)
+
+    layer = DatabaseLayer(f"file://{path}?read_only=true&connection_pool_size=3")
+    db = layer.open()
+    assert db.getPoolSize() == 3
+    with db.transaction() as conn:
+        assert conn.root()["fixture"] == 42
+        conn.root()["fixture"] = 43
+    db.close()
+    layer.close()
+
+    assert os.path.getsize(path) == size
+
+
+def test_database_layer_w_fork(tmpdir):
+    import multiprocessing
+
+    from zodburi.proxy import StorageProxy
+    from zodburi.testing import DatabaseLayer
+
+    path = f"{tmpdir}/Data.fs"
+    _fill_file(path)
+    layer = DatabaseLayer(f"file://{path}?read_only=true")
+    assert isinstance(layer.base, StorageProxy)
+    db = layer.open()
+    with db.transaction() as conn:
+        conn.root()["parent"] = True
+
+    def child(queue):  # pragma: NO COVER child
+        with db.transaction() as conn:
+            queue.put((conn.root()["fixture"], conn.root()["parent"]))
+
+    context = multiprocessing.get_context("fork")
+    queue = context.Queue()
+    process = context.Process(target=child, args=(queue,))
+    process.start()
+    assert queue.get(timeout=10) == (42, True)
+    process.join(10)
+    assert process.exitcode == 0
+
+    with db.transaction() as conn:
+        assert conn.root()["fixture"] == 42
+    db.close()
+    layer.close()
+
+
+CONFTEST = """
+import pytest
+
+pytest_plugins = ["zodburi.testing"]
+
+populated = []
+
+
+@pytest.fixture(scope="session")
+def zodb_populate():
+    def populate(db):
+        populated.append(db)
+        with db.transaction() as conn:
+            conn.root()["fixture"] = 42
+    return populate
+"""
+
+TESTS = """
+import pytest
+
+import conftest
+
+
+@pytest.mark.parametrize("i", range(3))
+def test_isolated(zodb, i):
+    with zodb.transaction() as conn:
+        assert conn.root()["fixture"] == 42
+        assert "changed" not in conn.root()
+        conn.root()["changed"] = i
+
+
+def test_connection(zodb_connection):
+    root = zodb_connection.root()
+    assert root["fixture"] == 42
+    root["uncommitted"] = True
+
+
+def test_populated_once(zodb_uri):
+    assert zodb_uri == "memory://"
+    assert len(conftest.populated) == 1
+"""
+
+
+def test_fixtures(pytester):
+    pytester.makeconftest(CONFTEST)
+    pytester.makepyfile(TESTS)
+
+    result = pytester.runpytest()
+
+    result.assert_outcomes(passed=5)
+
+
+def test_fixtures_w_zodburi_uri(pytester, tmpdir):
+    path = f"{tmpdir}/Data.fs"
+    _fill_file(path)
+    pytester.makeconftest('pytest_plugins = ["zodburi.testing"]\n')
+    pytester.makeini(
+        f"[pytest]\nzodburi_uri = file://{path}?read_only=true\n")
+    pytester.makepyfile("""
+        def test_base(zodb, zodb_uri):
+            assert zodb_uri.startswith("file://")
+            with zodb.transaction() as conn:
+                assert conn.root()["fixture"] == 42
+    """)
+
+    result = pytester.runpytest()
+
+    result.assert_outcomes(passed=1)
@@ -0,0 +1,136 @@
+import os
+from unittest import mock
+
+import pytest
+from ZODB.DB import DB
+from ZODB.MappingStorage import MappingStorage
+from ZODB.utils import p64
+from ZODB.utils import z64
+
+from zodburi.tests.util import wait_for
+
+
+def test_trace_writer_and_read_trace(tmpdir):
+    from zodburi.trace import read_trace
+    from zodburi.trace import TraceRecord
+    from zodburi.trace import TraceWriter
+
+    path = f"{tmpdir}/trace.bin"
+    writer = TraceWriter(path, flush_interval=60)
+    writer.record(1, p64(1), p64(2), 10, 0.0015)
+    writer.record(3, p64(1), z64, 20, 10000.0)
+    writer.flush()
+    writer.record(2, p64(2), z64, 0, 0)
+    writer.close()
+    writer.close()
+
+    records = list(read_trace(path))
+
+    assert [r[:1] + r[2:5] for r in records] == [
+        ("load", p64(1), p64(2), 10),
+        ("store", p64(1), z64, 20),
+        ("loadBefore", p64(2), z64, 0),
+    ]
+    assert records[0].latency == pytest.approx(0.0015)
+    # Latencies are capped.
+    assert records[1].latency == pytest.approx(0xFFFFFFFF / 1e6)
+    assert all(isinstance(r, TraceRecord) for r in records)
+
+    # Writers append to existing traces.
+    writer = TraceWriter(path)
+    writer.record(1, p64(3), p64(4), 5, 0)
+    writer.close()
+    assert len(list(read_trace(path))) == 4
+
+
+def test_trace_writer_flushes_in_background(tmpdir):
+    from zodburi.trace import read_trace
+    from zodburi.trace import TraceWriter
+
+    path = f"{tmpdir}/trace.bin"
+    writer = TraceWriter(path, flush_interval=0.01)
+    writer.record(1, p64(1), p64(2), 10, 0)
+
+    wait_for(lambda: list(read_trace(path)))
+
+    assert len(list(read_trace(path))) == 1
+    writer.close()
+
+
+@pytest.mark.parametrize("content, why", [
+    (b"", "not a trace file"),
+    (b"ZTR1" + b"\0" * 10, "truncated record"),
+    (b"ZTR1\x09" + b"\0" * 32, "unknown event 9"),
+])
+def test_read_trace_w_invalid_file(tmpdir, content, why):
+    from zodburi.trace import InvalidTraceFile
+    from zodburi.trace import read_trace
+
+    path = f"{tmpdir}/trace.bin"
+    with open(path, "wb") as f:
+        f.write(content)
+
+    with pytest.raises(InvalidTraceFile, match=why):
+        list(read_trace(path))
+
+
+def test_tracing_storage(tmpdir):
+    import transaction
+
+    from zodburi.trace import read_trace
+    from zodburi.trace import TraceWriter
+    from zodburi.trace import TracingStorage
+
+    path = f"{tmpdir}/trace.bin"
+    storage = TracingStorage(MappingStorage, TraceWriter(path))
+    db = DB(storage)
+    with db.transaction() as conn:
+        conn.root()["answer"] = 42
+    conn = db.open(transaction.TransactionManager())
+    conn.cacheMinimize()
+    assert conn.root()["answer"] == 42
+    data, serial = storage.load(z64)
+    assert storage.loadBefore(z64, p64(1)) is None
+    conn.close()
+    db.close()
+
+    records = list(read_trace(path))
+
+    events = [r.event for r in records]
+    assert "store" in events
+    assert "loadBefore" in events
+    assert records[-2][:5] == ("load", records[-2].time, z64, serial, len(data))
+    assert records[-1][:5] == (
+        "loadBefore", records[-1].time, z64, z64, 0)
+    assert os.path.getsize(path) > 0
+
+
+def test_tracing_storage_closes_writer_on_failure():
+    from zodburi.trace import TracingStorage
+
+    writer = mock.Mock()
+    storage = TracingStorage(MappingStorage, writer)
+
+    with mock.patch.object(
+        MappingStorage, "close", side_effect=ValueError("testing"),
+    ):
+        with pytest.raises(ValueError):
+            storage.close()
+
+    writer.close.assert_called_once_with()
+
+
+def test_resolve_trace_uri(tmpdir):
+    from zodburi import resolve_uri
+    from zodburi.trace import read_trace
+
+    factory, dbkw = resolve_uri(
+        f"trace:(memory://)?out={tmpdir}/trace.bin&connection_cache_size=7")
+
+    assert dbkw["cache_size"] == 7
+    db = DB(factory(), **dbkw)
+    with db.transaction() as conn:
+        conn.root()["answer"] = 42
+    db.close()
+
+    assert "store" in {r.event for r in read_trace(f"{tmpdir}/trace.bin")}
@@ -0,0 +1,810 @@
+import contextlib
+import os
+import pathlib
+import tempfile
+from unittest import mock
+
+import pytest
+import ZEO
+from ZEO.cache import max_block_size
+from ZODB.DB import DB
+from ZODB.utils import maxtid
+from ZODB.utils import p64
+
+from zodburi.tests.util import wait_for
+
+
+@pytest.fixture(scope="function")
+def tmpdir():
+    with tempfile.TemporaryDirectory() as tmp:
+        yield tmp
+
+
+@pytest.fixture(scope="function")
+def zeo_server():
+    addr, stop = ZEO.server()
+    try:
+        yield addr
+    finally:
+        stop()
+
+
+def test_read_oids_wo_file(tmpdir):
+    from zodburi.zeo import read_oids
+
+    assert read_oids(pathlib.Path(tmpdir) / "nonesuch") == []
+
+
+def test_write_oids_read_oids_roundtrip(tmpdir):
+    from zodburi.zeo import read_oids
+    from zodburi.zeo import write_oids
+
+    path = pathlib.Path(tmpdir) / "hot.oids"
+    oids = [p64(1), p64(0xdeadbeef)]
+
+    write_oids(path, oids)
+
+    assert path.read_text() == "0000000000000001\n00000000deadbeef\n"
+    assert read_oids(path) == oids
+    assert [p.name for p in path.parent.iterdir()] == ["hot.oids"]
+
+
+def test_read_oids_skips_invalid_lines(tmpdir):
+    from zodburi.zeo import read_oids
+
+    path = pathlib.Path(tmpdir) / "hot.oids"
+    path.write_bytes(
+        b"0000000000000001\nnot hex\n\n00000002\n\xff\xfe\n"
+        b"00000000deadbeef\n000000000000")
+
+    with mock.patch("zodburi.zeo.logger") as logger:
+        assert read_oids(path) == [p64(1), p64(0xdeadbeef)]
+
+    logger.warning.assert_called_once_with(
+        "Skipped %d invalid lines of %s", 4, path)
+
+
+def test_write_oids_uses_unique_temporary_file(tmpdir):
+    from zodburi.zeo import write_oids
+
+    path = pathlib.Path(tmpdir) / "hot.oids"
+    write_oids(path, [p64(1)])
+    # A stale temporary file of another writer is left alone.
+    (pathlib.Path(tmpdir) / "hot.oids.tmp").write_text("other")
+
+    with pytest.raises(AttributeError):
+        write_oids(path, [p64(2), None])
+
+    assert path.read_text() == "0000000000000001\n"
+    assert sorted(p.name for p in path.parent.iterdir()) == [
+        "hot.oids", "hot.oids.tmp"]
+
+
+def test_warm_cache_w_corrupted_file(tmpdir):
+    from zodburi.zeo import warm_cache
+
+    path = pathlib.Path(tmpdir) / "hot.oids"
+    path.write_text("garbage\n")
+    storage = mock.Mock(spec_set=("_server", "_cache", "close"))
+
+    warm_cache(storage, path, wait=True)
+
+    storage._server.prefetch.assert_not_called()
+
+
+@pytest.mark.parametrize("kw, expected", [
+    ({}, (None, None, None, "1", 20 << 20)),
+    (
+        {"client": "c", "var": "/v", "storage": "s", "cache_size": 1024},
+        (None, "/v", "c", "s", 1024),
+    ),
+])
+def test_open_dropped_cache(kw, expected):
+    from zodburi.zeo import open_dropped_cache
+
+    with mock.patch("zodburi.zeo.open_cache") as oc:
+        cache = open_dropped_cache(kw)
+
+    oc.assert_called_once_with(*expected)
+    assert cache is oc.return_value
+    cache.clear.assert_called_once_with()
+
+
+def test_prewarm_cache_in_batches():
+    from zodburi.zeo import prewarm_cache
+
+    storage = mock.Mock(spec_set=("_server",))
+    oids = [p64(i) for i in range(5)]
+
+    prewarm_cache(storage, oids, batch_size=2)
+
+    server = storage._server
+    server.wait.assert_called_once_with()
+    assert server.prefetch.call_args_list == [
+        mock.call(oids[0:2], maxtid),
+        mock.call(oids[2:4], maxtid),
+        mock.call(oids[4:5], maxtid),
+    ]
+
+
+def test_warm_cache_w_wait(tmpdir):
+    from zodburi.zeo import warm_cache
+    from zodburi.zeo import write_oids
+
+    path = pathlib.Path(tmpdir) / "hot.oids"
+    write_oids(path, [p64(1)])
+    storage = mock.Mock(spec_set=("_server", "_cache", "close"))
+    storage._cache.current = [p64(2), p64(3)]
+    close = storage.close
+
+    with mock.patch("zodburi.zeo.prewarm_cache") as pc:
+        warm_cache(storage, path, wait=True)
+
+    pc.assert_called_once_with(storage, [p64(1)])
+
+    storage.close()
+
+    close.assert_called_once_with()
+    assert path.read_text() == "0000000000000002\n0000000000000003\n"
+
+
+def test_warm_cache_wo_recorded_oids_or_wait(tmpdir):
+    from zodburi.zeo import warm_cache
+
+    path = pathlib.Path(tmpdir) / "hot.oids"
+    storage = mock.Mock(spec_set=("_server", "_cache", "close"))
+
+    with mock.patch("threading.Thread") as thread:
+        warm_cache(storage, path)
+
+    thread.assert_not_called()
+
+
+def test_warm_cache_logs_failures(tmpdir):
+    from zodburi.zeo import _prewarm_cache_logged
+    from zodburi.zeo import warm_cache
+
+    path = pathlib.Path(tmpdir) / "missing" / "hot.oids"
+    storage = mock.Mock(spec_set=("_server", "_cache", "close", "__name__"))
+    storage._cache.current = [p64(2)]
+    storage._server.wait.side_effect = ValueError("testing")
+
+    with mock.patch("zodburi.zeo.logger") as logger:
+        warm_cache(storage, path)
+        storage.close()
+        _prewarm_cache_logged(storage, [p64(1)])
+
+    assert logger.exception.call_count == 2
+
+
+def test_warm_cache_w_zeo_server(tmpdir, zeo_server):
+    from zodburi import resolve_uri
+    from zodburi.zeo import read_oids
+
+    path = pathlib.Path(tmpdir) / "hot.oids"
+    host, port = zeo_server
+    uri = (
+        f"zeo://{host}:{port}"
+        f"?cache_verify=startup&cache_prewarm={path}"
+    )
+
+    factory, dbkw = resolve_uri(uri)
+    db = DB(factory(), **dbkw)
+    with db.transaction() as conn:
+        conn.root.answer = 42
+    db.close()
+
+    recorded = read_oids(path)
+    assert p64(0) in recorded
+
+    with contextlib.closing(factory()) as storage:
+        assert set(recorded) <= set(storage._cache.current)
+
+
+def test_warm_cache_in_background_w_zeo_server(tmpdir, zeo_server):
+    import threading
+
+    from persistent.mapping import PersistentMapping
+
+    from zodburi import resolve_uri
+    from zodburi.zeo import write_oids
+
+    host, port = zeo_server
+    factory, dbkw = resolve_uri(f"zeo://{host}:{port}")
+    db = DB(factory(), **dbkw)
+    answer = PersistentMapping(answer=42)
+    with db.transaction() as conn:
+        conn.root.answer = answer
+    oids = [p64(0), answer._p_oid]
+    db.close()
+    path = pathlib.Path(tmpdir) / "hot.oids"
+    write_oids(path, oids)
+
+    prewarmed = threading.Event()
+    factory, dbkw = resolve_uri(f"zeo://{host}:{port}?cache_prewarm={path}")
+    with mock.patch("zodburi.zeo.logger") as logger:
+        logger.info.side_effect = lambda *args: prewarmed.set()
+        with contextlib.closing(factory()) as storage:
+            assert prewarmed.wait(10)
+            assert set(oids) <= set(storage._cache.current)
+
+    logger.info.assert_called_once_with(
+        "Prewarmed the cache of %s", storage)
+    logger.exception.assert_not_called()
+
+
+def test_backoff_delays():
+    from zodburi.zeo import Backoff
+
+    backoff = Backoff(0.5, maximum=3, jitter=0.5, random=lambda: 1.0)
+
+    assert [backoff.delay() for _ in range(5)] == [0.25, 0.5, 1, 1.5, 1.5]
+    backoff.reset()
+    assert backoff.delay() == 0.25
+
+
+def test_backoff_as_disconnect_poll():
+    from zodburi.zeo import Backoff
+
+    backoff = Backoff(1, jitter=0)
+
+    # ZEO computes its delays as 'disconnect_poll + random()'.
+    assert backoff + 0.5 == 1.5
+    assert 0.5 + backoff == 2.5
+    assert backoff.attempts == 2
+
+
+def test_default_verify_lock():
+    from zodburi.zeo import default_verify_lock
+
+    path = default_verify_lock(("localhost", 9991))
+
+    assert path.startswith(tempfile.gettempdir())
+    assert path == default_verify_lock(("localhost", 9991), "1")
+    assert path != default_verify_lock(("localhost", 9991), "2")
+    assert path != default_verify_lock("/var/run/zeo.sock")
+
+
+def test_default_verify_lock_in_private_directory(tmpdir):
+    import os
+
+    from zodburi.zeo import default_verify_lock
+    from zodburi.zeo import VerificationSlots
+
+    with mock.patch("tempfile.gettempdir", return_value=str(tmpdir)):
+        path = default_verify_lock(("localhost", 9991))
+    slots = VerificationSlots(path, 1)
+
+    slots.release(slots.try_acquire())
+
+    assert os.path.dirname(path).startswith(str(tmpdir))
+    assert str(os.getuid()) in os.path.basename(os.path.dirname(path))
+    assert os.stat(os.path.dirname(path)).st_mode & 0o777 == 0o700
+
+
+def test_private_directory(tmpdir):
+    import os
+
+    from zodburi.zeo import private_directory
+
+    path = f"{tmpdir}/private"
+
+    assert private_directory(path) == path
+    assert os.stat(path).st_mode & 0o777 == 0o700
+    # Existing, still private.
+    assert private_directory(path) == path
+
+
+def _make_file(path):
+    open(path, "w").close()
+
+
+def _make_symlink(path):
+    os.symlink(os.path.dirname(path), path)
+
+
+def _make_directory(mode):
+    def make(path):
+        os.mkdir(path)
+        os.chmod(path, mode)
+    return make
+
+
+@pytest.mark.parametrize("make, why", [
+    (_make_file, "not a directory"),
+    (_make_symlink, "not a directory"),
+    (_make_directory(0o777), "writable by other users"),
+    (_make_directory(0o720), "writable by other users"),
+], ids=["file", "symlink", "world-writable", "group-writable"])
+def test_private_directory_w_insecure_directory(tmpdir, make, why):
+    from zodburi.zeo import InsecureDirectory
+    from zodburi.zeo import private_directory
+
+    path = f"{tmpdir}/private"
+    make(path)
+
+    with pytest.raises(InsecureDirectory, match=why) as exc:
+        private_directory(path)
+
+    assert exc.value.path == path
+
+
+def test_private_directory_owned_by_another_user(tmpdir):
+    from zodburi.zeo import InsecureDirectory
+    from zodburi.zeo import private_directory
+
+    path = f"{tmpdir}/private"
+    os.mkdir(path, 0o700)
+    st = mock.Mock(st_mode=os.stat(path).st_mode, st_uid=os.getuid() + 1)
+
+    with mock.patch("os.lstat", return_value=st):
+        with pytest.raises(InsecureDirectory, match="another user"):
+            private_directory(path)
+
+
+def test_verification_slots_w_insecure_directory(tmpdir):
+    from zodburi.zeo import InsecureDirectory
+    from zodburi.zeo import VerificationSlots
+
+    os.chmod(tmpdir, 0o777)
+    try:
+        with pytest.raises(InsecureDirectory):
+            VerificationSlots(f"{tmpdir}/verify", 1).try_acquire()
+    finally:
+        os.chmod(tmpdir, 0o700)
+
+
+def test_verification_slots_do_not_follow_symlinks(tmpdir):
+    from zodburi.zeo import VerificationSlots
+
+    target = pathlib.Path(tmpdir) / "target"
+    target.write_text("")
+    os.symlink(target, f"{tmpdir}/verify.0")
+
+    with pytest.raises(OSError):
+        VerificationSlots(f"{tmpdir}/verify", 1).try_acquire()
+
+    assert target.read_text() == ""
+
+
+def test_verification_slots(tmpdir):
+    import asyncio
+
+    from zodburi.zeo import VerificationSlots
+
+    slots = VerificationSlots(f"{tmpdir}/verify", 2, poll=0.01)
+    # Another client, e.g. in another process.
+    other = VerificationSlots(f"{tmpdir}/verify", 2, poll=0.01)
+
+    first = slots.try_acquire()
+    second = other.try_acquire()
+    assert first is not None and second is not None
+    assert other.try_acquire() is None
+
+    async def acquire_after_release():
+        waiting = asyncio.ensure_future(slots.acquire())
+        await asyncio.sleep(0.05)
+        assert not waiting.done()
+        other.release(second)
+        return await waiting
+
+    third = asyncio.run(acquire_after_release())
+    assert third.name == f"{tmpdir}/verify.1"
+    slots.release(first)
+    slots.release(third)
+    assert sorted(pathlib.Path(tmpdir).iterdir()) == [
+        pathlib.Path(tmpdir) / "verify.0",
+        pathlib.Path(tmpdir) / "verify.1",
+    ]
+
+
+def test_client_thread_verifies_in_slot(tmpdir, zeo_server):
+    from zodburi import resolve_uri
+    from zodburi.zeo import VerificationSlots
+
+    host, port = zeo_server
+    lock = f"{tmpdir}/verify"
+    uri = (
+        f"zeo://{host}:{port}?client=c&var={tmpdir}&wait=false"
+        f"&reconnect_backoff=0.1&verify_slots=1&verify_lock={lock}"
+    )
+    factory, dbkw = resolve_uri(uri)
+
+    # An empty cache is verified without a slot.
+    storage = factory()
+    storage._server.wait(5)
+    db = DB(storage, **dbkw)
+    with db.transaction() as conn:
+        conn.root.answer = 42
+    db.close()
+
+    # Another client is verifying its cache.
+    slot = VerificationSlots(lock, 1).try_acquire()
+    with contextlib.closing(factory()) as storage:
+        with pytest.raises(ZEO.Exceptions.ClientDisconnected):
+            storage._server.wait(0.5)
+
+        VerificationSlots(lock, 1).release(slot)
+
+        storage._server.wait(5)
+        assert storage.is_connected()
+        assert storage._server.client.verify_result == "Cache up to date"
+        assert storage._server.client.connect_poll.attempts == 0
+
+    assert VerificationSlots(lock, 1).try_acquire() is not None
+
+
+def test_client_thread_backs_off(tmpdir):
+    from zodburi import resolve_uri
+
+    factory, dbkw = resolve_uri(
+        f"zeo://{tmpdir}/nosuch.sock?wait=false"
+        f"&reconnect_backoff=0.01&reconnect_jitter=0")
+
+    with contextlib.closing(factory()) as storage:
+        backoff = storage._server.client.connect_poll
+        wait_for(lambda: backoff.attempts >= 3)
+
+        assert backoff.attempts >= 3
+        assert not storage.is_connected()
+
+
+@pytest.mark.parametrize("value, expected", [
+    ("1kb", 1024),
+    ("host:20gb", 20 << 30),
+    ("HOST:1024", 1024),
+])
+def test_convert_cache_size(value, expected):
+    from zodburi.zeo import convert_cache_size
+    from zodburi.zeo import HostCacheSize
+
+    size = convert_cache_size(value)
+
+    assert size == expected
+    assert isinstance(size, HostCacheSize) == value.lower().startswith("host:")
+    if isinstance(size, HostCacheSize):
+        assert str(size) == f"host:{expected}"
+
+
+def test_default_cache_budget_dir():
+    from zodburi.zeo import default_cache_budget_dir
+    from zodburi.zeo import default_verify_lock
+
+    path = default_cache_budget_dir(("localhost", 9991))
+
+    assert path.startswith(tempfile.gettempdir())
+    assert path != default_cache_budget_dir(("localhost", 9991), "2")
+    assert path != default_verify_lock(("localhost", 9991))
+
+
+def test_host_cache_budget(tmpdir):
+    from zodburi.zeo import HostCacheBudget
+
+    budget = HostCacheBudget(1000, f"{tmpdir}/budget")
+    # Another client, e.g. in another process.
+    other = HostCacheBudget(1000, f"{tmpdir}/budget")
+
+    first = budget.join()
+    assert budget.share() == 1000
+    second = other.join()
+    assert budget.share() == other.share() == 500
+    third = other.join()
+    assert budget.share() == 333
+
+    other.leave(second)
+    assert budget.share() == 500
+
+    # A member whose process died no longer holds its lock.
+    third.close()
+    assert budget.share() == 1000
+    assert len(list(pathlib.Path(tmpdir, "budget").iterdir())) == 1
+    budget.leave(first)
+    assert list(pathlib.Path(tmpdir, "budget").iterdir()) == []
+
+
+def test_host_cache_budget_in_private_directory(tmpdir):
+    from zodburi.zeo import default_cache_budget_dir
+    from zodburi.zeo import HostCacheBudget
+
+    with mock.patch("tempfile.gettempdir", return_value=str(tmpdir)):
+        path = default_cache_budget_dir(("localhost", 9991))
+    budget = HostCacheBudget(1000, path)
+
+    budget.leave(budget.join())
+
+    assert str(os.getuid()) in os.path.basename(path)
+    assert os.stat(path).st_mode & 0o777 == 0o700
+
+
+def test_host_cache_budget_w_insecure_directory(tmpdir):
+    from zodburi.zeo import HostCacheBudget
+    from zodburi.zeo import InsecureDirectory
+
+    path = f"{tmpdir}/budget"
+    os.mkdir(path)
+    os.chmod(path, 0o777)
+    planted = pathlib.Path(path, "planted.member")
+    planted.write_text("")
+
+    with pytest.raises(InsecureDirectory):
+        HostCacheBudget(1000, path).join()
+
+    assert planted.exists()
+
+
+def test_host_cache_budget_members_skips_other_files(tmpdir):
+    from zodburi.zeo import HostCacheBudget
+
+    budget = HostCacheBudget(1000, f"{tmpdir}/budget")
+    member = budget.join()
+    pathlib.Path(tmpdir, "budget", "other.tmp").write_text("")
+    listdir = os.listdir
+
+    # A member leaving between listing and counting.
+    with mock.patch(
+        "os.listdir", side_effect=lambda path: listdir(path) + ["1-x.member"],
+    ):
+        assert budget.members() == 1
+
+    budget.leave(member)
+    assert [p.name for p in pathlib.Path(tmpdir, "budget").iterdir()] == [
+        "other.tmp"]
+
+
+def _cache(tmpdir, size):
+    from ZEO.cache import ClientCache
+
+    return ClientCache(f"{tmpdir}/cache", size)
+
+
+@pytest.mark.parametrize("size, new_size, expected_size", [
+    (100_000, 300_000, 300_000),
+    (100_000, 100_003, 100_000),
+    # Grown by more than a free block's maximum size.
+    (100_000, 100_000 + max_block_size + 10, 100_000 + max_block_size + 10),
+    (300_000, 100_000, 100_000),
+])
+def test_resize_cache(tmpdir, size, new_size, expected_size):
+    import os
+
+    cache = _cache(tmpdir, size)
+    for i in range(100):
+        cache.store(p64(i), p64(1), None, b"x" * 1000)
+    cache.setLastTid(p64(1))
+
+    from zodburi.zeo import resize_cache
+
+    resize_cache(cache, new_size)
+
+    assert cache.maxsize == expected_size
+    assert os.path.getsize(f"{tmpdir}/cache") == expected_size
+    for i in range(200, 400):
+        cache.store(p64(i), p64(2), None, b"y" * 1000)
+    cache.setLastTid(p64(2))
+    assert cache.load(p64(399)) == (b"y" * 1000, p64(2))
+    cache.close()
+
+    # The resized cache file is valid.
+    cache = _cache(tmpdir, expected_size)
+    assert cache.load(p64(399)) == (b"y" * 1000, p64(2))
+    cache.close()
+
+
+def test_share_cache_budget(tmpdir):
+    from zodburi.zeo import HostCacheBudget
+    from zodburi.zeo import share_cache_budget
+
+    budget = HostCacheBudget(400_000, f"{tmpdir}/budget")
+    member = budget.join()
+    storage = mock.Mock(__name__="test", _cache=_cache(tmpdir, 400_000))
+    close = storage.close
+    share_cache_budget(storage, budget, member, interval=0.01)
+
+    other = budget.join()
+    wait_for(lambda: storage._cache.maxsize == 200_000)
+    assert storage._cache.maxsize == 200_000
+
+    storage.close()
+
+    close.assert_called_once_with()
+    assert budget.share() == 400_000
+    budget.leave(other)
+    storage._cache.close()
+
+
+def test_share_cache_budget_logs_failures(tmpdir):
+    from zodburi.zeo import HostCacheBudget
+    from zodburi.zeo import share_cache_budget
+
+    budget = HostCacheBudget(400_000, f"{tmpdir}/budget")
+    storage = mock.Mock(__name__="test")
+    storage._cache.maxsize = 1
+
+    with mock.patch("zodburi.zeo.resize_cache", side_effect=OSError):
+        with mock.patch("zodburi.zeo.logger") as logger:
+            share_cache_budget(storage, budget, budget.join(), interval=0.01)
+            wait_for(lambda: logger.exception.called)
+            storage.close()
+
+    logger.exception.assert_called_with(
+        "Resizing the cache of %s failed", storage)
+
+
+@pytest.mark.parametrize("host, expected", [
+    ("", True),
+    ("localhost", True),
+    ("127.0.0.1", True),
+    ("::1", True),
+    ("192.0.2.1", False),
+    ("zeo.example.com", False),
+])
+def test_is_local_host(host, expected):
+    from zodburi.zeo import is_local_host
+
+    assert is_local_host(host) is expected
+
+
+def test_is_local_host_w_hostname():
+    import socket
+
+    from zodburi.zeo import is_local_host
+
+    assert is_local_host(socket.gethostname())
+
+
+def test_default_unix_socket(tmpdir):
+    from zodburi.zeo import default_unix_socket
+
+    with mock.patch("tempfile.tempdir", tmpdir):
+        path = default_unix_socket(("localhost", 8100))
+
+    assert path == f"{tmpdir}/zodburi-zeo-{os.getuid()}/8100.sock"
+
+
+def test_prefer_unix_socket(tmpdir):
+    from zodburi.zeo import prefer_unix_socket
+
+    path = f"{tmpdir}/zeo.sock"
+    tcp = ("localhost", 8100)
+    assert prefer_unix_socket(tcp, path) == tcp
+
+    # Not a socket.
+    pathlib.Path(path).touch()
+    assert prefer_unix_socket(tcp, path) == tcp
+    pathlib.Path(path).unlink()
+
+    addr, stop = ZEO.server(port=path)
+    try:
+        assert prefer_unix_socket(tcp, path) == path
+    finally:
+        stop()
+
+    # The socket file is left behind, with no server listening on it.
+    assert prefer_unix_socket(tcp, path) == tcp
+
+
+@pytest.fixture
+def unix_server(tmpdir):
+    # A server listening on a unix socket in a private directory.
+    os.mkdir(f"{tmpdir}/private", 0o700)
+    path = f"{tmpdir}/private/zeo.sock"
+    addr, stop = ZEO.server(port=path)
+    yield path
+    stop()
+
+
+def test_prefer_unix_socket_through_symlinks(tmpdir, unix_server):
+    from zodburi.zeo import prefer_unix_socket
+
+    tcp = ("localhost", 8100)
+    os.symlink("private/zeo.sock", f"{tmpdir}/zeo.sock")
+    os.symlink(f"{tmpdir}/zeo.sock", f"{tmpdir}/link.sock")
+
+    assert prefer_unix_socket(tcp, f"{tmpdir}/link.sock") == (
+        f"{tmpdir}/link.sock")
+
+
+def test_prefer_unix_socket_w_symlink_loop(tmpdir):
+    from zodburi.zeo import prefer_unix_socket
+
+    tcp = ("localhost", 8100)
+    os.symlink("zeo.sock", f"{tmpdir}/zeo.sock")
+
+    assert prefer_unix_socket(tcp, f"{tmpdir}/zeo.sock") == tcp
+
+
+@pytest.mark.parametrize("writable", ["socket", "symlink"])
+def test_prefer_unix_socket_in_world_writable_directory(
+        tmpdir, unix_server, writable):
+    from zodburi.zeo import prefer_unix_socket
+
+    tcp = ("localhost", 8100)
+    path = unix_server
+    if writable == "socket":
+        os.chmod(os.path.dirname(path), 0o777)
+    else:
+        os.mkdir(f"{tmpdir}/public")
+        os.chmod(f"{tmpdir}/public", 0o1777)
+        os.symlink(path, f"{tmpdir}/public/zeo.sock")
+        path = f"{tmpdir}/public/zeo.sock"
+
+    with mock.patch("zodburi.zeo.logger") as logger:
+        assert prefer_unix_socket(tcp, path) == tcp
+
+    logger.warning.assert_called_once()
+
+
+@pytest.mark.parametrize("owned", ["socket", "directory"])
+def test_prefer_unix_socket_owned_by_another_user(tmpdir, unix_server, owned):
+    from zodburi.zeo import prefer_unix_socket
+
+    tcp = ("localhost", 8100)
+    # lstat for the socket itself, stat for its directory.
+    name = "lstat" if owned == "socket" else "stat"
+    real = getattr(os, name)
+
+    def owned_by_other(path):
+        return mock.Mock(st_mode=real(path).st_mode, st_uid=os.getuid() + 1)
+
+    with mock.patch(f"os.{name}", owned_by_other):
+        assert prefer_unix_socket(tcp, unix_server) == tcp
+
+    assert prefer_unix_socket(tcp, unix_server) == unix_server
+
+
+def test_client_storage_falls_back_to_tcp_on_reconnect(tmpdir, zeo_server):
+    from zodburi import resolve_uri
+
+    host, port = zeo_server
+    tcp = ("localhost", port)
+    path = f"{tmpdir}/zeo.sock"
+    factory, dbkw = resolve_uri(f"zeo://localhost:{port}?unix_socket={path}")
+    unix_addr, stop = ZEO.server(port=path)
+
+    with contextlib.closing(factory()) as storage:
+        client = storage._server.client
+        assert client.protocol.addr == path
+
+        # The server stops listening on its unix socket:  the client
+        # reconnects over TCP.
+        stop()
+        wait_for(
+            lambda: storage.is_connected() and client.protocol.addr == tcp,
+            timeout=10)
+
+        assert client.protocol.addr == tcp
+        assert client.addrs == [tcp]
+        assert storage.__name__ == str(tcp)
+
+
+def test_client_storage_prefers_advertised_unix_socket(tmpdir, zeo_server):
+    from zodburi import resolve_uri
+
+    host, port = zeo_server
+    uri = f"zeo://localhost:{port}?unix_socket=auto"
+    with mock.patch("tempfile.tempdir", tmpdir):
+        factory, dbkw = resolve_uri(uri)
+
+    # No advertised socket:  connect over TCP.
+    storage = factory()
+    try:
+        assert storage._addr == [("localhost", port)]
+        assert storage.__name__ == str(("localhost", port))
+    finally:
+        storage.close()
+
+    os.mkdir(f"{tmpdir}/zodburi-zeo-{os.getuid()}", 0o700)
+    path = f"{tmpdir}/zodburi-zeo-{os.getuid()}/{port}.sock"
+    unix_addr, stop = ZEO.server(port=path)
+    try:
+        storage = factory()
+        db = DB(storage)
+        try:
+            assert storage._addr == [path]
+            assert storage.__name__ == str(("localhost", port))
+            with db.transaction() as conn:
+                conn.root()["x"] = 1
+        finally:
+            db.close()
+    finally:
+        stop()
@@ -0,0 +1,13 @@
+import time
+
+
+def wait_for(predicate, timeout=5.0, interval=0.01):
+    """Wait up to 'timeout' seconds for 'predicate()' to return a true
+    value, and return its last result.
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        result = predicate()
+        if result or time.monotonic() >= deadline:
+            return result
+        time.sleep(interval)  # pragma: NO COVER timing
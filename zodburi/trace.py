@@ -0,0 +1,167 @@
+import collections
+import os
+import struct
+import threading
+import time
+
+from ZODB.utils import z64
+
+from zodburi.proxy import StorageProxy
+
+
+DEFAULT_FLUSH_INTERVAL = 1.0
+
+# Trace files start with this, followed by records.
+MAGIC = b"ZTR1"
+# event, time, oid, tid, size, latency (in microseconds)
+RECORD = struct.Struct(">Bd8s8sII")
+MAX_LATENCY = 0xFFFFFFFF
+
+LOAD = 1
+LOAD_BEFORE = 2
+STORE = 3
+EVENTS = {LOAD: "load", LOAD_BEFORE: "loadBefore", STORE: "store"}
+
+TraceRecord = collections.namedtuple(
+    "TraceRecord", ["event", "time", "oid", "tid", "size", "latency"])
+
+
+class InvalidTraceFile(ValueError):
+    def __init__(self, path, why):
+        self.path = path
+        self.why = why
+        super().__init__(f"Invalid trace file {path!r}: {why}")
+
+
+class TraceWriter:
+    """Append trace records to the file at 'path'.
+
+    :meth:`record` only queues an event:  a background thread packs the
+    queued events and appends them to the file every 'flush_interval'
+    seconds, in one write of whole records, so that processes tracing to
+    the same file do not interleave partial records.
+    """
+    def __init__(self, path, flush_interval=DEFAULT_FLUSH_INTERVAL):
+        self.path = path
+        self.flush_interval = flush_interval
+        self._fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o666)
+        if os.fstat(self._fd).st_size == 0:
+            os.write(self._fd, MAGIC)
+        self._events = collections.deque()
+        self._write_lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run,
+            name=f"zodburi trace writer for {path}",
+            daemon=True,
+        )
+        self._thread.start()
+
+    def record(self, event, oid, tid, size, latency):
+        """Queue an event, of 'latency' seconds, for writing."""
+        self._events.append((event, time.time(), oid, tid, size, latency))
+
+    def _run(self):
+        while not self._stopped.wait(self.flush_interval):
+            self.flush()
+
+    def flush(self):
+        """Write the queued events."""
+        pack = RECORD.pack
+        events = self._events
+        with self._write_lock:
+            chunks = []
+            while True:
+                try:
+                    event, t, oid, tid, size, latency = events.popleft()
+                except IndexError:
+                    break
+                chunks.append(pack(
+                    event, t, oid, tid, size,
+                    min(int(latency * 1e6), MAX_LATENCY)))
+            if chunks:
+                os.write(self._fd, b"".join(chunks))
+
+    def close(self):
+        if self._stopped.is_set():
+            return
+        self._stopped.set()
+        self._thread.join()
+        self.flush()
+        os.close(self._fd)
+
+
+def read_trace(path):
+    """Iterate over the :class:`TraceRecord` of the trace file at 'path'.
+
+    The records are read as a stream, so traces of any size can be
+    processed.  A :class:`TraceRecord`'s 'event' is one of ``"load"``,
+    ``"loadBefore"`` or ``"store"`` and its 'latency' is in seconds.
+    """
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise InvalidTraceFile(path, "not a trace file")
+        for event, t, oid, tid, size, latency in _whole_records(f, path):
+            try:
+                name = EVENTS[event]
+            except KeyError:
+                raise InvalidTraceFile(path, f"unknown event {event}")
+            yield TraceRecord(name, t, oid, tid, size, latency / 1e6)
+
+
+def _whole_records(f, path, chunk_records=1 << 16):
+    # Unpack the records of 'f', reading many at a time.
+    chunk_size = RECORD.size * chunk_records
+    while True:
+        chunk = f.read(chunk_size)
+        if len(chunk) % RECORD.size:
+            raise InvalidTraceFile(path, "truncated record")
+        if not chunk:
+            return
+        yield from RECORD.iter_unpack(chunk)
+
+
+class TracingStorage(StorageProxy):
+    """Record the loads and stores of the storage returned by 'factory'
+    with 'writer', a :class:`TraceWriter` closed with the storage.
+
+    Loads are recorded with the size of the record loaded (0 if none) and
+    the transaction id it was committed in, stores with the size of the
+    record and its previous serial.
+    """
+    def __init__(self, factory, writer):
+        super().__init__(factory)
+        self._writer = writer
+
+    def load(self, oid, version=''):
+        start = time.perf_counter()
+        data, serial = self._get_storage().load(oid, version)
+        self._writer.record(
+            LOAD, oid, serial, len(data), time.perf_counter() - start)
+        return data, serial
+
+    def loadBefore(self, oid, tid):
+        start = time.perf_counter()
+        result = self._get_storage().loadBefore(oid, tid)
+        latency = time.perf_counter() - start
+        if result is None:
+            self._writer.record(LOAD_BEFORE, oid, z64, 0, latency)
+        else:
+            self._writer.record(
+                LOAD_BEFORE, oid, result[1], len(result[0]), latency)
+        return result
+
+    def store(self, oid, serial, data, version, transaction):
+        start = time.perf_counter()
+        result = self._get_storage().store(
+            oid, serial, data, version, transaction)
+        self._writer.record(
+            STORE, oid, serial or z64, len(data or b""),
+            time.perf_counter() - start)
+        return result
+
+    def close(self):
+        try:
+            super().close()
+        finally:
+            self._writer.close()
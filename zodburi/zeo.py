@@ -0,0 +1,599 @@
+import asyncio
+import hashlib
+import ipaddress
+import logging
+import os
+import random
+import socket
+import stat
+import tempfile
+import threading
+
+import ZEO.asyncio.client
+from ZEO.cache import max_block_size
+from ZEO.ClientStorage import open_cache
+from ZODB.utils import maxtid
+
+from zodburi.datatypes import convert_bytesize
+
+
+logger = logging.getLogger(__name__)
+
+CACHE_VERIFY_MODES = ("startup", "background", "drop")
+
+# ClientStorage's own default 'cache_size'
+DEFAULT_CACHE_SIZE = 20 << 20
+
+PREWARM_BATCH_SIZE = 100
+
+DEFAULT_RECONNECT_BACKOFF_MAX = 60.0
+DEFAULT_RECONNECT_JITTER = 0.5
+# Seconds between attempts to get a verification slot (before jitter).
+VERIFY_SLOT_POLL = 0.5
+
+HOST_CACHE_SIZE_PREFIX = "host:"
+DEFAULT_CACHE_BUDGET_INTERVAL = 30.0
+
+# 'unix_socket' value looking for the socket at 'default_unix_socket'.
+AUTO_UNIX_SOCKET = "auto"
+# Seconds to wait for a unix socket to accept a connection when probing it.
+UNIX_SOCKET_PROBE_TIMEOUT = 1.0
+# Most symlinks followed from a unix socket's path to the socket.
+MAX_UNIX_SOCKET_SYMLINKS = 40
+
+
+class InvalidCacheVerifyMode(ValueError):
+    def __init__(self, mode):
+        self.mode = mode
+        super().__init__(
+            f"Invalid cache_verify mode {mode!r}, expected one of: "
+            f"{', '.join(CACHE_VERIFY_MODES)}"
+        )
+
+
+class InvalidReconnectJitter(ValueError):
+    def __init__(self, jitter):
+        self.jitter = jitter
+        super().__init__(
+            f"Invalid reconnect_jitter {jitter!r}, expected a fraction "
+            f"between 0 and 1")
+
+
+class InsecureDirectory(OSError):
+    def __init__(self, path, why):
+        self.path = path
+        self.why = why
+        super().__init__(f"Refusing to use directory {path!r}: {why}")
+
+
+def read_oids(path):
+    """Return the OIDs recorded in 'path', one per line in hex.
+
+    Returns an empty list if 'path' does not exist.  Lines which are not
+    an OID in hex (e.g. from a truncated or corrupted file) are skipped.
+    """
+    oids = []
+    invalid = 0
+    try:
+        with open(path, errors="replace") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    oid = bytes.fromhex(line)
+                except ValueError:
+                    oid = None
+                if oid is None or len(oid) != 8:
+                    invalid += 1
+                else:
+                    oids.append(oid)
+    except FileNotFoundError:
+        return []
+
+    if invalid:
+        logger.warning("Skipped %d invalid lines of %s", invalid, path)
+    return oids
+
+
+def write_oids(path, oids):
+    """Record 'oids' in 'path', one per line in hex, replacing it atomically.
+    """
+    fd, tmp_path = tempfile.mkstemp(
+        prefix=f"{os.path.basename(path)}.",
+        suffix=".tmp",
+        dir=os.path.dirname(path) or None,
+    )
+    try:
+        with open(fd, "w") as f:
+            for oid in oids:
+                f.write(f"{oid.hex()}\n")
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def open_dropped_cache(kw):
+    """Return the client cache ``ClientStorage(**kw)`` would open, cleared.
+
+    Clearing a persistent cache skips its verification against the server.
+    """
+    cache = open_cache(
+        kw.get("cache"),
+        kw.get("var"),
+        kw.get("client"),
+        kw.get("storage", "1"),
+        kw.get("cache_size", DEFAULT_CACHE_SIZE),
+    )
+    cache.clear()
+    return cache
+
+
+def prewarm_cache(storage, oids, batch_size=PREWARM_BATCH_SIZE):
+    """Load 'oids' into the client cache of 'storage', a ``ClientStorage``.
+
+    Waits for the storage to connect (and verify its cache), then
+    prefetches the OIDs which are not yet cached, a batch at a time, so
+    that the server is not flooded with requests.
+    """
+    server = storage._server
+    server.wait()
+
+    for i in range(0, len(oids), batch_size):
+        server.prefetch(oids[i:i + batch_size], maxtid).result()
+
+
+def _prewarm_cache_logged(storage, oids):
+    try:
+        prewarm_cache(storage, oids)
+    except Exception:
+        logger.exception("Prewarming the cache of %s failed", storage)
+    else:
+        logger.info("Prewarmed the cache of %s", storage)
+
+
+def warm_cache(storage, path, wait=False):
+    """Prewarm the cache of 'storage' from, and record it to, 'path'.
+
+    The OIDs recorded in 'path' (if it exists) are loaded into the client
+    cache, in a background thread unless 'wait' is true.  When 'storage'
+    is closed, the OIDs then in its cache are recorded in 'path' for the
+    next process to prewarm from.
+    """
+    oids = read_oids(path)
+    close = storage.close
+
+    def close_and_record():
+        close()
+        # Only read the cache's in-memory index once its I/O has stopped.
+        try:
+            write_oids(path, storage._cache.current)
+        except OSError:
+            logger.exception("Recording the cache of %s failed", storage)
+
+    storage.close = close_and_record
+
+    if wait:
+        prewarm_cache(storage, oids)
+    elif oids:
+        threading.Thread(
+            target=_prewarm_cache_logged,
+            args=(storage, oids),
+            name=f"{storage.__name__} zodburi cache prewarm thread",
+            daemon=True,
+        ).start()
+
+
+class Backoff:
+    """Exponential reconnection backoff with jitter.
+
+    The n-th delay is 'initial' * 2**n seconds, at most 'maximum', less a
+    random fraction of up to 'jitter' of it, so that clients disconnected
+    at once spread their reconnection attempts.  :meth:`reset` starts over.
+
+    ZEO's client computes the delay between connection attempts as its
+    ``disconnect_poll`` plus a random second:  passed as
+    ``disconnect_poll``, a backoff yields its next delay each time.
+    """
+    def __init__(self, initial, maximum=DEFAULT_RECONNECT_BACKOFF_MAX,
+                 jitter=DEFAULT_RECONNECT_JITTER, random=random.random):
+        self.initial = initial
+        self.maximum = maximum
+        self.jitter = jitter
+        self._random = random
+        self.attempts = 0
+
+    def delay(self):
+        """Return the next delay, in seconds."""
+        delay = min(self.initial * 2 ** self.attempts, self.maximum)
+        self.attempts += 1
+        return delay * (1 - self.jitter * self._random())
+
+    def reset(self):
+        self.attempts = 0
+
+    def __add__(self, other):
+        return self.delay() + other
+
+    __radd__ = __add__
+
+
+def _host_path(kind, addr, storage):
+    # A path in the temporary directory shared by this user's clients of
+    # 'storage' at 'addr' on this host.
+    digest = hashlib.sha256(repr((addr, storage)).encode()).hexdigest()
+    return os.path.join(
+        tempfile.gettempdir(),
+        f"zodburi-zeo-{kind}-{os.getuid()}-{digest[:16]}")
+
+
+def private_directory(path):
+    """Create the directory at 'path', accessible to this user only, if
+    missing, and return 'path'.
+
+    Raise :class:`InsecureDirectory` unless it is a directory, not a
+    symlink, owned by this user (or root) and writable by its owner only:
+    otherwise, other users could replace or plant the files in it.
+    """
+    try:
+        os.makedirs(path, 0o700, exist_ok=True)
+    except FileExistsError:  # not a directory
+        pass
+    st = os.lstat(path)
+    if not stat.S_ISDIR(st.st_mode):
+        raise InsecureDirectory(path, "not a directory")
+    if st.st_uid not in (os.getuid(), 0):
+        raise InsecureDirectory(path, "owned by another user")
+    if st.st_mode & 0o022:
+        raise InsecureDirectory(path, "writable by other users")
+    return path
+
+
+def _open_nofollow(path, flags):
+    return os.open(path, flags | os.O_NOFOLLOW, 0o600)
+
+
+def default_verify_lock(addr, storage="1"):
+    """Return the default path prefix of the verification lock files for
+    this user's clients of 'storage' at 'addr', in a private directory in
+    the temporary directory.
+    """
+    return os.path.join(_host_path("verify", addr, storage), "slot")
+
+
+def default_unix_socket(addr):
+    """Return the well-known path of the unix socket advertised to this
+    user's clients by the ZEO server listening on this host at 'addr', a
+    (host, port) tuple:  a socket, or a symlink to one, named after the
+    port in a directory of the user's in the temporary directory.
+    """
+    return os.path.join(
+        tempfile.gettempdir(), f"zodburi-zeo-{os.getuid()}",
+        f"{addr[1]}.sock")
+
+
+def _trusted_path(path):
+    # Whether only this user or root could have put what is at 'path' in
+    # place:  owned by either, in a directory owned by either and not
+    # writable by other users.
+    owners = (os.getuid(), 0)
+    directory = os.stat(os.path.dirname(path))
+    return (
+        os.lstat(path).st_uid in owners
+        and directory.st_uid in owners
+        and not directory.st_mode & stat.S_IWOTH
+    )
+
+
+def _trusted_unix_socket(path):
+    # Whether 'path' is a unix socket, or a chain of symlinks to one, which
+    # only this user or root could have put in place.
+    path = os.path.abspath(path)
+    for _ in range(MAX_UNIX_SOCKET_SYMLINKS):
+        if not _trusted_path(path):
+            logger.warning(
+                "Ignoring unix socket %s, which other users could have "
+                "put in place", path)
+            return False
+        mode = os.lstat(path).st_mode
+        if not stat.S_ISLNK(mode):
+            return stat.S_ISSOCK(mode)
+        path = os.path.join(os.path.dirname(path), os.readlink(path))
+    return False
+
+
+def is_local_host(host):
+    """Return whether 'host' names this host."""
+    if host in ("", "localhost") or host == socket.gethostname():
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+def unix_socket_available(path, timeout=UNIX_SOCKET_PROBE_TIMEOUT):
+    """Return whether a server accepts connections on the unix socket at
+    'path'.
+
+    The socket, and the symlinks leading to it if any, must be owned by
+    this user or root, in directories owned by either and not writable by
+    other users:  otherwise, another user could impersonate the server.
+    """
+    if not hasattr(socket, "AF_UNIX"):  # pragma: NO COVER Windows
+        return False
+    try:
+        if not _trusted_unix_socket(path):
+            return False
+        with socket.socket(socket.AF_UNIX) as sock:
+            sock.settimeout(timeout)
+            sock.connect(path)
+    except OSError:
+        return False
+    return True
+
+
+def prefer_unix_socket(addr, path):
+    """Return 'path' if a server accepts connections on the unix socket
+    there, and 'addr' otherwise.
+    """
+    if unix_socket_available(path):
+        logger.debug("Using unix socket %s rather than %s", path, addr)
+        return path
+    return addr
+
+
+class VerificationSlots:
+    """At most 'count' concurrent cache verifications among the clients,
+    on this host, sharing the lock files ``<path>.0`` to
+    ``<path>.<count - 1>``.
+
+    A slot is held as an exclusive ``flock`` on one of the files, which the
+    system releases if the process dies.  The directory of the files must
+    be private to the user (see :func:`private_directory`), and is created
+    if missing.  Unix only.
+    """
+    def __init__(self, path, count, poll=VERIFY_SLOT_POLL):
+        self.path = path
+        self.count = count
+        self.poll = poll
+
+    def try_acquire(self):
+        """Return a held slot, to :meth:`release`, or None if all are
+        taken.
+        """
+        import fcntl
+
+        private_directory(os.path.dirname(os.path.abspath(self.path)))
+        for i in range(self.count):
+            f = open(f"{self.path}.{i}", "a", opener=_open_nofollow)
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                f.close()
+            else:
+                return f
+        return None
+
+    async def acquire(self):
+        """Wait for a slot and return it."""
+        while True:
+            slot = self.try_acquire()
+            if slot is not None:
+                return slot
+            await asyncio.sleep(self.poll * (1 + random.random()))
+
+    def release(self, slot):
+        import fcntl
+
+        fcntl.flock(slot, fcntl.LOCK_UN)
+        slot.close()
+
+
+class ClientThread(ZEO.asyncio.client.ClientThread):
+    """A ZEO client thread (for ``ClientStorage``'s ``_client_factory``)
+    reconnecting after a :class:`Backoff`, and verifying its cache, when
+    not empty, in one of the :class:`VerificationSlots`.
+
+    If not None, 'address' is called for the address to connect to each
+    time the client reconnects, e.g. a partial :func:`prefer_unix_socket`.
+    """
+    def __init__(self, *args, backoff=None, slots=None, address=None,
+                 **kw):
+        self._backoff = backoff
+        self._slots = slots
+        self._address = address
+        if backoff is not None:
+            kw["disconnect_poll"] = backoff
+        super().__init__(*args, **kw)
+
+    def setup_delegation(self, loop):
+        super().setup_delegation(loop)
+        client = self.client
+        verify = client.verify
+
+        async def verify_in_slot(server_tid):
+            slot = None
+            if self._slots is not None and len(client.cache):
+                slot = await self._slots.acquire()
+            try:
+                await verify(server_tid)
+            finally:
+                if slot is not None:
+                    self._slots.release(slot)
+            if self._backoff is not None and client.ready:
+                self._backoff.reset()
+
+        client.verify = verify_in_slot
+
+        if self._address is not None:
+            try_connecting = client.try_connecting
+
+            def try_connecting_to_address():
+                client.addrs = [self._address()]
+                try_connecting()
+
+            client.try_connecting = try_connecting_to_address
+
+
+class HostCacheSize(int):
+    """A ``cache_size`` shared by the clients of a host, in bytes."""
+
+    def __str__(self):
+        return f"{HOST_CACHE_SIZE_PREFIX}{int(self)}"
+
+
+def convert_cache_size(value):
+    """Convert a ``cache_size`` query string argument:  a bytesize, or a
+    bytesize prefixed with ``host:`` for a :class:`HostCacheSize`.
+    """
+    if value.lower().startswith(HOST_CACHE_SIZE_PREFIX):
+        return HostCacheSize(
+            convert_bytesize(value[len(HOST_CACHE_SIZE_PREFIX):]))
+    return convert_bytesize(value)
+
+
+def default_cache_budget_dir(addr, storage="1"):
+    """Return the default directory in which this user's clients of
+    'storage' at 'addr' on this host share a :class:`HostCacheBudget`, in
+    the temporary directory.
+    """
+    return _host_path("cache-budget", addr, storage)
+
+
+class HostCacheBudget:
+    """A client cache budget of 'size' bytes, shared equally by the clients
+    which joined it in the directory at 'path', in any process of the host.
+
+    Each member holds an exclusive ``flock`` on its own file in the
+    directory, which the system releases if its process dies:  the files
+    of dead members are removed when members are counted.  The directory
+    must be private to the user (see :func:`private_directory`), and is
+    created if missing.  Unix only.
+    """
+    MEMBER_SUFFIX = ".member"
+
+    def __init__(self, size, path):
+        self.size = size
+        self.path = path
+
+    def join(self):
+        """Add a member and return it, to :meth:`leave`."""
+        import fcntl
+
+        private_directory(self.path)
+        fd, tmp_path = tempfile.mkstemp(
+            prefix=f"{os.getpid()}-", suffix=".tmp", dir=self.path)
+        member = os.fdopen(fd, "w")
+        fcntl.flock(member, fcntl.LOCK_EX)
+        # Only count it as a member once locked.
+        path = tmp_path[:-len(".tmp")] + self.MEMBER_SUFFIX
+        os.rename(tmp_path, path)
+        member.path = path
+        return member
+
+    def leave(self, member):
+        os.remove(member.path)
+        member.close()
+
+    def members(self):
+        """Return the number of live members, removing dead ones."""
+        import fcntl
+
+        count = 0
+        for name in os.listdir(self.path):
+            if not name.endswith(self.MEMBER_SUFFIX):
+                continue
+            path = os.path.join(self.path, name)
+            try:
+                f = open(path, opener=_open_nofollow)
+            except FileNotFoundError:  # removed since listed
+                continue
+            with f:
+                try:
+                    fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    count += 1
+                else:
+                    os.remove(path)
+        return count
+
+    def share(self):
+        """Return the share of the budget of each member."""
+        return self.size // max(self.members(), 1)
+
+
+def resize_cache(cache, size):
+    """Resize 'cache', a ZEO ``ClientCache``, to 'size' bytes, in place.
+
+    Growing the cache appends free space to its file.  Shrinking it
+    truncates its file, dropping the records beyond the new size, and
+    rescans the rest.
+    """
+    with cache._lock:
+        old_size = cache.maxsize
+        grow = size - old_size
+        remainder = grow % max_block_size
+        if 0 < remainder < 5:  # too small for a free block
+            grow -= remainder
+        if grow == 0:
+            return
+
+        f = cache.f
+        if grow > 0:
+            f.seek(old_size + grow - 1)
+            f.write(b"x")
+            f.seek(old_size)
+            for i in range(0, grow, max_block_size):
+                block_size = min(max_block_size, grow - i)
+                f.write(b"f" + block_size.to_bytes(4, "big"))
+                f.seek(block_size - 5, 1)
+            f.flush()
+            cache.maxsize = old_size + grow
+        else:
+            cache.maxsize = size
+            f.seek(0, os.SEEK_END)
+            cache._initfile(f.tell())
+        cache.rearrange = cache.rearrange * cache.maxsize / old_size
+
+    logger.info(
+        "Resized client cache %s from %d to %d bytes",
+        cache.path, old_size, cache.maxsize)
+
+
+def share_cache_budget(storage, budget, member,
+                       interval=DEFAULT_CACHE_BUDGET_INTERVAL):
+    """Keep the client cache of 'storage', a ``ClientStorage`` which joined
+    'budget' as 'member', sized to its share of the budget.
+
+    A daemon thread resizes the cache every 'interval' seconds, as members
+    join and leave, until the storage is closed, which leaves the budget.
+    """
+    stopped = threading.Event()
+    close = storage.close
+
+    def rebalance():
+        while not stopped.wait(interval):
+            try:
+                size = budget.share()
+                if size != storage._cache.maxsize:
+                    resize_cache(storage._cache, size)
+            except Exception:
+                logger.exception(
+                    "Resizing the cache of %s failed", storage)
+
+    def close_and_leave():
+        stopped.set()
+        thread.join()
+        try:
+            close()
+        finally:
+            budget.leave(member)
+
+    storage.close = close_and_leave
+    thread = threading.Thread(
+        target=rebalance,
+        name=f"{storage.__name__} zodburi cache budget thread",
+        daemon=True,
+    )
+    thread.start()